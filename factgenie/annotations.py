@@ -30,6 +30,24 @@ class OutputAnnotationsNoReason(BaseModel):
     annotations: List[SpanAnnotationNoReason] = Field(description="The list of annotations.")
 
 
+class OutputIdxAnnotations(BaseModel):
+    output_idx: int = Field(description="Index of the annotated output.")
+    annotations: List[SpanAnnotation] = Field(description="The list of annotations for the output.")
+
+
+class OutputIdxAnnotationsNoReason(BaseModel):
+    output_idx: int = Field(description="Index of the annotated output.")
+    annotations: List[SpanAnnotationNoReason] = Field(description="The list of annotations for the output.")
+
+
+class MultiOutputAnnotations(BaseModel):
+    outputs: List[OutputIdxAnnotations] = Field(description="The list of annotations for each output.")
+
+
+class MultiOutputAnnotationsNoReason(BaseModel):
+    outputs: List[OutputIdxAnnotationsNoReason] = Field(description="The list of annotations for each output.")
+
+
 class AnnotationModelFactory:
     """Factory for creating appropriate annotation output models based on configuration."""
 
@@ -66,3 +84,20 @@ class AnnotationModelFactory:
             return SpanAnnotation
         else:
             return SpanAnnotationNoReason
+
+    @staticmethod
+    def get_multi_output_model(with_reason: bool = True) -> Type[BaseModel]:
+        """
+        Returns the appropriate model for annotating multiple outputs in a single response.
+
+        Args:
+            with_reason: If True, returns MultiOutputAnnotations with reasons.
+                         If False, returns MultiOutputAnnotationsNoReason.
+
+        Returns:
+            The appropriate Pydantic model class.
+        """
+        if with_reason:
+            return MultiOutputAnnotations
+        else:
+            return MultiOutputAnnotationsNoReason
@@ -2,7 +2,10 @@ import json
 import logging
 import os
 import random
+import threading
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -40,20 +43,125 @@ class ModelAPI:
                 f"Required API variables not found for the model {model_service}. Please add the following keys to the system environment or factgenie config: {response['missing_keys']}"
             )
 
-    def call_model_once(self, messages, model_service, prompt_strat_kwargs):
+    def call_model_once(self, messages, model_service, prompt_strat_kwargs, api_base=None):
         import litellm
 
         response = litellm.completion(
             model=model_service,
             messages=messages,
-            api_base=self._api_url(),
+            api_base=api_base or self._api_url(),
             **prompt_strat_kwargs,  # E.g. structured output format.
             **self.api_kwargs,  # E.g. credentials.
             **self.config.get("model_args", {}),  # E.g. temperature, max_tokens, etc.
         )
         return response
 
-    def get_model_response_with_retries(self, messages, prompt_strat_kwargs={}):
+    def iter_stream_deltas(self, messages, model_service, prompt_strat_kwargs, api_base=None):
+        """
+        Call the model in the streaming mode and yield the generated text chunks.
+
+        Yields pairs (text, usage), where `usage` is None except for the last chunk of a completed stream.
+        """
+        import litellm
+
+        response = litellm.completion(
+            model=model_service,
+            messages=messages,
+            api_base=api_base or self._api_url(),
+            stream=True,
+            # the token usage is sent in the last chunk
+            stream_options={"include_usage": True},
+            **prompt_strat_kwargs,
+            **self.api_kwargs,
+            **self.config.get("model_args", {}),
+        )
+
+        try:
+            for chunk in response:
+                text = (chunk.choices[0].delta.content or "") if chunk.choices else ""
+                yield text, getattr(chunk, "usage", None)
+        finally:
+            # closing the underlying stream aborts the request if we stopped reading early
+            completion_stream = getattr(response, "completion_stream", None)
+
+            if hasattr(completion_stream, "close"):
+                completion_stream.close()
+
+    def stream_model_once(self, messages, model_service, prompt_strat_kwargs, stop_sequences=(), on_progress=None):
+        """
+        Consume the model response incrementally and abort the request as soon as any of `stop_sequences` appears.
+
+        The content is cut at the start of the earliest stop sequence, as the non-streamed responses are cut in `PromptingStrategy.postprocess_output()`.
+
+        Returns:
+            A dictionary: {
+                "content": the generated text,
+                "ttft": time to the first token in seconds,
+                "stopped_early": whether the generation was aborted at a stop sequence,
+                "usage": the token usage (None if the generation was aborted or the usage was not reported)
+            }
+        """
+        progress_interval = 1.0  # seconds
+        stop_sequences = [seq for seq in stop_sequences if seq]
+        max_stop_len = max((len(seq) for seq in stop_sequences), default=0)
+
+        start = time.time()
+        last_progress = start
+        ttft = None
+        content = ""
+        stopped_early = False
+        usage = None
+
+        stream = self.iter_stream_deltas(messages, model_service, prompt_strat_kwargs)
+
+        try:
+            for delta, chunk_usage in stream:
+                if chunk_usage is not None:
+                    usage = chunk_usage
+
+                if not delta:
+                    continue
+
+                now = time.time()
+
+                if ttft is None:
+                    ttft = now - start
+
+                    if on_progress:
+                        on_progress({"event": "first_token", "ttft": ttft})
+
+                # only the newly generated text (plus the overlap for sequences split across chunks) is searched
+                search_from = max(0, len(content) - max_stop_len + 1)
+                content += delta
+
+                stop_starts = []
+                for seq in stop_sequences:
+                    pos = content.find(seq, search_from)
+                    if pos != -1:
+                        stop_starts.append(pos)
+
+                if stop_starts:
+                    content = content[: min(stop_starts)]
+                    stopped_early = True
+                    break
+
+                if on_progress and now - last_progress >= progress_interval:
+                    last_progress = now
+                    on_progress({"event": "partial", "ttft": ttft, "chars": len(content), "elapsed": now - start})
+        finally:
+            stream.close()
+
+        if stopped_early:
+            logger.info(f"Stop sequence detected, aborted the generation after {len(content)} characters.")
+
+        if on_progress:
+            on_progress({"event": "done", "ttft": ttft, "chars": len(content), "elapsed": time.time() - start})
+
+        return {"content": content, "ttft": ttft, "stopped_early": stopped_early, "usage": usage}
+
+    def get_model_response_with_retries(
+        self, messages, prompt_strat_kwargs={}, stream=False, stop_sequences=(), on_progress=None
+    ):
         import litellm
 
         """Handle rate limits and overload errors with exponential backoff and retry logic."""
@@ -66,6 +174,15 @@ class ModelAPI:
 
         for attempt in range(max_retries):
             try:
+                if stream:
+                    return self.stream_model_once(
+                        messages,
+                        model_service,
+                        prompt_strat_kwargs=prompt_strat_kwargs,
+                        stop_sequences=stop_sequences,
+                        on_progress=on_progress,
+                    )
+
                 response = self.call_model_once(messages, model_service, prompt_strat_kwargs=prompt_strat_kwargs)
                 return response
 
@@ -107,6 +224,283 @@ class ModelAPI:
         )
 
 
+class EndpointPool:
+    """
+    Load balancing of requests between multiple replicas of a locally hosted model.
+
+    Each request is routed to the healthy endpoint with the lowest number of outstanding requests. An endpoint that fails is ejected from the pool for `cooldown` seconds and returns only after passing a health check. Optionally, a request that takes longer than the `hedge_percentile` of the recent latencies is re-issued to another endpoint and the first response is used.
+    """
+
+    # pools are shared by all the models in the process calling the same endpoints
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    min_latency_samples = 20
+    # threads for the hedged requests, shared by all the concurrent callers (each request occupies a thread until it finishes)
+    hedge_threads = 64
+
+    def __init__(self, urls, health_path, cooldown=30, hedge_percentile=None, health_timeout=2):
+        self.urls = urls
+        self.health_path = health_path
+        self.cooldown = cooldown
+        self.hedge_percentile = hedge_percentile
+        self.health_timeout = health_timeout
+
+        self.lock = threading.Lock()
+        self.outstanding = {url: 0 for url in urls}
+        self.ejected_until = {url: 0.0 for url in urls}
+        self.latencies = deque(maxlen=200)
+        self.hedge_executor = ThreadPoolExecutor(max_workers=self.hedge_threads) if hedge_percentile else None
+
+        for url in urls:
+            if not self.is_healthy(url):
+                self.eject(url)
+
+    @classmethod
+    def get(cls, urls, health_path, **kwargs):
+        key = (tuple(urls), health_path)
+
+        with cls._pools_lock:
+            if key not in cls._pools:
+                cls._pools[key] = cls(urls, health_path, **kwargs)
+
+            return cls._pools[key]
+
+    def is_healthy(self, url):
+        import requests
+
+        try:
+            response = requests.get(url.rstrip("/") + self.health_path, timeout=self.health_timeout)
+            return response.ok
+        except requests.exceptions.RequestException:
+            return False
+
+    def eject(self, url):
+        with self.lock:
+            self.ejected_until[url] = time.time() + self.cooldown
+
+        logger.warning(f"Endpoint {url} ejected from the pool for {self.cooldown} seconds.")
+
+    def acquire(self, exclude=()):
+        """Select the endpoint for the next request and count it as outstanding."""
+        now = time.time()
+
+        # ejected endpoints return to the pool after the cooldown if they pass the health check
+        with self.lock:
+            to_check = [url for url in self.urls if 0 < self.ejected_until[url] <= now and url not in exclude]
+
+            # the other threads keep skipping the endpoint while it is being checked
+            for url in to_check:
+                self.ejected_until[url] = now + self.cooldown
+
+        for url in to_check:
+            if self.is_healthy(url):
+                logger.info(f"Endpoint {url} returned to the pool.")
+                with self.lock:
+                    self.ejected_until[url] = 0.0
+
+        with self.lock:
+            candidates = [url for url in self.urls if url not in exclude and self.ejected_until[url] <= now]
+
+            # all the endpoints are failing, try the one which is ejected for the shortest time
+            if not candidates:
+                candidates = [min(self.urls, key=lambda url: self.ejected_until[url])]
+
+            least_outstanding = min(self.outstanding[url] for url in candidates)
+            url = random.choice([url for url in candidates if self.outstanding[url] == least_outstanding])
+            self.outstanding[url] += 1
+
+        return url
+
+    def release(self, url, latency=None):
+        with self.lock:
+            self.outstanding[url] -= 1
+
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def get_hedge_delay(self):
+        """The latency after which the request is re-issued to another endpoint, None if hedging is not used."""
+        if not self.hedge_percentile or len(self.urls) < 2 or len(self.latencies) < self.min_latency_samples:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))]
+
+    def call_endpoint(self, url, call):
+        start = time.time()
+
+        try:
+            response = call(url)
+        except Exception as e:
+            self.release(url)
+
+            if is_endpoint_failure(e):
+                self.eject(url)
+            raise e
+
+        self.release(url, latency=time.time() - start)
+        return response
+
+    def call(self, call):
+        """
+        Call `call(api_base)` with the selected endpoint, failing over to the other endpoints if the endpoint fails.
+        """
+        failed = []
+
+        while True:
+            try:
+                return self.call_hedged(call, exclude=failed)
+            except Exception as e:
+                if not is_endpoint_failure(e) or len(failed) + 1 >= len(self.urls):
+                    raise e
+
+                failed.append(e.endpoint_url)
+                logger.warning(f"Endpoint {e.endpoint_url} failed, retrying with another endpoint: {str(e)}")
+
+    def call_hedged(self, call, exclude=()):
+        def tagged_call(url):
+            try:
+                return call(url)
+            except Exception as e:
+                # remember which endpoint failed for the failover
+                e.endpoint_url = url
+                raise e
+
+        hedge_delay = self.get_hedge_delay()
+        url = self.acquire(exclude=exclude)
+
+        if hedge_delay is None:
+            return self.call_endpoint(url, tagged_call)
+
+        started = threading.Event()
+
+        def primary_call(url):
+            started.set()
+            return self.call_endpoint(url, tagged_call)
+
+        primary = self.hedge_executor.submit(primary_call, url)
+
+        # the hedge delay is counted from the start of the request, not including the time waiting for a thread
+        started.wait()
+        done, _ = wait([primary], timeout=hedge_delay)
+
+        if done:
+            return primary.result()
+
+        logger.info(f"No response after {hedge_delay:.2f} seconds, sending a hedged request to another endpoint.")
+        hedged = self.hedge_executor.submit(self.call_endpoint, self.acquire(exclude=[*exclude, url]), tagged_call)
+
+        # the first successful response wins, the slower request finishes in the background
+        pending = {primary, hedged}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            # both requests may finish at once
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+
+        # both requests failed
+        return primary.result()
+
+
+def is_endpoint_failure(e):
+    """Whether the exception signals a problem with the endpoint (as opposed to a problem with the request)."""
+    import litellm
+    import requests
+
+    return isinstance(
+        e,
+        (
+            litellm.exceptions.APIConnectionError,
+            litellm.exceptions.Timeout,
+            litellm.exceptions.InternalServerError,
+            litellm.exceptions.ServiceUnavailableError,
+            requests.exceptions.ConnectionError,
+            ConnectionError,
+        ),
+    )
+
+
+def parse_api_urls(api_url):
+    """The API URL can be a single URL, a list of URLs or a comma-separated string of URLs."""
+    if not api_url:
+        return []
+
+    if isinstance(api_url, str):
+        api_url = api_url.split(",")
+
+    return [url.strip().rstrip("/") for url in api_url if url.strip()]
+
+
+class MultiEndpointAPI(ModelAPI):
+    """
+    Locally hosted models which can be served by multiple replicas.
+
+    The `api_url` can be a list of URLs (or a comma-separated string), the requests are then balanced between the endpoints by `EndpointPool`. The pool is configured with `endpoint_cooldown` and `hedge_percentile` in `extra_args`.
+    """
+
+    # path appended to the API URL for checking the health of the endpoint
+    health_path = None
+
+    def __init__(self, config, api_kwargs: dict = {}):
+        super().__init__(config, api_kwargs)
+
+        urls = [self.validate_api_url(url) for url in parse_api_urls(config.get("api_url"))]
+        self.endpoint_pool = None
+
+        if len(urls) > 1:
+            extra_args = config.get("extra_args") or {}
+            hedge_percentile = extra_args.get("hedge_percentile")
+
+            self.endpoint_pool = EndpointPool.get(
+                urls,
+                self.health_path,
+                cooldown=float(extra_args.get("endpoint_cooldown", 30)),
+                hedge_percentile=float(hedge_percentile) if hedge_percentile else None,
+            )
+
+    def validate_api_url(self, api_url):
+        return api_url
+
+    def call_model_once(self, messages, model_service, prompt_strat_kwargs, api_base=None):
+        if self.endpoint_pool is None or api_base:
+            return super().call_model_once(messages, model_service, prompt_strat_kwargs, api_base=api_base)
+
+        return self.endpoint_pool.call(
+            lambda url: ModelAPI.call_model_once(self, messages, model_service, prompt_strat_kwargs, api_base=url)
+        )
+
+    def iter_stream_deltas(self, messages, model_service, prompt_strat_kwargs, api_base=None):
+        if self.endpoint_pool is None or api_base:
+            yield from super().iter_stream_deltas(messages, model_service, prompt_strat_kwargs, api_base=api_base)
+            return
+
+        # streamed requests are not hedged, the endpoint is only released after the stream is consumed
+        url = self.endpoint_pool.acquire()
+        start = time.time()
+        failed = False
+
+        try:
+            yield from super().iter_stream_deltas(messages, model_service, prompt_strat_kwargs, api_base=url)
+        except Exception as e:
+            failed = True
+
+            if is_endpoint_failure(e):
+                self.endpoint_pool.eject(url)
+            raise e
+        finally:
+            # also reached when the stream is closed early at a stop sequence
+            self.endpoint_pool.release(url, latency=None if failed else time.time() - start)
+
+    def _api_url(self):
+        # local server URL
+        urls = parse_api_urls(self.config.get("api_url"))
+
+        return self.validate_api_url(urls[0]) if urls else None
+
+
 class OpenAIAPI(ModelAPI):
     # https://docs.litellm.ai/docs/providers/openai
     def __init__(self, config, api_kwargs: dict = {}):
@@ -117,8 +511,10 @@ class OpenAIAPI(ModelAPI):
         return ""
 
 
-class OllamaAPI(ModelAPI):
+class OllamaAPI(MultiEndpointAPI):
     # https://docs.litellm.ai/docs/providers/ollama
+    health_path = "/api/tags"
+
     def __init__(self, config, api_kwargs: dict = {}):
         super().__init__(config, api_kwargs)
 
@@ -126,9 +522,7 @@ class OllamaAPI(ModelAPI):
         # we want to call the `chat` endpoint: https://docs.litellm.ai/docs/providers/ollama#using-ollama-apichat
         return "ollama_chat/"
 
-    def _api_url(self):
-        # local server URL
-        api_url = self.config.get("api_url", None)
+    def validate_api_url(self, api_url):
         api_url = api_url.rstrip("/")
 
         if api_url.endswith("/generate") or api_url.endswith("/chat") or api_url.endswith("/api"):
@@ -141,18 +535,17 @@ class OllamaAPI(ModelAPI):
         pass
 
 
-class VllmAPI(ModelAPI):
+class VllmAPI(MultiEndpointAPI):
     # https://docs.litellm.ai/docs/providers/vllm
+    # the API URL of the OpenAI-compatible server ends with /v1
+    health_path = "/models"
+
     def __init__(self, config, api_kwargs: dict = {}):
         super().__init__(config, api_kwargs)
 
     def _service_prefix(self):
         return "hosted_vllm/"
 
-    def _api_url(self):
-        # local server URL
-        return self.config.get("api_url", None)
-
 
 class AnthropicAPI(ModelAPI):
     # https://docs.litellm.ai/docs/providers/anthropic
@@ -196,3 +589,246 @@ class VertexAIAPI(ModelAPI):
 
     def _service_prefix(self):
         return "vertex_ai/"
+
+
+class MockAPI(ModelAPI):
+    """
+    Model served locally without any network requests, meant for benchmarking the campaigns and reproducing incidents offline.
+
+    The behavior is configured in `extra_args`:
+        - `mock_replay`: ID of a campaign or a path to a JSONL file (or a directory with JSONL files) with the recorded outputs. The responses are looked up by the prompt; the prompts which were not recorded get a synthetic response.
+        - `mock_annotations`: maximum number of synthetic annotations per output (default: 3).
+        - `mock_latency`: median latency of a response in seconds (default: 0). The latency is log-normally distributed with `mock_latency_sigma` (default: 0, i.e. constant).
+        - `mock_error_rate`: probability of a failed request (a non-retryable server error).
+        - `mock_rate_limit_rate`: probability of a rate limit error.
+        - `mock_rate_limit_rpm`: maximum number of requests per minute, the requests above the limit get a rate limit error.
+        - `mock_seed`: seed for the random generator. The randomness only depends on the seed, the prompt and the number of previous requests with the same prompt, so that the runs are reproducible regardless of the order of the requests.
+    """
+
+    # request timestamps for `mock_rate_limit_rpm`, shared by all the instances with the same model name
+    request_times = {}
+    request_times_lock = threading.Lock()
+
+    def __init__(self, config, api_kwargs: dict = {}):
+        super().__init__(config, api_kwargs)
+
+        extra_args = config.get("extra_args") or {}
+
+        self.max_annotations = int(extra_args.get("mock_annotations", 3))
+        self.latency = float(extra_args.get("mock_latency", 0))
+        self.latency_sigma = float(extra_args.get("mock_latency_sigma", 0))
+        self.error_rate = float(extra_args.get("mock_error_rate", 0))
+        self.rate_limit_rate = float(extra_args.get("mock_rate_limit_rate", 0))
+        self.rate_limit_rpm = extra_args.get("mock_rate_limit_rpm")
+        self.seed = extra_args.get("mock_seed", 0)
+        # same as in `AnnotationsStrategy`
+        self.with_reason = extra_args.get("with_reason") != False
+        self.annotation_categories = len(config.get("annotation_span_categories") or []) or 1
+
+        self.replay = self.load_replay(extra_args["mock_replay"]) if extra_args.get("mock_replay") else {}
+        # number of requests per prompt
+        self.request_counts = {}
+        self.lock = threading.Lock()
+
+    def validate_environment(self):
+        pass
+
+    def _service_prefix(self):
+        return "mock/"
+
+    def load_replay(self, source):
+        """Load the recorded outputs from the campaign files, indexed by the prompt."""
+        from factgenie import CAMPAIGN_DIR
+
+        if not os.path.exists(source):
+            source = os.path.join(CAMPAIGN_DIR, source, "files")
+
+        if os.path.isdir(source):
+            files = sorted(os.path.join(source, f) for f in os.listdir(source) if f.endswith(".jsonl"))
+        elif os.path.exists(source):
+            files = [source]
+        else:
+            raise ValueError(f"Replay source {source} not found.")
+
+        replay = {}
+
+        for file in files:
+            with open(file) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+
+                    record = json.loads(line)
+                    prompt = record.get("metadata", {}).get("prompt")
+
+                    if prompt is not None:
+                        replay.setdefault(prompt, []).append(record)
+
+        logger.info(f"Loaded recorded responses for {len(replay)} prompts.")
+        return replay
+
+    def get_prompt(self, messages):
+        content = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+
+        # cacheable messages are split into content blocks
+        if isinstance(content, list):
+            content = "".join(block.get("text", "") for block in content)
+
+        return content
+
+    def get_rng(self, prompt):
+        with self.lock:
+            cnt = self.request_counts.get(prompt, 0)
+            self.request_counts[prompt] = cnt + 1
+
+        return random.Random(f"{self.seed}-{cnt}-{prompt}")
+
+    def check_rate_limit(self):
+        import litellm
+
+        if not self.rate_limit_rpm:
+            return
+
+        now = time.time()
+
+        with MockAPI.request_times_lock:
+            times = MockAPI.request_times.setdefault(self.config["model"], deque())
+
+            while times and times[0] < now - 60:
+                times.popleft()
+
+            if len(times) >= int(self.rate_limit_rpm):
+                raise litellm.RateLimitError(
+                    message="Mock rate limit exceeded.", llm_provider="mock", model=self.config["model"]
+                )
+
+            times.append(now)
+
+    def simulate_request(self, rng):
+        """Sleep for the simulated latency and raise the simulated errors."""
+        import litellm
+
+        self.check_rate_limit()
+
+        if self.latency:
+            time.sleep(self.latency * (rng.lognormvariate(0, self.latency_sigma) if self.latency_sigma else 1))
+
+        if rng.random() < self.rate_limit_rate:
+            raise litellm.RateLimitError(
+                message="Mock rate limit exceeded.", llm_provider="mock", model=self.config["model"]
+            )
+
+        if rng.random() < self.error_rate:
+            raise litellm.InternalServerError(
+                message="Mock server error.", llm_provider="mock", model=self.config["model"]
+            )
+
+    def get_replayed_response(self, prompt, response_format):
+        records = self.replay.get(prompt)
+
+        if not records:
+            return None
+
+        if response_format is None:
+            return records[0]["output"] if "annotations" not in records[0] else self.format_annotations(records[0])
+
+        if "outputs" in response_format.model_fields:
+            # the outputs annotated with a single request share the prompt
+            outputs = [
+                {"output_idx": i, **json.loads(self.format_annotations(record))} for i, record in enumerate(records)
+            ]
+            return json.dumps({"outputs": outputs})
+
+        return self.format_annotations(records[0])
+
+    def format_annotations(self, record):
+        annotations = [
+            {"reason": a.get("reason", ""), "text": a["text"], "annotation_type": a["type"]}
+            for a in record.get("annotations", [])
+        ]
+        return json.dumps({"annotations": annotations})
+
+    def get_synthetic_annotations(self, rng, text):
+        # skipping the serialized data in the prompt
+        words = [word for word in text.split() if not any(c in word for c in '{}[]"')]
+        annotations = []
+
+        for _ in range(rng.randint(0, self.max_annotations) if words else 0):
+            start = rng.randrange(len(words))
+            annotation = {
+                "text": " ".join(words[start : start + rng.randint(1, 3)]),
+                "annotation_type": rng.randrange(self.annotation_categories),
+            }
+            if self.with_reason:
+                annotation["reason"] = "Synthetic annotation."
+
+            annotations.append(annotation)
+
+        return annotations
+
+    def get_synthetic_response(self, rng, prompt, response_format):
+        if response_format is None and not self.config.get("annotation_span_categories"):
+            # generation: a random sequence of the words from the prompt
+            words = prompt.split() or ["mock"]
+            return " ".join(rng.choice(words) for _ in range(rng.randint(10, 50)))
+
+        if response_format is not None and "outputs" in response_format.model_fields:
+            # the outputs are formatted by `MultiOutputStrategy.format_outputs()`
+            texts = [block.split("\n", 1)[-1] for block in prompt.split("[OUTPUT ")[1:]] or [prompt]
+            outputs = [
+                {"output_idx": i, "annotations": self.get_synthetic_annotations(rng, text)}
+                for i, text in enumerate(texts)
+            ]
+            return json.dumps({"outputs": outputs})
+
+        return json.dumps({"annotations": self.get_synthetic_annotations(rng, prompt)})
+
+    def get_response_content(self, messages, prompt_strat_kwargs):
+        prompt = self.get_prompt(messages)
+        rng = self.get_rng(prompt)
+
+        self.simulate_request(rng)
+
+        response_format = prompt_strat_kwargs.get("response_format")
+        content = self.get_replayed_response(prompt, response_format)
+
+        if content is None:
+            content = self.get_synthetic_response(rng, prompt, response_format)
+
+        return prompt, content
+
+    def call_model_once(self, messages, model_service, prompt_strat_kwargs, api_base=None):
+        import litellm
+
+        prompt, content = self.get_response_content(messages, prompt_strat_kwargs)
+
+        return litellm.ModelResponse(
+            model=model_service,
+            choices=[
+                litellm.Choices(
+                    index=0, finish_reason="stop", message=litellm.Message(role="assistant", content=content)
+                )
+            ],
+            usage=self.get_usage(prompt, content),
+        )
+
+    def get_usage(self, prompt, content):
+        import litellm
+
+        # approximate number of tokens
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+
+        return litellm.Usage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+    def iter_stream_deltas(self, messages, model_service, prompt_strat_kwargs, api_base=None):
+        prompt, content = self.get_response_content(messages, prompt_strat_kwargs)
+
+        # chunks of the size of a few tokens
+        for i in range(0, len(content), 16):
+            yield content[i : i + 16], None
+
+        yield "", self.get_usage(prompt, content)
@@ -4,7 +4,6 @@ import json
 import logging
 import os
 import shutil
-import threading
 import traceback
 import urllib.parse
 
@@ -27,8 +26,9 @@ import factgenie.crowdsourcing as crowdsourcing
 import factgenie.llm_campaign as llm_campaign
 import factgenie.utils as utils
 import factgenie.workflows as workflows
-from factgenie import CAMPAIGN_DIR, INPUT_DIR, PACKAGE_DIR, STATIC_DIR, TEMPLATES_DIR
+from factgenie import CAMPAIGN_DIR, INPUT_DIR, STATIC_DIR, TEMPLATES_DIR
 from factgenie.campaign import CampaignMode, CampaignStatus, ExampleStatus
+from factgenie.estimate import estimate_llm_campaign, format_estimate
 from factgenie.models import ModelFactory
 
 app = Flask("factgenie", template_folder=TEMPLATES_DIR, static_folder=STATIC_DIR)
@@ -37,7 +37,7 @@ app.db["annotation_index"] = None
 app.db["annotation_index_cache"] = {}
 app.db["output_index"] = None
 app.db["output_index_cache"] = {}
-app.db["lock"] = threading.Lock()
+app.db["locks"] = utils.LockManager()
 app.db["running_campaigns"] = set()
 app.db["announcers"] = {}
 app.wsgi_app = ProxyFix(app.wsgi_app, x_host=1)
@@ -174,8 +174,6 @@ def analyze_detail(campaign_id):
 
 @app.route("/annotate/<campaign_id>", methods=["GET", "POST"])
 def annotate(campaign_id):
-    workflows.refresh_indexes(app)
-
     # only for preview purposes, batch index is otherwise randomly generated
     batch_idx = request.args.get("batch_idx", None)
     campaign = workflows.load_campaign(app, campaign_id=campaign_id)
@@ -193,9 +191,11 @@ def annotate(campaign_id):
             host_prefix=app.config["host_prefix"],
         )
 
+    crowdsourcing.add_batch_payloads(app, campaign, annotation_set)
+
     return utils.render_from_folder(
         f"annotate.html",
-        custom_folder=f"{PACKAGE_DIR}/campaigns/{campaign.campaign_id}/pages",
+        custom_folder=f"{CAMPAIGN_DIR}/{campaign.campaign_id}/pages",
         host_prefix=app.config["host_prefix"],
         annotation_set=annotation_set,
         annotator_id=service_ids["annotator_id"],
@@ -386,8 +386,9 @@ def delete_model_outputs():
     split = data.get("split")
     setup_id = data.get("setup_id")
 
-    dataset = app.db["datasets_obj"][dataset_id]
-    workflows.delete_model_outputs(dataset, split, setup_id)
+    workflows.delete_model_outputs(dataset_id, split, setup_id)
+    # the cached annotation pages are invalidated by the new version of the index
+    workflows.get_output_index(app, force_reload=True)
 
     return utils.success()
 
@@ -453,7 +454,12 @@ def render_example():
     try:
         example_data = workflows.get_example_data(app, dataset_id, split, example_idx, setup_id)
 
-        return jsonify(example_data)
+        # the browser revalidates the cached response with If-None-Match and gets 304 if the example data did not change
+        response = jsonify(example_data)
+        response.add_etag()
+        response.cache_control.no_cache = True
+
+        return response.make_conditional(request)
     except Exception as e:
         traceback.print_exc()
         logger.error(f"Error while getting example data: {e}")
@@ -493,6 +499,13 @@ def download_file(filename):
     return send_from_directory(INPUT_DIR, filename)
 
 
+@app.route("/lock_metrics", methods=["GET"])
+@login_required
+def lock_metrics():
+    # wait and hold times of the campaign locks
+    return jsonify(app.db["locks"].get_metrics())
+
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
@@ -557,6 +570,33 @@ def llm_campaign_create():
     return utils.success()
 
 
+@app.route("/llm_eval/estimate", methods=["POST"])
+@app.route("/llm_gen/estimate", methods=["POST"])
+@login_required
+def llm_campaign_estimate():
+    mode = utils.get_mode_from_path(request.path)
+    data = request.get_json()
+
+    campaign_data = data.get("campaignData")
+    config = data.get("config")
+    workers = int(data.get("workers") or 1)
+
+    if mode == CampaignMode.LLM_EVAL:
+        config = llm_campaign.parse_llm_eval_config(config)
+    elif mode == CampaignMode.LLM_GEN:
+        config = llm_campaign.parse_llm_gen_config(config)
+
+    datasets = app.db["datasets_obj"]
+
+    try:
+        estimate = estimate_llm_campaign(app, mode, config, campaign_data, datasets, workers=workers)
+    except Exception as e:
+        traceback.print_exc()
+        return utils.error(f"Error while estimating campaign: {e}")
+
+    return jsonify(success=True, estimate=estimate, message=format_estimate(estimate))
+
+
 @app.route("/llm_eval/detail/<campaign_id>", methods=["GET", "POST"])
 @app.route("/llm_gen/detail/<campaign_id>", methods=["GET", "POST"])
 @login_required
@@ -566,7 +606,7 @@ def llm_campaign_detail(campaign_id):
     mode = utils.get_mode_from_path(request.path)
     campaign = workflows.load_campaign(app, campaign_id=campaign_id)
 
-    if campaign.metadata["status"] == CampaignStatus.RUNNING and not app.db["announcers"].get(campaign_id):
+    if campaign.metadata["status"] == CampaignStatus.RUNNING and campaign_id not in app.db["running_campaigns"]:
         campaign.metadata["status"] = CampaignStatus.IDLE
         campaign.update_metadata()
 
@@ -629,7 +669,7 @@ def llm_campaign_run():
     data = request.get_json()
     campaign_id = data.get("campaignId")
 
-    app.db["announcers"][campaign_id] = announcer = utils.MessageAnnouncer()
+    announcer = utils.get_progress_channel(app, campaign_id)
     app.db["running_campaigns"].add(campaign_id)
 
     try:
@@ -653,6 +693,24 @@ def llm_campaign_run():
     except Exception as e:
         traceback.print_exc()
         return utils.error(f"Error while running campaign: {e}")
+    finally:
+        # end the streams of the connected clients
+        announcer.close()
+
+
+@app.route("/llm_eval/retry_failed", methods=["POST"])
+@app.route("/llm_gen/retry_failed", methods=["POST"])
+@login_required
+def llm_campaign_retry_failed():
+    data = request.get_json()
+    campaign_id = data.get("campaignId")
+
+    if campaign_id in app.db["running_campaigns"]:
+        return utils.error("The campaign is running, pause it before retrying the failed examples")
+
+    failed_cnt = llm_campaign.retry_failed_examples(app, campaign_id)
+
+    return jsonify(success=True, failed=failed_cnt)
 
 
 @app.route("/llm_campaign/update_metadata", methods=["POST"])
@@ -674,16 +732,10 @@ def llm_campaign_update_config():
 @app.route("/llm_campaign/progress/<campaign_id>", methods=["GET", "POST"])
 @login_required
 def listen(campaign_id):
-    if not app.db["announcers"].get(campaign_id):
-        return Response(status=404)
-
-    def stream():
-        messages = app.db["announcers"][campaign_id].listen()
-        while True:
-            msg = messages.get()
-            yield msg
+    # the client can connect before the campaign is started
+    channel = utils.get_progress_channel(app, campaign_id)
 
-    return Response(stream(), mimetype="text/event-stream")
+    return Response(channel.listen(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @app.route("/llm_campaign/pause", methods=["POST"])
@@ -0,0 +1,238 @@
+"""Command line interface for the performance benchmarks."""
+
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import sys
+from pathlib import Path
+
+import click
+from flask import current_app as app
+from tabulate import tabulate
+
+from factgenie.benchmark.loadtest import run_loadtest
+from factgenie.benchmark.scenarios import SCENARIOS, run_scenarios
+from factgenie.benchmark.synthetic import (
+    cleanup_synthetic_data,
+    generate_synthetic_data,
+    temporary_data_dirs,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_git_commit():
+    """Return the current commit of the factgenie repository (with a `-dirty` suffix for uncommitted changes), or None."""
+    repo_dir = Path(__file__).parent
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo_dir, text=True).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "-uno"], cwd=repo_dir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit + ("-dirty" if dirty else "")
+
+
+@click.group("benchmark")
+def benchmark_cli():
+    """Performance benchmarks on synthetic data."""
+    pass
+
+
+@benchmark_cli.command("run")
+@click.option("--examples", type=int, default=100, help="Number of examples in the synthetic dataset.")
+@click.option("--setups", type=int, default=3, help="Number of setups with outputs for each example.")
+@click.option("--annotators", type=int, default=2, help="Number of annotator groups in each campaign.")
+@click.option("--spans", type=int, default=3, help="Number of annotated spans in each output.")
+@click.option("--output_words", type=int, default=50, help="Number of words in each output.")
+@click.option("--examples_per_batch", type=int, default=5, help="Examples per batch in the crowdsourcing campaign.")
+@click.option("--repeat", type=int, default=5, help="Number of repetitions of each scenario.")
+@click.option(
+    "--scenario",
+    type=click.Choice(list(SCENARIOS.keys())),
+    multiple=True,
+    help="Scenario to run (can be specified multiple times, all scenarios are run by default).",
+)
+@click.option("--seed", type=int, default=0, help="Seed for generating the synthetic data.")
+@click.option("--output", type=str, help="Output file for the results (JSON format).")
+def run_command(examples, setups, annotators, spans, output_words, examples_per_batch, repeat, scenario, seed, output):
+    """Generate synthetic data and run the timed scenarios on them."""
+    params = {
+        "examples": examples,
+        "setups": setups,
+        "annotators": annotators,
+        "spans": spans,
+        "output_words": output_words,
+        "examples_per_batch": examples_per_batch,
+        "seed": seed,
+    }
+    scenarios = list(scenario) or list(SCENARIOS.keys())
+
+    with temporary_data_dirs(app):
+        ids = generate_synthetic_data(app, prefix="benchmark", **params)
+
+        try:
+            results = run_scenarios(app, scenarios, ids, params, repeat)
+        finally:
+            cleanup_synthetic_data(app, ids)
+
+    report = {
+        "commit": get_git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": params,
+        "repeat": repeat,
+        "results": results,
+    }
+
+    table = [[name, f"{r['min'] * 1000:.1f}", f"{r['median'] * 1000:.1f}"] for name, r in results.items()]
+    print(tabulate(table, headers=["Scenario", "Min [ms]", "Median [ms]"], tablefmt="github"))
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {output}")
+
+
+@benchmark_cli.command("loadtest")
+@click.option("--annotators", type=int, default=20, help="Number of simultaneous annotators.")
+@click.option("--examples", type=int, default=200, help="Number of examples in the synthetic dataset.")
+@click.option("--setups", type=int, default=2, help="Number of setups with outputs for each example.")
+@click.option("--annotator_groups", type=int, default=1, help="Number of annotator groups in the campaign.")
+@click.option("--examples_per_batch", type=int, default=5, help="Examples per batch in the crowdsourcing campaign.")
+@click.option("--max_batches", type=int, help="Stop after the annotators opened this number of batches.")
+@click.option("--duration", type=float, help="Stop after this number of seconds.")
+@click.option("--think_time", type=float, default=0.05, help="Median time spent on a single example (seconds).")
+@click.option("--abandon_rate", type=float, default=0.1, help="Probability that an annotator abandons the batch.")
+@click.option("--idle_time", type=float, default=5.0, help="Time after which an abandoned batch is released (seconds).")
+@click.option("--fetch_examples", is_flag=True, default=False, help="Request every example from /example.")
+@click.option("--seed", type=int, default=0, help="Seed for the synthetic data and the annotators.")
+@click.option("--output", type=str, help="Output file for the results (JSON format).")
+def loadtest_command(
+    annotators,
+    examples,
+    setups,
+    annotator_groups,
+    examples_per_batch,
+    max_batches,
+    duration,
+    think_time,
+    abandon_rate,
+    idle_time,
+    fetch_examples,
+    seed,
+    output,
+):
+    """Simulate annotators working in parallel on a synthetic crowdsourcing campaign."""
+    with temporary_data_dirs(app):
+        ids = generate_synthetic_data(
+            app,
+            prefix="loadtest",
+            examples=examples,
+            setups=setups,
+            annotators=annotator_groups,
+            spans=0,
+            examples_per_batch=examples_per_batch,
+            seed=seed,
+        )
+
+        try:
+            # the annotators are simulated in separate threads without the application context
+            report = run_loadtest(
+                app._get_current_object(),
+                ids["crowdsourcing"],
+                annotators=annotators,
+                max_batches=max_batches,
+                duration=duration,
+                think_time=think_time,
+                abandon_rate=abandon_rate,
+                idle_time=idle_time,
+                fetch_examples=fetch_examples,
+                seed=seed,
+            )
+        finally:
+            cleanup_synthetic_data(app, ids)
+
+    report["commit"] = get_git_commit()
+    report["timestamp"] = datetime.datetime.now().isoformat(timespec="seconds")
+
+    table = [
+        [endpoint, r["requests"], *[f"{r[k] * 1000:.1f}" for k in ["mean", "p50", "p95", "p99", "max"]]]
+        for endpoint, r in report["latency"].items()
+    ]
+    print(tabulate(table, headers=["Endpoint", "Requests", "Mean [ms]", "p50", "p95", "p99", "Max"], tablefmt="github"))
+
+    locks = report["locks"]
+    print(f"\nThroughput: {report['throughput']['requests_per_second']:.1f} requests/s, ", end="")
+    print(f"{report['throughput']['batches_per_second']:.1f} batches/s ({report['elapsed']:.1f} s)")
+    print(f"Batches: {report['batches']}, campaign db: {report['db']}")
+    if locks:
+        print(
+            f"Campaign lock: {locks['acquired']} acquisitions, wait p50 {locks['wait_p50'] * 1000:.1f} ms, "
+            f"p99 {locks['wait_p99'] * 1000:.1f} ms, max {locks['wait_max'] * 1000:.1f} ms"
+        )
+    if report["errors"]:
+        print(f"Errors: {report['errors']}")
+    print(f"Double assignments: {len(report['double_assignments'])}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {output}")
+
+    if report["double_assignments"] or not report["db"]["consistent"]:
+        sys.exit(1)
+
+
+@benchmark_cli.command("compare")
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--threshold",
+    type=float,
+    default=1.1,
+    help="Ratio of the median durations (current / baseline) above which the scenario is reported as a regression.",
+)
+def compare_command(baseline, current, threshold):
+    """Compare two benchmark results. Exits with a non-zero code if any scenario regressed."""
+    with open(baseline) as f:
+        baseline = json.load(f)
+    with open(current) as f:
+        current = json.load(f)
+
+    if baseline["params"] != current["params"]:
+        print("Warning: the benchmarks were run with different parameters.\n")
+
+    table = []
+    regressions = []
+
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+
+        base_median = baseline["results"][name]["median"]
+        ratio = result["median"] / base_median if base_median else float("inf")
+
+        if ratio > threshold:
+            regressions.append(name)
+
+        table.append(
+            [
+                name,
+                f"{base_median * 1000:.1f}",
+                f"{result['median'] * 1000:.1f}",
+                f"{ratio:.2f}x",
+                "REGRESSION" if ratio > threshold else "",
+            ]
+        )
+
+    print(f"Baseline: {baseline.get('commit')}, current: {current.get('commit')}\n")
+    print(tabulate(table, headers=["Scenario", "Baseline [ms]", "Current [ms]", "Ratio", ""], tablefmt="github"))
+
+    if regressions:
+        print(f"\n{len(regressions)} scenarios regressed by more than {threshold:.2f}x: {', '.join(regressions)}")
+        sys.exit(1)
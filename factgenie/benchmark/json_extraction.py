@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Benchmark of extracting the JSON annotations from long raw model responses.
+# Usage: python -m factgenie.benchmark.json_extraction [--sizes 10000 100000 1000000] [--repeat 5]
+
+import argparse
+import json
+import random
+import re
+import time
+
+from factgenie.text_processing import find_last_json_object, strip_think_blocks
+
+
+def naive_extract(content):
+    """Reference implementation: character-by-character scan, every balanced candidate is parsed."""
+    output = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL)
+
+    potential_jsons = []
+    stack = []
+    start_indices = []
+
+    for i, char in enumerate(output):
+        if char == "{":
+            if not stack:
+                start_indices.append(i)
+            stack.append("{")
+        elif (char == "}") and stack:
+            stack.pop()
+            if not stack:
+                start = start_indices.pop()
+                potential_jsons.append(output[start : i + 1])
+
+    valid_jsons = []
+    for json_str in potential_jsons:
+        try:
+            json.loads(json_str)
+            valid_jsons.append(json_str)
+        except json.JSONDecodeError:
+            continue
+
+    return valid_jsons[-1] if valid_jsons else None
+
+
+def fast_extract(content):
+    output, _ = strip_think_blocks(content)
+    return find_last_json_object(output)
+
+
+def generate_response(size, seed=0):
+    """
+    Synthetic response of approximately `size` characters: a long reasoning trace with draft JSON objects, followed by the final annotations.
+    """
+    rnd = random.Random(seed)
+    words = ["the", "value", "is", "incorrect", "{draft}", "span", "output", "check", "table", "}", "{"]
+    annotations = {
+        "annotations": [
+            {"reason": "The value is wrong.", "text": f"word{i}", "annotation_type": rnd.randint(0, 3)}
+            for i in range(20)
+        ]
+    }
+    final = json.dumps(annotations)
+
+    parts = ["<think>"]
+    length = 0
+    while length < size - len(final):
+        if rnd.random() < 0.05:
+            chunk = json.dumps({"draft": [rnd.randint(0, 100) for _ in range(10)]})
+        else:
+            chunk = " ".join(rnd.choice(words) for _ in range(20))
+        parts.append(chunk)
+        length += len(chunk) + 1
+
+    parts.append(
+        "</think>\nSome explanation with a draft " + json.dumps({"annotations": []}) + " and the final output:"
+    )
+    parts.append(final)
+
+    return "\n".join(parts)
+
+
+def run_benchmark(sizes, repeat):
+    results = []
+
+    for size in sizes:
+        content = generate_response(size)
+        row = {"size": len(content)}
+
+        for name, fn in [("naive", naive_extract), ("fast", fast_extract)]:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                extracted = fn(content)
+                timings.append(time.perf_counter() - start)
+            row[name] = min(timings)
+            row[f"{name}_result"] = extracted
+
+        assert row["naive_result"] == row["fast_result"], "The extractors returned different results"
+        results.append(row)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the JSON extraction from raw model responses.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'chars':>10} {'naive [ms]':>12} {'fast [ms]':>12} {'speedup':>8}")
+    for row in run_benchmark(args.sizes, args.repeat):
+        print(
+            f"{row['size']:>10} {row['naive'] * 1000:>12.2f} {row['fast'] * 1000:>12.2f} {row['naive'] / row['fast']:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+# Load test of the crowdsourcing endpoints with simulated annotators.
+#
+# The annotators are simulated by threads sending requests to the app with the Flask test client, so the test runs offline without starting the server. Each thread plays a sequence of annotators: an annotator opens the annotation page, views the examples of the assigned batch (waiting for a random "think time" between them) and submits the annotations, or abandons the batch so that it is released after the idle time.
+
+import json
+import logging
+import random
+import re
+import statistics
+import threading
+import time
+from collections import defaultdict
+
+import factgenie.workflows as workflows
+from factgenie.campaign import ExampleStatus
+
+logger = logging.getLogger("factgenie")
+
+ANNOTATION_SET_RE = re.compile(r"window\.annotation_set = (.*?);\n")
+
+
+class LoadTestStats:
+    """
+    Request latencies and the assignment log shared by the simulated annotators.
+
+    A batch assigned to an annotator must not be assigned to anyone else unless it was abandoned or released after `min_hold` seconds (the idle time of the campaign).
+    """
+
+    def __init__(self, min_hold):
+        self.min_hold = min_hold
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        # batch_idx -> (annotator_id, state, assignment time) of the last annotator the batch was assigned to
+        self.holders = {}
+        self.double_assignments = []
+        self.submitted = 0
+        self.rejected = 0
+        self.abandoned = 0
+        self.expired = 0
+
+    def add_request(self, endpoint, duration, ok):
+        with self.lock:
+            self.latencies[endpoint].append(duration)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def assign(self, batch_idx, annotator_id):
+        now = time.time()
+
+        with self.lock:
+            holder = self.holders.get(batch_idx)
+
+            if holder is not None and holder[0] != annotator_id:
+                annotator, state, assigned = holder
+
+                if state == "finished" or (state == "active" and now - assigned < self.min_hold):
+                    self.double_assignments.append({"batch_idx": batch_idx, "annotators": [annotator, annotator_id]})
+                elif state == "active":
+                    # the batch was released due to the idle time before the annotator submitted it
+                    self.expired += 1
+
+            self.holders[batch_idx] = (annotator_id, "active", now)
+
+    def finish(self, batch_idx, annotator_id, success):
+        with self.lock:
+            if success:
+                self.submitted += 1
+                self.holders[batch_idx] = (annotator_id, "finished", self.holders[batch_idx][2])
+            else:
+                self.rejected += 1
+
+    def abandon(self, batch_idx, annotator_id):
+        with self.lock:
+            self.abandoned += 1
+            self.holders[batch_idx] = (annotator_id, "abandoned", self.holders[batch_idx][2])
+
+
+def timed_request(stats, endpoint, request, *args, **kwargs):
+    start = time.perf_counter()
+    response = request(*args, **kwargs)
+    stats.add_request(endpoint, time.perf_counter() - start, response.status_code == 200)
+
+    return response
+
+
+def think(rnd, think_time):
+    if think_time > 0:
+        # log-normal distribution with the median of `think_time` seconds
+        time.sleep(rnd.lognormvariate(0, 0.5) * think_time)
+
+
+def simulate_annotator(client, campaign_id, annotator_id, stats, rnd, think_time, abandon_rate, fetch_examples):
+    """
+    Simulate a single annotator.
+
+    Returns:
+        False if there are no more batches available, True otherwise.
+    """
+    response = timed_request(
+        stats, "annotate", client.get, f"/annotate/{campaign_id}", query_string={"annotatorId": annotator_id}
+    )
+    match = ANNOTATION_SET_RE.search(response.get_data(as_text=True))
+
+    if not match:
+        # the campaign is closed
+        return False
+
+    annotation_set = json.loads(match.group(1))
+    batch_idx = annotation_set[0]["batch_idx"]
+    stats.assign(batch_idx, annotator_id)
+
+    abandon = rnd.random() < abandon_rate
+
+    for example in annotation_set:
+        # the examples are normally sent with the page, see `crowdsourcing.add_batch_payloads()`
+        if fetch_examples or not example.get("payload"):
+            query = {k: example[k] for k in ["dataset", "split", "setup_id", "example_idx"]}
+            timed_request(stats, "example", client.get, "/example", query_string=query)
+
+        example.pop("payload", None)
+        think(rnd, think_time)
+
+        if abandon:
+            stats.abandon(batch_idx, annotator_id)
+            return True
+
+        example.update(
+            {
+                "annotations": [],
+                "flags": [],
+                "options": [],
+                "sliders": [],
+                "textFields": [],
+                "timeLastSaved": int(time.time()),
+                "timeLastAccessed": int(time.time()),
+            }
+        )
+
+    response = timed_request(
+        stats,
+        "submit_annotations",
+        client.post,
+        "/submit_annotations",
+        json={"campaign_id": campaign_id, "annotation_set": annotation_set, "annotator_id": annotator_id},
+    )
+    stats.finish(batch_idx, annotator_id, response.status_code == 200 and response.get_json().get("success"))
+
+    return True
+
+
+def check_db(campaign, stats):
+    """Compare the final state of the campaign db with the submissions."""
+    db = campaign.db
+    batches = db.groupby("batch_idx")["status"].first()
+
+    return {
+        "finished_batches": int((batches == ExampleStatus.FINISHED).sum()),
+        "assigned_batches": int((batches == ExampleStatus.ASSIGNED).sum()),
+        "free_batches": int((batches == ExampleStatus.FREE).sum()),
+        # every accepted submission must have finished exactly one batch
+        "consistent": int((batches == ExampleStatus.FINISHED).sum()) == stats.submitted,
+    }
+
+
+def summarize_latencies(latencies):
+    if not latencies:
+        return {}
+
+    latencies = sorted(latencies)
+    percentile = lambda p: latencies[min(len(latencies) - 1, len(latencies) * p // 100)]
+
+    return {
+        "requests": len(latencies),
+        "mean": statistics.mean(latencies),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": latencies[-1],
+    }
+
+
+def run_loadtest(
+    app,
+    campaign_id,
+    annotators=20,
+    max_batches=None,
+    duration=None,
+    think_time=0.05,
+    abandon_rate=0.1,
+    idle_time=5.0,
+    fetch_examples=False,
+    seed=0,
+):
+    """
+    Run `annotators` simulated annotators in parallel on the crowdsourcing campaign.
+
+    The test ends when all the batches are finished, when `max_batches` batches were opened or after `duration` seconds. The abandoned batches are released after `idle_time` seconds (the idle time of the campaign is overridden for the duration of the test).
+
+    Returns:
+        A dictionary with the throughput, the latencies of the individual endpoints (in seconds), the lock metrics and the result of the correctness checks.
+    """
+    campaign = workflows.load_campaign(app, campaign_id)
+    config = campaign.metadata["config"]
+    original_idle_time = config["idle_time"]
+    # the idle time is in minutes
+    config["idle_time"] = idle_time / 60
+
+    # the assignment times in the db are in whole seconds
+    stats = LoadTestStats(min_hold=idle_time - 1)
+    stop = threading.Event()
+    opened = iter(range(max_batches)) if max_batches else None
+    opened_lock = threading.Lock()
+
+    def worker(worker_idx):
+        rnd = random.Random(f"{seed}-{worker_idx}")
+        client = app.test_client()
+        session = 0
+
+        while not stop.is_set():
+            if opened is not None:
+                with opened_lock:
+                    if next(opened, None) is None:
+                        return
+
+            annotator_id = f"loadtest-{worker_idx}-{session}"
+            session += 1
+
+            try:
+                if not simulate_annotator(
+                    client, campaign_id, annotator_id, stats, rnd, think_time, abandon_rate, fetch_examples
+                ):
+                    # wait for the abandoned batches to be released
+                    if campaign.batch_assignment.annotator_batches:
+                        time.sleep(idle_time / 2)
+                        continue
+                    return
+            except Exception as e:
+                logger.exception(f"Simulated annotator {annotator_id} failed: {e}")
+                with stats.lock:
+                    stats.errors["simulation"] += 1
+
+    def idle_checker():
+        # the same job as the one run by the scheduler of the app every minute, the test uses a shorter interval
+        while not stop.wait(min(idle_time / 2, 1.0)):
+            campaign.check_idle_time()
+
+    logger.info(f"Running the load test with {annotators} annotators on {campaign_id}")
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(annotators)]
+    checker = threading.Thread(target=idle_checker, daemon=True)
+
+    start = time.perf_counter()
+    checker.start()
+    for thread in threads:
+        thread.start()
+
+    try:
+        deadline = start + duration if duration else None
+        for thread in threads:
+            thread.join(timeout=max(deadline - time.perf_counter(), 0) if deadline else None)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        checker.join()
+        config["idle_time"] = original_idle_time
+
+    elapsed = time.perf_counter() - start
+    requests = sum(len(latencies) for latencies in stats.latencies.values())
+
+    return {
+        "annotators": annotators,
+        "elapsed": elapsed,
+        "throughput": {
+            "requests_per_second": requests / elapsed,
+            "batches_per_second": stats.submitted / elapsed,
+        },
+        "batches": {
+            "submitted": stats.submitted,
+            "rejected": stats.rejected,
+            "abandoned": stats.abandoned,
+            "expired": stats.expired,
+        },
+        "latency": {endpoint: summarize_latencies(latencies) for endpoint, latencies in stats.latencies.items()},
+        "errors": dict(stats.errors),
+        "locks": app.db["locks"].get_metrics().get(campaign_id, {}),
+        "double_assignments": stats.double_assignments,
+        "db": check_db(campaign, stats),
+    }
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# Timed benchmark scenarios running on the data from `factgenie.benchmark.synthetic`.
+#
+# Each scenario is a function `scenario(app, ids, params)` returning a pair of callables `(prepare, run)`:
+# `prepare()` is called before every repetition and is not timed, `run()` is the timed part.
+
+import logging
+import statistics
+import time
+
+import factgenie.workflows as workflows
+from factgenie.benchmark.json_extraction import fast_extract, generate_response
+from factgenie.benchmark.synthetic import SPLIT
+
+logger = logging.getLogger("factgenie")
+
+
+def reset_indexes(app):
+    app.db["output_index"] = None
+    app.db["output_index_cache"] = {}
+    app.db["annotation_index"] = None
+    app.db["annotation_index_cache"] = {}
+
+
+def output_index_cold(app, ids, params):
+    return lambda: reset_indexes(app), lambda: workflows.get_output_index(app, force_reload=True)
+
+
+def output_index_warm(app, ids, params):
+    # the index is already loaded, only the modification times of the files are checked
+    load = lambda: workflows.get_output_index(app, force_reload=True)
+    return load, load
+
+
+def annotation_index_cold(app, ids, params):
+    return lambda: reset_indexes(app), lambda: workflows.get_annotation_index(app, force_reload=True)
+
+
+def annotation_index_warm(app, ids, params):
+    load = lambda: workflows.get_annotation_index(app, force_reload=True)
+    return load, load
+
+
+def get_example_data(app, ids, params):
+    calls = min(params["examples"], 100)
+
+    def prepare():
+        workflows.get_output_index(app, force_reload=True)
+        workflows.get_annotation_index(app, force_reload=True)
+
+    def run():
+        for i in range(calls):
+            setup_id = ids["setups"][i % len(ids["setups"])]
+            workflows.get_example_data(app, ids["dataset"], SPLIT, i, setup_id=setup_id)
+
+    return prepare, run
+
+
+def batch_assignment(app, ids, params):
+    from factgenie.crowdsourcing import get_annotator_batch
+
+    campaign = workflows.load_campaign(app, ids["crowdsourcing"])
+    free_db = campaign.db.copy()
+    calls = min(free_db["batch_idx"].nunique(), 100)
+
+    def prepare():
+        campaign.update_db(free_db.copy())
+        # the assignment index is rebuilt for the new db outside of the timed part
+        campaign.batch_assignment
+
+    def run():
+        for i in range(calls):
+            get_annotator_batch(app, campaign, {"annotator_id": f"benchmark-annotator-{i}"})
+
+    return prepare, run
+
+
+def compute_statistics(app, ids, params):
+    from factgenie.analysis import compute_statistics
+
+    campaign = workflows.load_campaign(app, ids["campaigns"][0])
+
+    return lambda: None, lambda: compute_statistics(app, campaign)
+
+
+def f1(app, ids, params):
+    from factgenie.iaa.f1 import compute_f1
+
+    group = ids["annotator_groups"][0]
+
+    return lambda: None, lambda: compute_f1(ids["campaigns"][0], group, ids["campaigns"][1], group)
+
+
+def gamma(app, ids, params):
+    from factgenie.iaa.gamma import compute_gamma
+
+    # the gamma score is expensive, only a subset of the examples is used
+    example_ids = list(range(min(params["examples"], params.get("gamma_examples", 10))))
+
+    groups = [ids["annotator_groups"][0]] * len(ids["campaigns"])
+
+    return lambda: None, lambda: compute_gamma(ids["campaigns"], groups, include_example_id=example_ids)
+
+
+def pearson(app, ids, params):
+    from factgenie.iaa.pearson import compute_pearson
+
+    group = ids["annotator_groups"][0]
+
+    return lambda: None, lambda: compute_pearson(ids["campaigns"][0], group, ids["campaigns"][1], group)
+
+
+def confusion(app, ids, params):
+    from factgenie.stats.confusion import compute_confusion_matrix
+
+    group = ids["annotator_groups"][0]
+
+    return lambda: None, lambda: compute_confusion_matrix(ids["campaigns"][0], group, ids["campaigns"][1], group)
+
+
+def json_extraction(app, ids, params):
+    content = generate_response(1_000_000)
+
+    return lambda: None, lambda: fast_extract(content)
+
+
+SCENARIOS = {
+    "output_index_cold": output_index_cold,
+    "output_index_warm": output_index_warm,
+    "annotation_index_cold": annotation_index_cold,
+    "annotation_index_warm": annotation_index_warm,
+    "get_example_data": get_example_data,
+    "batch_assignment": batch_assignment,
+    "compute_statistics": compute_statistics,
+    "f1": f1,
+    "gamma": gamma,
+    "pearson": pearson,
+    "confusion": confusion,
+    "json_extraction": json_extraction,
+}
+
+
+def run_scenario(app, name, ids, params, repeat):
+    """
+    Run the scenario `repeat` times.
+
+    Returns:
+        A dictionary with the durations of the individual runs and their summary (in seconds).
+    """
+    prepare, run = SCENARIOS[name](app, ids, params)
+    durations = []
+
+    for _ in range(repeat):
+        prepare()
+
+        start = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start)
+
+    return {
+        "runs": durations,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+    }
+
+
+def run_scenarios(app, names, ids, params, repeat):
+    results = {}
+
+    for name in names:
+        logger.info(f"Running scenario {name}")
+        results[name] = run_scenario(app, name, ids, params, repeat)
+        logger.info(f"{name}: {results[name]['median'] * 1000:.1f} ms (median of {repeat})")
+
+    return results
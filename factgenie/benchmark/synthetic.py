@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+# Generator of synthetic datasets, outputs and campaigns of configurable size for the benchmarks.
+
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+import factgenie.workflows as workflows
+from factgenie import CAMPAIGN_DIR, INPUT_DIR, OUTPUT_DIR
+from factgenie.campaign import CampaignMode, CampaignStatus, ExampleStatus
+from factgenie.crowdsourcing import (
+    create_crowdsourcing_page,
+    generate_crowdsourcing_campaign_db,
+)
+from factgenie.datasets.basic import JSONLDataset
+
+logger = logging.getLogger("factgenie")
+
+SPLIT = "test"
+WORDS = (
+    "the team scored points in the first second third quarter game match season player coach won lost against "
+    "home away record high low average total rebounds assists minutes field goals percent fans stadium city"
+).split()
+CATEGORIES = [
+    {"name": "Incorrect", "description": "The fact is not supported by the data.", "color": "#ffbcbc"},
+    {"name": "Not checkable", "description": "The fact cannot be checked.", "color": "#e9d2ff"},
+    {"name": "Misleading", "description": "The fact is misleading.", "color": "#fff79f"},
+    {"name": "Other", "description": "Any other problem.", "color": "#bbbbbb"},
+]
+
+
+@contextmanager
+def temporary_data_dirs(app):
+    """
+    Redirect the input, output and campaign directories to a temporary directory for the duration of the benchmark.
+
+    The directories are imported by name in multiple modules, so the attribute is replaced in every loaded factgenie module. The indexes of the application are rebuilt from the original directories afterwards.
+    """
+    import factgenie
+
+    originals = {name: getattr(factgenie, name) for name in ["INPUT_DIR", "OUTPUT_DIR", "CAMPAIGN_DIR"]}
+    patched = []
+
+    with tempfile.TemporaryDirectory(prefix="factgenie-benchmark-") as tmp_dir:
+        for name in originals:
+            os.makedirs(Path(tmp_dir) / name.lower(), exist_ok=True)
+
+        for module in list(sys.modules.values()):
+            if not getattr(module, "__name__", "").startswith("factgenie"):
+                continue
+
+            for name, original in originals.items():
+                if getattr(module, name, None) is original:
+                    setattr(module, name, Path(tmp_dir) / name.lower())
+                    patched.append((module, name, original))
+
+        reset_app_indexes(app)
+
+        try:
+            yield Path(tmp_dir)
+        finally:
+            for module, name, original in patched:
+                setattr(module, name, original)
+
+            reset_app_indexes(app)
+
+
+def reset_app_indexes(app):
+    app.db["output_index"] = None
+    app.db["output_index_cache"] = {}
+    app.db.pop("output_lookup", None)
+    app.db["annotation_index"] = None
+    app.db["annotation_index_cache"] = {}
+    app.db.pop("campaign_index", None)
+
+    workflows.get_output_index(app, force_reload=True)
+    workflows.generate_campaign_index(app, force_reload=True)
+
+
+def get_ids(prefix, setups, annotators):
+    return {
+        "dataset": f"{prefix}-dataset",
+        "setups": [f"{prefix}-setup-{i}" for i in range(setups)],
+        # two annotation campaigns, each with `annotators` annotator groups
+        "campaigns": [f"{prefix}-eval-a", f"{prefix}-eval-b"],
+        "annotator_groups": list(range(annotators)),
+        "crowdsourcing": f"{prefix}-crowdsourcing",
+    }
+
+
+def random_text(rnd, words):
+    return " ".join(rnd.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def generate_dataset(dataset_id, examples, rnd):
+    os.makedirs(INPUT_DIR / dataset_id, exist_ok=True)
+
+    with open(INPUT_DIR / dataset_id / f"{SPLIT}.jsonl", "w") as f:
+        for i in range(examples):
+            example = {"id": i, "team": rnd.choice(WORDS), "points": rnd.randint(50, 150), "text": random_text(rnd, 20)}
+            f.write(json.dumps(example) + "\n")
+
+
+def generate_outputs(dataset_id, setup_id, examples, output_words, rnd):
+    os.makedirs(OUTPUT_DIR / setup_id, exist_ok=True)
+    outputs = []
+
+    with open(OUTPUT_DIR / setup_id / "outputs.jsonl", "w") as f:
+        for i in range(examples):
+            output = random_text(rnd, output_words)
+            outputs.append(output)
+            record = {"dataset": dataset_id, "split": SPLIT, "setup_id": setup_id, "example_idx": i, "output": output}
+            f.write(json.dumps(record) + "\n")
+
+    return outputs
+
+
+def generate_spans(output, spans, seed, rnd):
+    """
+    Annotate random words of the output. Half of the spans are the same for all the annotators (given by `seed`), so that the agreement metrics are neither zero nor perfect.
+    """
+    word_starts = [0] + [i + 1 for i, c in enumerate(output) if c == " "]
+    shared_rnd = random.Random(seed)
+    annotations = []
+
+    for i in range(spans):
+        span_rnd = shared_rnd if i % 2 == 0 else rnd
+        start = span_rnd.choice(word_starts)
+        end = output.find(" ", start)
+        text = output[start:] if end == -1 else output[start:end]
+        annotation_type = span_rnd.randrange(len(CATEGORIES))
+
+        annotations.append({"reason": "Synthetic annotation.", "text": text, "start": start, "type": annotation_type})
+
+    return sorted(annotations, key=lambda a: a["start"])
+
+
+def write_metadata(campaign_id, mode, config, status=None):
+    metadata = {"id": campaign_id, "mode": mode, "config": config, "created": "2025-01-01 00:00:00"}
+
+    if status:
+        metadata["status"] = status
+
+    with open(os.path.join(CAMPAIGN_DIR, campaign_id, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=4)
+
+
+def generate_annotation_campaign(campaign_id, ids, outputs, spans, rnd):
+    """An annotation campaign with all the examples annotated by all the annotator groups."""
+    files_dir = os.path.join(CAMPAIGN_DIR, campaign_id, "files")
+    os.makedirs(files_dir, exist_ok=True)
+
+    config = {
+        "api_provider": "mock",
+        "model": "synthetic",
+        "prompt_strat": "default",
+        "annotation_span_categories": CATEGORIES,
+        "annotation_overlap_allowed": False,
+        "annotation_granularity": "words",
+    }
+    write_metadata(campaign_id, CampaignMode.LLM_EVAL, config, status=CampaignStatus.FINISHED)
+
+    rows = []
+
+    for group in ids["annotator_groups"]:
+        with open(os.path.join(files_dir, f"{ids['dataset']}-{SPLIT}-{group}.jsonl"), "w") as f:
+            for setup_id in ids["setups"]:
+                for example_idx, output in enumerate(outputs[setup_id]):
+                    record = {
+                        "dataset": ids["dataset"],
+                        "split": SPLIT,
+                        "setup_id": setup_id,
+                        "example_idx": example_idx,
+                        "annotations": generate_spans(output, spans, f"{setup_id}-{example_idx}", rnd),
+                        "flags": [],
+                        "options": [],
+                        "sliders": [],
+                        "text_fields": [],
+                        "metadata": {
+                            "annotator_id": f"annotator-{group}",
+                            "annotator_group": group,
+                            "campaign_id": campaign_id,
+                            "start_timestamp": 0,
+                            "end_timestamp": 1,
+                        },
+                    }
+                    f.write(json.dumps(record) + "\n")
+
+                    rows.append(
+                        {
+                            "dataset": ids["dataset"],
+                            "split": SPLIT,
+                            "example_idx": example_idx,
+                            "setup_id": setup_id,
+                            "annotator_id": f"annotator-{group}",
+                            "annotator_group": group,
+                            "status": ExampleStatus.FINISHED,
+                            "start": 0,
+                            "end": 1,
+                        }
+                    )
+
+    pd.DataFrame.from_records(rows).to_csv(os.path.join(CAMPAIGN_DIR, campaign_id, "db.csv"), index=False)
+
+
+def generate_crowdsourcing_campaign(app, campaign_id, ids, examples_per_batch, annotators):
+    """A crowdsourcing campaign with all the batches free, used for benchmarking the batch assignment."""
+    os.makedirs(os.path.join(CAMPAIGN_DIR, campaign_id, "files"), exist_ok=True)
+
+    config = {
+        "examples_per_batch": examples_per_batch,
+        "annotators_per_example": annotators,
+        "idle_time": 60,
+        "sort_order": "keep-all",
+        "service": "local",
+        "annotation_span_categories": CATEGORIES,
+        "annotation_overlap_allowed": False,
+        "annotation_granularity": "words",
+        "annotator_instructions": "",
+        "final_message": "",
+        "flags": [],
+        "options": [],
+        "sliders": [],
+        "text_fields": [],
+    }
+    write_metadata(campaign_id, CampaignMode.CROWDSOURCING, config)
+    create_crowdsourcing_page(campaign_id, config)
+
+    campaign_data = [{"dataset": ids["dataset"], "split": SPLIT, "setup_id": setup_id} for setup_id in ids["setups"]]
+    db = generate_crowdsourcing_campaign_db(app, campaign_data, config=config)
+    db.to_csv(os.path.join(CAMPAIGN_DIR, campaign_id, "db.csv"), index=False)
+
+
+def generate_synthetic_data(
+    app,
+    prefix="benchmark",
+    examples=100,
+    setups=3,
+    annotators=2,
+    spans=3,
+    output_words=50,
+    examples_per_batch=5,
+    seed=0,
+):
+    """
+    Generate a synthetic dataset with outputs from `setups` setups and two annotation campaigns with `annotators` annotator groups, each annotating `spans` spans in every output, and a crowdsourcing campaign with free batches.
+
+    The data are written to the factgenie directories (see `temporary_data_dirs()`), use `cleanup_synthetic_data()` to remove them.
+
+    Returns:
+        A dictionary with the identifiers of the generated data.
+    """
+    rnd = random.Random(seed)
+    ids = get_ids(prefix, setups, annotators)
+
+    cleanup_synthetic_data(app, ids)
+    logger.info(f"Generating synthetic data: {examples} examples, {setups} setups, {annotators} annotator groups")
+
+    generate_dataset(ids["dataset"], examples, rnd)
+    app.db["datasets_obj"][ids["dataset"]] = JSONLDataset(ids["dataset"], splits=[SPLIT])
+
+    outputs = {
+        setup_id: generate_outputs(ids["dataset"], setup_id, examples, output_words, rnd) for setup_id in ids["setups"]
+    }
+    workflows.get_output_index(app, force_reload=True)
+
+    for campaign_id in ids["campaigns"]:
+        generate_annotation_campaign(campaign_id, ids, outputs, spans, rnd)
+
+    generate_crowdsourcing_campaign(app, ids["crowdsourcing"], ids, examples_per_batch, annotators)
+
+    workflows.generate_campaign_index(app, force_reload=True)
+    workflows.get_annotation_index(app, force_reload=True)
+
+    return ids
+
+
+def cleanup_synthetic_data(app, ids):
+    shutil.rmtree(INPUT_DIR / ids["dataset"], ignore_errors=True)
+
+    for setup_id in ids["setups"]:
+        shutil.rmtree(OUTPUT_DIR / setup_id, ignore_errors=True)
+
+    for campaign_id in ids["campaigns"] + [ids["crowdsourcing"]]:
+        shutil.rmtree(CAMPAIGN_DIR / campaign_id, ignore_errors=True)
+
+    app.db["datasets_obj"].pop(ids["dataset"], None)
+
+    # drop the removed files from the indexes
+    workflows.refresh_indexes(app)
+    workflows.generate_campaign_index(app, force_reload=False)
@@ -7,6 +7,7 @@ import click
 from flask.cli import FlaskGroup
 
 from factgenie.app import app
+from factgenie.benchmark.cli import benchmark_cli
 from factgenie.campaign import CampaignMode
 from factgenie.iaa.cli import iaa_cli
 from factgenie.stats.cli import stats_cli
@@ -126,6 +127,7 @@ def show_campaign_info(app, campaign_id: str):
 
 app.cli.add_command(iaa_cli)  # Register the iaa command group
 app.cli.add_command(stats_cli)  # Register the stats command group
+app.cli.add_command(benchmark_cli)  # Register the benchmark command group
 
 
 @app.cli.command("info")
@@ -178,8 +180,25 @@ def download_data(dataset_id: str):
     help="Path to the YAML configuration file  / name of an existing config (without file suffix).",
 )
 @click.option("-f", "--overwrite", is_flag=True, default=False, help="Overwrite existing campaign if it exists.")
+@click.option(
+    "--estimate",
+    is_flag=True,
+    default=False,
+    help="Only estimate the number of tokens, the cost and the duration of the campaign without creating it.",
+)
+@click.option(
+    "--workers", type=int, default=1, help="Number of workers the campaign will be run with (used with --estimate)."
+)
 def create_llm_campaign(
-    campaign_id: str, dataset_ids: str, splits: str, setup_ids: str, mode: str, config_file: str, overwrite: bool
+    campaign_id: str,
+    dataset_ids: str,
+    splits: str,
+    setup_ids: str,
+    mode: str,
+    config_file: str,
+    overwrite: bool,
+    estimate: bool,
+    workers: int,
 ):
     """Create a new LLM campaign."""
     from pathlib import Path
@@ -256,6 +275,12 @@ def create_llm_campaign(
         config_names = [Path(x).stem for x in configs.keys()]
         raise ValueError(f"Config {config_file} not found. Available configs: {config_names}")
 
+    if estimate:
+        from factgenie.estimate import estimate_llm_campaign, format_estimate
+
+        print(format_estimate(estimate_llm_campaign(app, mode, config, campaign_data, datasets, workers=workers)))
+        return
+
     llm_campaign.create_llm_campaign(app, mode, campaign_id, config, campaign_data, datasets, overwrite=overwrite)
 
     print(f"Created campaign {campaign_id}")
@@ -263,10 +288,22 @@ def create_llm_campaign(
 
 @app.cli.command("run_llm_campaign")
 @click.argument("campaign_id", type=str)
-def run_llm_campaign(campaign_id: str):
+@click.option(
+    "--retry_failed", is_flag=True, default=False, help="Return the failed examples to the queue before running."
+)
+@click.option(
+    "--worker_id",
+    type=str,
+    help="Identifier of the worker when running the campaign from multiple processes or machines at once.",
+)
+@click.option("--lease_size", type=int, default=1, help="Number of examples leased by a worker at a time.")
+@click.option("--workers", type=int, default=1, help="Number of workers running in parallel in this process.")
+def run_llm_campaign(campaign_id: str, retry_failed: bool, worker_id: str, lease_size: int, workers: int):
     """
     Run a LLM campaign by id.
     """
+    from concurrent.futures import ThreadPoolExecutor
+
     from factgenie import llm_campaign
     from factgenie.campaign import CampaignStatus
     from factgenie.models import ModelFactory
@@ -281,24 +318,68 @@ def run_llm_campaign(campaign_id: str):
     if campaign is None:
         raise ValueError(f"Campaign {campaign_id} not found.")
 
+    if retry_failed:
+        failed_cnt = llm_campaign.retry_failed_examples(app, campaign_id)
+        print(f"Retrying {failed_cnt} failed examples.")
+
     if campaign.metadata["status"] == CampaignStatus.FINISHED:
         print(f"Campaign {campaign_id} is already finished.")
         return
         # raise ValueError(f"Campaign {campaign_id} is already finished.")
 
-    if campaign.metadata["status"] == CampaignStatus.RUNNING:
-        raise ValueError(f"Campaign {campaign_id} is already running.")
+    # other workers can join a running campaign if its db is shared
+    if campaign.metadata["status"] == CampaignStatus.RUNNING and (
+        worker_id is None or not campaign.metadata.get("shared_db")
+    ):
+        raise ValueError(
+            f"Campaign {campaign_id} is already running. To run additional workers, all the workers have to be started with --worker_id."
+        )
+
+    # the db is locked and re-read on every update only if there are multiple workers
+    shared = worker_id is not None or workers > 1
 
     config = campaign.metadata["config"]
     mode = campaign.metadata["mode"]
-    model = ModelFactory.from_config(config, mode=mode)
     running_campaigns = app.db["running_campaigns"]
 
     app.db["running_campaigns"].add(campaign_id)
 
-    return llm_campaign.run_llm_campaign(
-        app, mode, campaign_id, announcer, campaign, datasets, model, running_campaigns
-    )
+    if workers == 1:
+        model = ModelFactory.from_config(config, mode=mode)
+
+        return llm_campaign.run_llm_campaign(
+            app,
+            mode,
+            campaign_id,
+            announcer,
+            campaign,
+            datasets,
+            model,
+            running_campaigns,
+            worker_id=worker_id,
+            lease_size=lease_size,
+            shared=shared,
+        )
+
+    def run_worker(i):
+        # each worker keeps its own model (with the token usage) and its own copy of the campaign db
+        with app.app_context():
+            return llm_campaign.run_llm_campaign(
+                app,
+                mode,
+                campaign_id,
+                announcer,
+                campaign.__class__(campaign_id),
+                datasets,
+                ModelFactory.from_config(config, mode=mode),
+                running_campaigns,
+                worker_id=f"{worker_id or llm_campaign.get_default_worker_id()}-{i}",
+                lease_size=lease_size,
+                shared=shared,
+            )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run_worker, range(workers)))
 
 
 @app.cli.command("save_generated_outputs")
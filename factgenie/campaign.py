@@ -1,17 +1,53 @@
 #!/usr/bin/env python3
 import ast
 import glob
+import heapq
+import itertools
 import json
 import logging
 import os
+import random
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
 from factgenie import CAMPAIGN_DIR
 
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, the db is then shared only by the threads of a single process
+    fcntl = None
+
 logger = logging.getLogger("factgenie")
 
+# locks of the campaign dbs used instead of the file locks if `fcntl` is not available
+thread_locks = {}
+thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def db_file_lock(lock_path):
+    """Exclusive lock over the db shared by multiple processes, or by multiple threads if file locks are not available."""
+    if fcntl is None:
+        with thread_locks_guard:
+            lock = thread_locks.setdefault(os.path.abspath(lock_path), threading.Lock())
+
+        with lock:
+            yield
+        return
+
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 
 class CampaignMode:
     CROWDSOURCING = "crowdsourcing"
@@ -31,6 +67,8 @@ class ExampleStatus:
     FREE = "free"
     ASSIGNED = "assigned"
     FINISHED = "finished"
+    # the example could not be processed even after retrying (LLM campaigns only)
+    FAILED = "failed"
 
 
 class Campaign:
@@ -42,8 +80,14 @@ class Campaign:
         self.campaign_id = campaign_id
         self.dir = os.path.join(CAMPAIGN_DIR, campaign_id)
         self.db_path = os.path.join(self.dir, "db.csv")
+        self.lock_path = os.path.join(self.dir, "db.lock")
         self.metadata_path = os.path.join(self.dir, "metadata.json")
 
+        # versions of the in-memory db, so that an older snapshot never overwrites a newer one on the disk
+        self.db_versions = itertools.count(1)
+        self.persisted_version = 0
+        self.persist_lock = threading.Lock()
+
         self.load_metadata()
         self.load_db()
 
@@ -78,7 +122,46 @@ class Campaign:
 
     def update_db(self, db):
         self.db = db
-        db.to_csv(self.db_path, index=False)
+        self.persist_db(next(self.db_versions), db)
+
+    def snapshot_db(self):
+        """
+        Copy of the current db for `persist_db()`.
+
+        Taking the snapshot is cheap compared to writing the db, so the snapshot can be taken while holding a lock over the db and written after the lock is released.
+        """
+        return next(self.db_versions), self.db.copy()
+
+    def persist_db(self, version, db):
+        """Write the db to the disk, unless a newer version of the db was already written."""
+        with self.persist_lock:
+            if version <= self.persisted_version:
+                return
+
+            # write to a temporary file first so that other processes never read a partially written db
+            tmp_path = f"{self.db_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            db.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, self.db_path)
+            self.db_mtime = os.path.getmtime(self.db_path)
+            self.persisted_version = version
+
+    @contextmanager
+    def locked_db(self):
+        """
+        Exclusive access to the db shared by multiple workers.
+
+        The db is re-read from the disk after acquiring the lock and the changes made to `self.db` inside the block are written back before the lock is released.
+        """
+        with db_file_lock(self.lock_path):
+            self.load_db()
+            db = self.db
+            yield db
+            self.update_db(db)
+
+    def refresh_db(self):
+        """Reload the db if it was modified by another worker."""
+        if os.path.exists(self.db_path) and os.path.getmtime(self.db_path) != getattr(self, "db_mtime", None):
+            self.load_db()
 
     def load_db(self):
         # do not assume db for external campaigns
@@ -86,13 +169,16 @@ class Campaign:
             self.db = pd.DataFrame()
             return
 
-        dtype_dict = {"annotator_id": str, "start": float, "end": float}
+        dtype_dict = {"annotator_id": str, "start": float, "end": float, "error": str, "lease_owner": str}
+        self.db_mtime = os.path.getmtime(self.db_path)
         with open(self.db_path) as f:
             self.db = pd.read_csv(f, dtype=dtype_dict)
 
     def update_metadata(self):
-        with open(self.metadata_path, "w") as f:
+        tmp_path = f"{self.metadata_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
             json.dump(self.metadata, f, indent=4)
+        os.replace(tmp_path, self.metadata_path)
 
     def load_metadata(self):
         with open(self.metadata_path) as f:
@@ -110,6 +196,18 @@ class Campaign:
         self.db["annotator_id"] = ""
         self.db["start"] = None
         self.db["end"] = None
+
+        if "attempts" in self.db.columns:
+            self.db["attempts"] = 0
+            self.db["error"] = ""
+
+        if "retry_after" in self.db.columns:
+            self.db["retry_after"] = None
+
+        if "lease_owner" in self.db.columns:
+            self.db["lease_owner"] = ""
+            self.db["lease_expires"] = None
+
         self.update_db(self.db)
 
         self.metadata["status"] = CampaignStatus.IDLE
@@ -121,6 +219,13 @@ class Campaign:
         self.db.loc[db_idx, "start"] = None
         self.db.loc[db_idx, "end"] = None
 
+        if "attempts" in self.db.columns:
+            self.db.loc[db_idx, "attempts"] = 0
+            self.db.loc[db_idx, "error"] = ""
+
+        if "retry_after" in self.db.columns:
+            self.db.loc[db_idx, "retry_after"] = None
+
         self.update_db(self.db)
 
         if self.metadata.get("status") == CampaignStatus.FINISHED:
@@ -157,25 +262,176 @@ class ExternalCampaign(Campaign):
         return {}
 
 
+class BatchAssignment:
+    """
+    In-memory index of the batch assignments of a crowdsourcing campaign, so that a batch can be assigned without scanning the campaign db.
+
+    The free batches are bucketed by their lowest annotator group: each bucket is a list with a position map (O(1) random selection and removal) and the non-empty buckets are kept in a heap (O(log n) lookup of the lowest group). Assigned batches are indexed by the annotator.
+    """
+
+    def __init__(self, db):
+        self.batch_rows = {}
+        self.batch_groups = {}
+        self.free = {}
+        self.free_pos = {}
+        self.group_heap = []
+        self.annotator_batches = {}
+        self.batch_annotators = {}
+
+        if db.empty or "batch_idx" not in db.columns:
+            return
+
+        # row labels sorted by the batch, split at the batch boundaries
+        batch_ids = db["batch_idx"].to_numpy()
+        order = np.argsort(batch_ids, kind="stable")
+        batches, starts = np.unique(batch_ids[order], return_index=True)
+        row_labels = np.split(db.index.to_numpy()[order], starts[1:])
+
+        self.batch_rows = {int(b): rows.tolist() for b, rows in zip(batches, row_labels)}
+        self.batch_groups = {int(b): int(g) for b, g in db.groupby("batch_idx")["annotator_group"].min().items()}
+
+        free_batches = db.loc[db["status"] == ExampleStatus.FREE, "batch_idx"].unique()
+        for batch_idx in sorted(int(b) for b in free_batches):
+            self.add_free(batch_idx)
+
+        # keep the first assigned batch of each annotator, same as the original row order
+        assigned = db[db["status"] == ExampleStatus.ASSIGNED].drop_duplicates("batch_idx")
+        for batch_idx, annotator_id in zip(assigned["batch_idx"], assigned["annotator_id"]):
+            batch_idx = int(batch_idx)
+            if batch_idx in self.free_pos:
+                continue
+            self.batch_annotators[batch_idx] = annotator_id
+            self.annotator_batches.setdefault(annotator_id, batch_idx)
+
+    def add_free(self, batch_idx):
+        if batch_idx in self.free_pos:
+            return
+
+        group = self.batch_groups[batch_idx]
+        bucket = self.free.get(group)
+
+        if not bucket:
+            bucket = self.free.setdefault(group, [])
+            heapq.heappush(self.group_heap, group)
+
+        self.free_pos[batch_idx] = len(bucket)
+        bucket.append(batch_idx)
+
+    def remove_free(self, batch_idx):
+        if batch_idx not in self.free_pos:
+            return
+
+        bucket = self.free[self.batch_groups[batch_idx]]
+        pos = self.free_pos.pop(batch_idx)
+
+        # swap with the last element so that the removal is O(1)
+        last = bucket.pop()
+        if last != batch_idx:
+            bucket[pos] = last
+            self.free_pos[last] = pos
+
+    def get_assigned_batch(self, annotator_id):
+        return self.annotator_batches.get(annotator_id)
+
+    def select_free_batch(self, rnd=random):
+        """Randomly select one of the free batches with the lowest annotator group, or return None if there is none."""
+        # the buckets emptied since they were pushed to the heap are removed lazily
+        while self.group_heap and not self.free.get(self.group_heap[0]):
+            self.free.pop(heapq.heappop(self.group_heap), None)
+
+        if not self.group_heap:
+            return None
+
+        return rnd.choice(self.free[self.group_heap[0]])
+
+    def assign(self, batch_idx, annotator_id):
+        self.remove_free(batch_idx)
+        self._remove_annotator(batch_idx)
+
+        self.batch_annotators[batch_idx] = annotator_id
+        self.annotator_batches.setdefault(annotator_id, batch_idx)
+
+    def release(self, batch_idx):
+        self._remove_annotator(batch_idx)
+        self.add_free(batch_idx)
+
+    def finish(self, batch_idx):
+        self._remove_annotator(batch_idx)
+        self.remove_free(batch_idx)
+
+    def _remove_annotator(self, batch_idx):
+        annotator_id = self.batch_annotators.pop(batch_idx, None)
+
+        if annotator_id is not None and self.annotator_batches.get(annotator_id) == batch_idx:
+            del self.annotator_batches[annotator_id]
+
+
 class HumanCampaign(Campaign):
-    def __init__(self, campaign_id, scheduler):
+    def __init__(self, campaign_id, scheduler, locks):
         super().__init__(campaign_id)
 
+        # the per-campaign locks shared with the request handlers (`app.db["locks"]`), guarding the db and the batch assignment
+        self.locks = locks
+
+        # the data displayed on the annotation page for each example, see `crowdsourcing.add_batch_payloads()`
+        self.payload_cache = OrderedDict()
+        self.payload_lock = threading.Lock()
+
         scheduler.add_job(
             self.check_idle_time, "interval", minutes=1, id=f"idle_time_{self.campaign_id}", replace_existing=True
         )
 
+    @property
+    def batch_assignment(self):
+        """The batch assignment index, rebuilt whenever the db is replaced (e.g. after it is reloaded from the disk)."""
+        if getattr(self, "_batch_assignment_db", None) is not self.db:
+            self._batch_assignment = BatchAssignment(self.db)
+            self._batch_assignment_db = self.db
+
+        return self._batch_assignment
+
     def check_idle_time(self):
-        current_time = datetime.now()
-        for _, example in self.db.iterrows():
-            if (
-                example.status == ExampleStatus.ASSIGNED
-                and (current_time - datetime.fromtimestamp(example.start)).total_seconds()
-                > self.metadata["config"]["idle_time"] * 60
-            ):
-                logger.info(f"Freeing example {example.example_idx} for {self.campaign_id} due to idle time")
-                db_index = example.name
-                self.clear_output_by_idx(db_index)
+        # all the idle examples are released in memory under the lock, the db is written once after the lock is released
+        with self.locks.lock(self.campaign_id):
+            if self.db.empty:
+                return
+
+            idle_limit = datetime.now().timestamp() - self.metadata["config"]["idle_time"] * 60
+            idle = (self.db["status"] == ExampleStatus.ASSIGNED) & (self.db["start"] < idle_limit)
+
+            if not idle.any():
+                return
+
+            for example_idx in self.db.loc[idle, "example_idx"]:
+                logger.info(f"Freeing example {example_idx} for {self.campaign_id} due to idle time")
+
+            batch_assignment = self.batch_assignment
+            self.db.loc[idle, "status"] = ExampleStatus.FREE
+            self.db.loc[idle, "annotator_id"] = ""
+            self.db.loc[idle, "start"] = None
+            self.db.loc[idle, "end"] = None
+
+            if "batch_idx" in self.db.columns:
+                for batch_idx in self.db.loc[idle, "batch_idx"].unique():
+                    batch_assignment.release(int(batch_idx))
+
+            snapshot = self.snapshot_db()
+
+        self.persist_db(*snapshot)
+
+    def clear_output_by_idx(self, db_idx):
+        # must be called with the campaign lock held
+        super().clear_output_by_idx(db_idx)
+
+        if "batch_idx" in self.db.columns:
+            self.batch_assignment.release(int(self.db.loc[db_idx, "batch_idx"]))
+
+    def clear_all_outputs(self):
+        with self.locks.lock(self.campaign_id):
+            super().clear_all_outputs()
+
+            # the db was modified in place
+            self._batch_assignment_db = None
 
     def get_stats(self):
         # if there is no batch_idx in the db, return the stats for the whole db
@@ -193,16 +449,15 @@ class HumanCampaign(Campaign):
         }
 
     def clear_output(self, idx):
-        self.load_db()
-        examples_for_batch = self.db[self.db["batch_idx"] == idx]
-
-        for _, example in examples_for_batch.iterrows():
-            db_index = example.name
-            self.clear_output_by_idx(db_index)
+        # the in-memory db is the source of truth, the db on the disk may not contain the latest assignments yet
+        with self.locks.lock(self.campaign_id):
+            for db_index in self.batch_assignment.batch_rows.get(idx, []):
+                self.clear_output_by_idx(db_index)
 
     def get_overview(self):
-        self.load_db()
-        df = self.db.copy()
+        with self.locks.lock(self.campaign_id):
+            df = self.db.copy()
+
         # replace NaN with empty string
         df = df.where(pd.notnull(df), "")
 
@@ -237,12 +492,40 @@ class HumanCampaign(Campaign):
 
 
 class LLMCampaign(Campaign):
-    def get_stats(self):
-        return {
+    def get_stats(self, refresh=True):
+        # the progress of other workers
+        if refresh:
+            self.refresh_db()
+
+        stats = {
             "total": len(self.db),
             "finished": len(self.db[self.db["status"] == ExampleStatus.FINISHED]),
             "free": len(self.db[self.db["status"] == ExampleStatus.FREE]),
+            "failed": len(self.db[self.db["status"] == ExampleStatus.FAILED]),
         }
+        # number of model calls saved by annotating identical outputs only once
+        if "dedup_key" in self.db.columns:
+            stats["deduplicated"] = len(self.db) - self.db["dedup_key"].nunique()
+
+        return stats
+
+    def reset_failed_examples(self):
+        """Return the failed examples to the pool of free examples so that they are processed in the next run."""
+        # the workers may be running
+        with self.locked_db() as db:
+            failed = db["status"] == ExampleStatus.FAILED
+
+            db.loc[failed, "status"] = ExampleStatus.FREE
+            db.loc[failed, "annotator_id"] = ""
+            db.loc[failed, "start"] = None
+            db.loc[failed, "end"] = None
+            db.loc[failed, "attempts"] = 0
+            db.loc[failed, "error"] = ""
+
+            if "retry_after" in db.columns:
+                db.loc[failed, "retry_after"] = None
+
+        return int(failed.sum())
 
     def clear_output(self, idx):
         example_row = self.db[self.db["example_idx"] == idx].iloc[0]
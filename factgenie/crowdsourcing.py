@@ -20,6 +20,9 @@ from factgenie.campaign import CampaignMode, ExampleStatus
 
 logger = logging.getLogger("factgenie")
 
+# number of examples for which the data displayed on the annotation page are cached in each campaign
+PAYLOAD_CACHE_SIZE = 10000
+
 
 def create_crowdsourcing_campaign(app, campaign_id, config, campaign_data):
     # create a new directory
@@ -282,40 +285,30 @@ def parse_crowdsourcing_config(config):
     return config
 
 
-def select_batch(db, seed, annotator_id):
-    # If the annotator already has any examples with ExampleStatus.ASSIGNED, return that batch
+def select_batch(batch_assignment, annotator_id, rnd=random):
+    # If the annotator already has a batch with ExampleStatus.ASSIGNED, return that batch
     if annotator_id != PREVIEW_STUDY_ID:
-        if not db.loc[(db["annotator_id"] == annotator_id) & (db["status"] == ExampleStatus.ASSIGNED)].empty:
-            assigned_batch = db.loc[
-                (db["annotator_id"] == annotator_id) & (db["status"] == ExampleStatus.ASSIGNED)
-            ].iloc[0]
-            logging.info(f"Reusing batch {assigned_batch['batch_idx']}")
-            return assigned_batch["batch_idx"]
-
-    # Choose from the batches with the lowest annotator group
-    free_batches = db[db["status"] == ExampleStatus.FREE]
-    eligible_batches = free_batches.groupby("batch_idx")["annotator_group"].min()
-
-    eligible_batches = eligible_batches[eligible_batches == eligible_batches.min()]
+        assigned_batch_idx = batch_assignment.get_assigned_batch(annotator_id)
 
-    eligible_examples = free_batches[free_batches["batch_idx"].isin(eligible_batches.index)]
+        if assigned_batch_idx is not None:
+            logging.info(f"Reusing batch {assigned_batch_idx}")
+            return assigned_batch_idx
 
-    # Randomly select an example (with its batch) from the eligible ones
-    if not eligible_examples.empty:
-        selected_example = eligible_examples.sample(n=1, random_state=seed).iloc[0]
-        selected_batch_idx = selected_example["batch_idx"]
+    # Randomly choose from the batches with the lowest annotator group
+    selected_batch_idx = batch_assignment.select_free_batch(rnd)
 
+    if selected_batch_idx is not None:
         logging.info(f"Selected batch {selected_batch_idx}")
         return selected_batch_idx
     else:
         raise ValueError("No available batches")
 
 
-def get_examples_for_batch(db, batch_idx):
+def get_examples_for_batch(db, batch_idx, rows=None):
     annotator_batch = []
 
     # find all examples for this batch and annotator group
-    batch_examples = db[db["batch_idx"] == batch_idx]
+    batch_examples = db.loc[rows] if rows is not None else db[db["batch_idx"] == batch_idx]
 
     for _, row in batch_examples.iterrows():
         annotator_batch.append(
@@ -332,21 +325,68 @@ def get_examples_for_batch(db, batch_idx):
     return annotator_batch
 
 
+def add_batch_payloads(app, campaign, annotation_set):
+    """
+    Attach the rendered example and the model output to each example of the batch, so that the annotation page does not need to request them separately.
+
+    The payloads are cached with the campaign (up to `PAYLOAD_CACHE_SIZE` examples), as the same examples are shown to the annotators of all the annotator groups. Each payload is stored with the version of the output index it was created from and it is not used once the outputs are regenerated or deleted.
+    """
+    # the output index is replaced (not modified) on every update
+    output_index = app.db["output_index"]
+
+    for example in annotation_set:
+        key = (example["dataset"], example["split"], example["setup_id"], int(example["example_idx"]))
+        payload = None
+
+        with campaign.payload_lock:
+            cached = campaign.payload_cache.get(key)
+            if cached is not None and cached[0] is output_index and output_index is not None:
+                payload = cached[1]
+                campaign.payload_cache.move_to_end(key)
+
+        if payload is None:
+            dataset_id, split, setup_id, example_idx = key
+
+            try:
+                data = workflows.get_example_data(app, dataset_id, split, example_idx, setup_id)
+            except Exception as e:
+                # the annotation page requests the example itself
+                logger.warning(f"Cannot prepare the example {key} for the annotation page: {e}")
+                continue
+
+            # the annotations from other campaigns are not shown on the annotation page
+            output = {k: v for k, v in data["generated_outputs"][0].items() if k != "annotations"}
+            payload = {"html": data["html"], "generated_outputs": output}
+
+            with campaign.payload_lock:
+                campaign.payload_cache[key] = (output_index, payload)
+                campaign.payload_cache.move_to_end(key)
+
+                if len(campaign.payload_cache) > PAYLOAD_CACHE_SIZE:
+                    campaign.payload_cache.popitem(last=False)
+
+        example["payload"] = payload
+
+    return annotation_set
+
+
 def get_annotator_batch(app, campaign, service_ids, batch_idx=None):
-    db = campaign.db
+    annotator_id = service_ids["annotator_id"]
+    snapshot = None
 
-    # simple locking over the CSV file to prevent double writes
-    with app.db["lock"]:
-        annotator_id = service_ids["annotator_id"]
+    # only the state transition is done under the campaign lock, the db is written after the lock is released
+    with app.db["locks"].lock(campaign.campaign_id):
+        db = campaign.db
+        batch_assignment = campaign.batch_assignment
 
         logger.info(f"Acquiring lock for {annotator_id}")
         start = int(time.time())
-        seed = random.seed(str(start) + str(service_ids.values()))
+        rnd = random.Random(str(start) + str(service_ids.values()))
 
         if not batch_idx:
             # usual case: an annotator opened the annotation page, we need to select the batch
             try:
-                batch_idx = select_batch(db, seed, annotator_id)
+                batch_idx = select_batch(batch_assignment, annotator_id, rnd)
             except ValueError as e:
                 logger.info(str(e))
                 # no available batches
@@ -355,19 +395,23 @@ def get_annotator_batch(app, campaign, service_ids, batch_idx=None):
             # preview mode with the specific batch
             batch_idx = int(batch_idx)
 
-        mask = db["batch_idx"] == batch_idx
+        rows = batch_assignment.batch_rows.get(batch_idx, [])
 
         # we do not block the example if we are in preview mode
         if annotator_id != PREVIEW_STUDY_ID:
-            db.loc[mask, "status"] = ExampleStatus.ASSIGNED
-            db.loc[mask, "start"] = start
-            db.loc[mask, "annotator_id"] = annotator_id
+            db.loc[rows, "status"] = ExampleStatus.ASSIGNED
+            db.loc[rows, "start"] = start
+            db.loc[rows, "annotator_id"] = annotator_id
 
-            campaign.update_db(db)
+            batch_assignment.assign(batch_idx, annotator_id)
+            snapshot = campaign.snapshot_db()
 
-        annotator_batch = get_examples_for_batch(db, batch_idx)
+        annotator_batch = get_examples_for_batch(db, batch_idx, rows=rows)
         logging.info(f"Releasing lock for {annotator_id}")
 
+    if snapshot:
+        campaign.persist_db(*snapshot)
+
     return annotator_batch
 
 
@@ -377,16 +421,20 @@ def save_annotations(app, campaign_id, annotation_set, annotator_id):
     save_dir = os.path.join(CAMPAIGN_DIR, campaign_id, "files")
     os.makedirs(save_dir, exist_ok=True)
     campaign = workflows.load_campaign(app, campaign_id=campaign_id)
+    batch_idx = annotation_set[0]["batch_idx"]
+
+    # the related model outputs are saved with the annotations, they are retrieved before taking the lock as the output index may need to be loaded
+    keys = [(ann["dataset"], ann["split"], ann["setup_id"], int(ann["example_idx"])) for ann in annotation_set]
+    outputs = workflows.get_outputs_for_keys(app, keys)
 
-    with app.db["lock"]:
+    with app.db["locks"].lock(campaign_id):
         db = campaign.db
-        batch_idx = annotation_set[0]["batch_idx"]
 
         # select the examples for this batch and annotator group
-        mask = db["batch_idx"] == batch_idx
+        rows = campaign.batch_assignment.batch_rows[batch_idx]
 
         # if the batch is not assigned to this annotator, return an error
-        batch_annotator_id = db.loc[mask].iloc[0]["annotator_id"]
+        batch_annotator_id = db.loc[rows[0], "annotator_id"]
 
         if batch_annotator_id != annotator_id and annotator_id != PREVIEW_STUDY_ID:
             logger.info(
@@ -394,30 +442,44 @@ def save_annotations(app, campaign_id, annotation_set, annotator_id):
             )
             return utils.error(f"Batch not assigned to annotator {annotator_id}")
 
+        # the annotations have to be for the examples of the batch, in the same order
+        batch_keys = [
+            (row["dataset"], row["split"], row["setup_id"], int(row["example_idx"]))
+            for row in db.loc[rows, ["dataset", "split", "setup_id", "example_idx"]].to_dict(orient="records")
+        ]
+
+        if batch_keys != keys:
+            logger.info(f"Annotations rejected: examples do not match batch {batch_idx} in {campaign_id}")
+            return utils.error(f"Annotated examples do not match batch {batch_idx}")
+
+        # the batch stays assigned if any output is missing
+        missing = [key[3] for key, output in zip(keys, outputs) if output is None]
+
+        if missing:
+            logger.error(
+                f"Annotations rejected: no outputs for examples {missing} of batch {batch_idx} in {campaign_id}"
+            )
+            return utils.error(f"Model outputs for examples {missing} not found")
+
         # update the db
-        db.loc[mask, "status"] = ExampleStatus.FINISHED
-        db.loc[mask, "end"] = now
-        campaign.update_db(db)
-
-        # save the annotations
-        for i, ann in enumerate(annotation_set):
-            row = db.loc[mask].iloc[i]
-
-            # retrieve the related model output to save it with the annotations
-            output = workflows.get_output_for_setup(
-                dataset=row["dataset"],
-                split=row["split"],
-                setup_id=row["setup_id"],
-                example_idx=row["example_idx"],
-                app=app,
-                force_reload=False,
-            )["output"]
-
-            annotations = ann["annotations"]
-            # remove empty annotations
-            annotations = [a for a in annotations if a["text"]]
-
-            res = {
+        db.loc[rows, "status"] = ExampleStatus.FINISHED
+        db.loc[rows, "end"] = now
+        campaign.batch_assignment.finish(batch_idx)
+
+        batch_rows = db.loc[rows].to_dict(orient="records")
+        snapshot = campaign.snapshot_db()
+
+    campaign.persist_db(*snapshot)
+
+    results = []
+
+    for ann, output in zip(annotation_set, outputs):
+        annotations = ann["annotations"]
+        # remove empty annotations
+        annotations = [a for a in annotations if a["text"]]
+
+        results.append(
+            {
                 "annotations": annotations,
                 "flags": ann["flags"],
                 "options": ann["options"],
@@ -425,16 +487,18 @@ def save_annotations(app, campaign_id, annotation_set, annotator_id):
                 "text_fields": ann["textFields"],
                 "time_last_saved": ann.get("timeLastSaved"),
                 "time_last_accessed": ann.get("timeLastAccessed"),
-                "output": output,
+                "output": output["output"],
             }
-            # save the record to a JSONL file
-            workflows.save_record(
-                mode=CampaignMode.CROWDSOURCING,
-                campaign=campaign,
-                row=row,
-                result=res,
-            )
-        logger.info(f"Annotations for {campaign_id} (batch {batch_idx}, annotator {annotator_id}) saved.")
+        )
+
+    # save the records to a JSONL file
+    workflows.save_records(
+        mode=CampaignMode.CROWDSOURCING,
+        campaign=campaign,
+        rows=batch_rows,
+        results=results,
+    )
+    logger.info(f"Annotations for {campaign_id} (batch {batch_idx}, annotator {annotator_id}) saved.")
 
     final_message_html = markdown.markdown(campaign.metadata["config"]["final_message"])
 
@@ -10,11 +10,15 @@ import zipfile
 from pathlib import Path
 
 import json2table
-import pandas as pd
 import requests
-from natsort import natsorted
 
 from factgenie.datasets.dataset import Dataset
+from factgenie.datasets.indexed import (
+    DirectoryExamples,
+    IndexedJSONFile,
+    IndexedJSONLFile,
+    TableExamples,
+)
 from factgenie.utils import resumable_download
 
 
@@ -108,6 +112,19 @@ class JSONDataset(BasicDataset):
                 examples = json.load(f)
         return examples
 
+    def open_examples(self, split, data_path):
+        examples_path = data_path / f"{split}.json"
+
+        if not examples_path.exists():
+            return None
+
+        try:
+            return IndexedJSONFile(examples_path)
+        except ValueError as e:
+            # e.g., a dictionary on the top level, the whole file is loaded with `load_examples()`
+            logger.info(f"Loading {examples_path} without an index: {e}")
+            return None
+
     def render(self, example):
         # default method, can be overwritten by dataset classes
         html = json2table.convert(
@@ -130,6 +147,9 @@ class JSONLDataset(BasicDataset):
 
         return examples
 
+    def open_examples(self, split, data_path):
+        return IndexedJSONLFile(f"{data_path}/{split}.jsonl")
+
     def render(self, example):
         # default method, can be overwritten by dataset classes
         html = json2table.convert(
@@ -144,17 +164,12 @@ class JSONLDataset(BasicDataset):
 
 class CSVDataset(BasicDataset):
     def load_examples(self, split, data_path):
-        # load the corresponding CSV file
-        # each example will be a key-value pair where the key is the column name and the value is the value in the row
-        examples = []
+        # each example is a dictionary with the column names as keys, created only when the example is accessed
+        return TableExamples(f"{data_path}/{split}.csv")
 
-        csv = pd.read_csv(f"{data_path}/{split}.csv")
-
-        for _, row in csv.iterrows():
-            example = dict(row)
-            examples.append(example)
-
-        return examples
+    def open_examples(self, split, data_path):
+        # the table is reloaded from its columnar copy if the CSV file has not changed
+        return TableExamples(f"{data_path}/{split}.csv", cache=True)
 
     def render(self, example):
         html = (
@@ -173,26 +188,28 @@ class CSVDataset(BasicDataset):
 
 
 class HTMLDataset(BasicDataset):
+    def __init__(self, dataset_id, **kwargs):
+        # the files are read when the examples are accessed, unless `lazy_loading` is disabled in the dataset config
+        kwargs.setdefault("lazy_loading", True)
+        super().__init__(dataset_id, **kwargs)
+
     def load_examples(self, split, data_path):
         # load the HTML files in the directory, sorted by filename numerically
-        examples = []
-        split_dir = Path(f"{data_path}/{split}")
-        filenames = natsorted(split_dir.iterdir())
+        return list(self.open_examples(split, data_path))
 
-        for filename in filenames:
-            if filename.suffix == ".html":
-                with open(filename) as f:
-                    content = f.read()
+    def open_examples(self, split, data_path):
+        return DirectoryExamples(Path(f"{data_path}/{split}"), ".html", read=lambda path: self.read_html(split, path))
 
-                    # we need to redirect all the calling for the assets to the correct path
-                    # the assets are served by the "/files" endpoint
-                    path = f"/files/{self.id}/{split}"
+    def read_html(self, split, path):
+        with open(path) as f:
+            content = f.read()
 
-                    # replace the paths in the HTML content
-                    content = re.sub(r'src="', f'src="{path}/', content)
-                    examples.append(content)
+        # we need to redirect all the calling for the assets to the correct path
+        # the assets are served by the "/files" endpoint
+        path = f"/files/{self.id}/{split}"
 
-        return examples
+        # replace the paths in the HTML content
+        return re.sub(r'src="', f'src="{path}/', content)
 
     def render(self, example):
         return example
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import importlib
 import inspect
+import itertools
 import json
 import logging
 import os
@@ -13,9 +14,13 @@ import requests
 from slugify import slugify
 
 from factgenie import INPUT_DIR, OUTPUT_DIR
+from factgenie.datasets.indexed import LazyExamples
 
 logger = logging.getLogger("factgenie")
 
+# incremented whenever a split of any dataset is loaded, see `Dataset.get_split_version()`
+split_versions = itertools.count(1)
+
 
 def get_dataset_classes():
     module_name = "factgenie.datasets"
@@ -47,10 +52,16 @@ class Dataset(ABC):
         self.splits = kwargs.get("splits", ["train", "dev", "test"])
         self.description = kwargs.get("description", "")
 
+        # load the examples on demand instead of loading the whole split (if supported by the dataset class)
+        self.lazy_loading = kwargs.get("lazy_loading", False)
+        # number of the lazily loaded examples cached for each split
+        self.example_cache_size = kwargs.get("example_cache_size", 1000)
+
         # Initialize placeholder for examples, to be loaded lazily
         # self.examples will store the actual loaded data for each split,
         # initially None.
         self.examples = {split: None for split in self.splits}
+        self.versions = {}
 
     # --------------------------------
     # TODO: implement in subclasses
@@ -129,6 +140,26 @@ class Dataset(ABC):
         """
         pass
 
+    def open_examples(self, split, data_path):
+        """
+        Open the examples for random access without loading them into memory. Used if `lazy_loading` is enabled in the dataset config.
+
+        Does not need to be implemented, the whole split is then loaded with `load_examples()`.
+
+        Parameters
+        ----------
+        split : str
+            Split to open.
+        data_path : str
+            Path to the data directory.
+
+        Returns
+        -------
+        examples : IndexedFile or None
+            Sequence of the examples (see `factgenie.datasets.indexed`), or None if lazy loading is not supported for the split.
+        """
+        return None
+
     # --------------------------------
     # end TODO
     # --------------------------------
@@ -138,12 +169,31 @@ class Dataset(ABC):
         if split not in self.splits:
             raise ValueError(f"Split '{split}' is not configured for this dataset. Available splits: {self.splits}")
 
+        examples = self.examples.get(split)
+
+        # the lazily loaded examples are re-opened if the file has changed
+        if isinstance(examples, LazyExamples) and not examples.is_current():
+            examples.close()
+            self.examples[split] = None
+
+        if self.examples.get(split) is not None:
+            return
+
+        if self.lazy_loading:
+            source = self.open_examples(split=split, data_path=self.data_path)
+
+            if source is not None:
+                # postprocess_data is applied to each example separately when accessed
+                self.examples[split] = LazyExamples(source, self.postprocess_data, cache_size=self.example_cache_size)
+
         if self.examples.get(split) is None:
             examples_for_split = self.load_examples(split=split, data_path=self.data_path)
             # Assumes postprocess_data takes a list of examples for one split
             # and returns a list of postprocessed examples for that split.
             self.examples[split] = self.postprocess_data(examples=examples_for_split)
 
+        self.versions[split] = next(split_versions)
+
     def postprocess_data(self, examples):
         """
         Postprocess the data after loading.
@@ -166,6 +216,14 @@ class Dataset(ABC):
             raise IndexError(f"Examples for split '{split}' are None, cannot retrieve index {example_idx}.")
         return self.examples[split][example_idx]
 
+    def get_split_version(self, split):
+        """
+        Get the version of the loaded examples for the given split, unique across all the datasets. The version changes whenever the split is (re)loaded.
+        """
+        self._ensure_split_loaded(split)
+        # the examples may also be loaded by the subclass
+        return self.versions.setdefault(split, next(split_versions))
+
     def get_example_count(self, split=None):
         """
         Get the number of examples in the dataset.
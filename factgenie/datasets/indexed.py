@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+# Random access to the examples in large data files without loading the whole files into memory.
+#
+# The byte offsets of the examples are stored in an index next to the data file (in the `.index` subdirectory), so that the file is scanned only once. The index is rebuilt whenever the size or the modification time of the file changes.
+#
+# Tabular data are kept in columns and a copy of the table in the Parquet format is stored in the same directory for faster reloads.
+
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from natsort import natsorted
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # the tables are then always parsed from the original files
+    pa = None
+
+logger = logging.getLogger("factgenie")
+
+INDEX_DIR = ".index"
+# size of the chunks in which the files are scanned when building the index
+CHUNK_SIZE = 64 * 1024 * 1024
+WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+NUMBER_CHARS = set("0123456789.eE+-")
+
+
+def get_file_version(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_index_path(path):
+    path = Path(path)
+    return path.parent / INDEX_DIR / f"{path.name}.npy"
+
+
+def load_index(path):
+    """Load the offsets of the examples in the file, or return None if there is no up-to-date index."""
+    try:
+        index = np.load(get_index_path(path))
+    except (OSError, ValueError):
+        return None
+
+    # the first row identifies the version of the indexed file
+    if index.ndim != 2 or tuple(index[0]) != get_file_version(path):
+        return None
+
+    return index[1:]
+
+
+def save_index(path, offsets):
+    index_path = get_index_path(path)
+    index = np.vstack([np.array([get_file_version(path)], dtype=np.int64), offsets])
+
+    try:
+        os.makedirs(index_path.parent, exist_ok=True)
+        tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+
+        with open(tmp_path, "wb") as f:
+            np.save(f, index)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        # the index is then rebuilt after every restart
+        logger.warning(f"Cannot save the index for {path}: {e}")
+
+
+def build_line_index(path):
+    """
+    Scan the file for the line breaks.
+
+    Returns:
+        An array of shape (n, 2) with the start and end offsets of the non-empty lines.
+    """
+    newlines = []
+    size = 0
+
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            newlines.append(np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n")) + size)
+            size += len(chunk)
+
+    newlines = np.concatenate(newlines) if newlines else np.array([], dtype=np.int64)
+    starts = np.concatenate([[0], newlines + 1])
+    ends = np.concatenate([newlines, [size]])
+    offsets = np.stack([starts, ends], axis=1).astype(np.int64)
+
+    return offsets[ends > starts]
+
+
+def build_array_index(path, chunk_size=CHUNK_SIZE):
+    """
+    Parse the top-level JSON array in the file incrementally, keeping only a chunk of the file in memory.
+
+    Returns:
+        An array of shape (n, 2) with the start and end offsets of the array elements.
+
+    Raises:
+        ValueError: if the top level of the file is not an array or the file is not a valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    offsets = []
+
+    with open(path, encoding="utf-8", newline="") as f:
+        buffer, pos, eof = "", 0, False
+        # byte offset of `buffer[pos]`
+        byte_pos = 0
+
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+
+        def advance(end):
+            nonlocal pos, byte_pos
+            byte_pos += len(buffer[pos:end].encode("utf-8"))
+            pos = end
+
+        def next_char():
+            # skip the whitespace and return the next character
+            while True:
+                advance(WHITESPACE_RE.match(buffer, pos).end())
+                if pos < len(buffer) or eof:
+                    return buffer[pos : pos + 1]
+                fill()
+
+        fill()
+        if next_char() != "[":
+            raise ValueError(f"The top level of {path} is not an array")
+        advance(pos + 1)
+
+        if next_char() == "]":
+            return np.empty((0, 2), dtype=np.int64)
+
+        while True:
+            next_char()
+
+            # the element may continue in the next chunk (a number followed by a digit, ".", "e", etc. as well)
+            while True:
+                try:
+                    _, end = decoder.raw_decode(buffer, pos)
+                    if eof or (end < len(buffer) and buffer[end] not in NUMBER_CHARS):
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise ValueError(f"Invalid JSON in {path}")
+                fill()
+
+            start = byte_pos
+            advance(end)
+            offsets.append((start, byte_pos))
+
+            char = next_char()
+            if char == "]":
+                break
+            if char != ",":
+                raise ValueError(f"Invalid JSON in {path}")
+            advance(pos + 1)
+
+    return np.array(offsets, dtype=np.int64)
+
+
+class IndexedFile:
+    """
+    Read-only sequence of the examples in a file, each decoded from its byte range in the memory-mapped file.
+
+    Subclasses implement `build_index()`.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.version = get_file_version(self.path)
+
+        self.offsets = load_index(self.path)
+        if self.offsets is None:
+            logger.info(f"Indexing {self.path}")
+            self.offsets = self.build_index()
+            save_index(self.path, self.offsets)
+
+        with open(self.path, "rb") as f:
+            # an empty file cannot be memory-mapped
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.version[0] else b""
+
+    def build_index(self):
+        raise NotImplementedError
+
+    def is_current(self):
+        """Whether the file was not modified since it was opened."""
+        try:
+            return get_file_version(self.path) == self.version
+        except OSError:
+            return False
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx]
+        return json.loads(self.data[start:end])
+
+
+class IndexedJSONLFile(IndexedFile):
+    """Examples on the lines of a JSONL file."""
+
+    def build_index(self):
+        return build_line_index(self.path)
+
+
+class IndexedJSONFile(IndexedFile):
+    """Elements of a JSON file with an array on the top level."""
+
+    def build_index(self):
+        return build_array_index(self.path)
+
+
+def get_table_cache_path(path):
+    path = Path(path)
+    return path.parent / INDEX_DIR / f"{path.name}.parquet"
+
+
+def load_table_cache(path):
+    """Load the table from its Parquet copy, or return None if there is no up-to-date copy."""
+    if pa is None:
+        return None
+
+    cache_path = get_table_cache_path(path)
+
+    try:
+        metadata = pq.read_schema(cache_path).metadata or {}
+
+        if metadata.get(b"factgenie_version") != json.dumps(get_file_version(path)).encode():
+            return None
+
+        return pq.read_table(cache_path).to_pandas()
+    except (OSError, pa.ArrowException):
+        return None
+
+
+def save_table_cache(path, table):
+    if pa is None:
+        return
+
+    cache_path = get_table_cache_path(path)
+
+    try:
+        arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+        metadata = {**(arrow_table.schema.metadata or {}), b"factgenie_version": json.dumps(get_file_version(path))}
+        arrow_table = arrow_table.replace_schema_metadata(metadata)
+
+        os.makedirs(cache_path.parent, exist_ok=True)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        pq.write_table(arrow_table, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except (OSError, pa.ArrowException) as e:
+        logger.warning(f"Cannot save the columnar copy of {path}: {e}")
+
+
+class TableExamples:
+    """
+    Read-only sequence of the rows of a table, each returned as a dictionary when accessed.
+
+    The table is kept in typed columns instead of a dictionary for each row. If `cache` is set, the table is loaded from (and saved to) its Parquet copy in the `.index` directory.
+    """
+
+    def __init__(self, path, cache=False):
+        self.path = Path(path)
+        self.version = get_file_version(self.path)
+
+        self.table = load_table_cache(self.path) if cache else None
+        if self.table is None:
+            self.table = pd.read_csv(self.path)
+
+            if cache:
+                save_table_cache(self.path, self.table)
+
+        self.columns = list(self.table.columns)
+
+    def is_current(self):
+        try:
+            return get_file_version(self.path) == self.version
+        except OSError:
+            return False
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Example index {idx} out of range")
+
+        example = {}
+
+        for i, column in enumerate(self.columns):
+            value = self.table.iat[idx, i]
+            # numpy scalars are converted to Python types
+            example[column] = value.item() if isinstance(value, np.generic) else value
+
+        return example
+
+
+class DirectoryExamples:
+    """
+    Read-only sequence of the examples stored in separate files, each read with `read(path)` when accessed.
+
+    Only the list of the files with the given suffix (sorted naturally by their names) is kept in memory.
+    """
+
+    def __init__(self, directory, suffix, read):
+        self.directory = Path(directory)
+        self.read = read
+        self.version = os.stat(self.directory).st_mtime_ns
+        # only the names are sorted, the paths are the same up to the name
+        self.filenames = natsorted(entry.name for entry in os.scandir(self.directory) if entry.name.endswith(suffix))
+
+    def is_current(self):
+        # adding, removing or renaming a file changes the modification time of the directory
+        try:
+            return os.stat(self.directory).st_mtime_ns == self.version
+        except OSError:
+            return False
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, idx):
+        return self.read(self.directory / self.filenames[idx])
+
+
+class LazyExamples:
+    """
+    Examples of a split loaded on demand from an indexed file, used in place of the list of examples.
+
+    The examples are postprocessed one by one when accessed. The most recently used examples are kept in a cache of `cache_size` examples.
+    """
+
+    def __init__(self, source, postprocess, cache_size=1000):
+        self.source = source
+        self.postprocess = postprocess
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def is_current(self):
+        return self.source.is_current()
+
+    def close(self):
+        self.source.close()
+
+    def __len__(self):
+        return len(self.source)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Example index {idx} out of range")
+
+        with self.lock:
+            if idx in self.cache:
+                self.cache.move_to_end(idx)
+                return self.cache[idx]
+
+        example = self.postprocess(examples=[self.source[idx]])[0]
+
+        with self.lock:
+            self.cache[idx] = example
+
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return example
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# Offline estimate of the number of tokens, the cost and the duration of an LLM campaign before running it.
+
+import glob
+import json
+import logging
+import os
+
+import factgenie.workflows as workflows
+from factgenie import CAMPAIGN_DIR
+from factgenie.campaign import CampaignMode
+from factgenie.llm_campaign import generate_llm_campaign_db, get_example_groups
+from factgenie.models import Model, ModelFactory
+
+logger = logging.getLogger("factgenie")
+
+# number of output tokens per output assumed if the model was not used before and `max_tokens` is not set
+DEFAULT_OUTPUT_TOKENS = 300
+# number of prompts rendered before they are tokenized together
+CHUNK_SIZE = 1000
+# number of the most recent records of the model used for the estimate
+MAX_HISTORY_RECORDS = 5000
+
+
+def get_tokenizer():
+    """
+    Local tokenizer for counting the tokens in the prompts.
+
+    The tokenizer bundled with LiteLLM (cl100k) is used for all the models, which is a good enough approximation for the estimate and does not require downloading the tokenizer of the particular model. If it is not available, the number of tokens is approximated by the number of characters.
+    """
+    try:
+        import litellm
+
+        return litellm.encoding
+    except Exception as e:
+        logger.warning(f"Tokenizer not available, approximating the number of tokens by characters: {e}")
+        return None
+
+
+def count_tokens(texts, tokenizer, num_threads=None):
+    """Number of tokens in each text. The texts are tokenized in parallel threads of the tokenizer (which releases the GIL) if there is more than one CPU."""
+    if tokenizer is None:
+        return [len(text) // 4 for text in texts]
+
+    num_threads = num_threads or os.cpu_count() or 1
+
+    if num_threads == 1:
+        # the thread pool of the batch call only adds overhead here
+        return [len(tokenizer.encode_ordinary(text)) for text in texts]
+
+    return [len(tokens) for tokens in tokenizer.encode_ordinary_batch(list(texts), num_threads=num_threads)]
+
+
+def get_request_texts(mode, prompt_strat, datasets, outputs, rows):
+    """Return the prompt for the db rows processed with a single request and the number of annotated outputs."""
+    row = rows[0]
+    data = datasets[row["dataset"]].get_example(row["split"], row["example_idx"])
+
+    if mode == CampaignMode.LLM_GEN:
+        prompt = prompt_strat.prompt(data)
+    else:
+        texts = [outputs.get((r["dataset"], r["split"], r["setup_id"], r["example_idx"]), "") for r in rows]
+
+        if getattr(prompt_strat, "groups_outputs", False):
+            prompt = prompt_strat.prompt(data, prompt_strat.format_outputs(texts))
+        else:
+            prompt = prompt_strat.prompt(data, texts[0])
+
+    system_msg = prompt_strat.config.get("system_msg") or ""
+
+    return system_msg + "\n" + prompt, len(rows)
+
+
+def get_model_history(config, mode):
+    """
+    Collect the telemetry from the previous campaigns using the same model: the number of output tokens per annotated output and the duration of the requests.
+    """
+    output_tokens, durations = [], []
+    campaign_dirs = sorted(glob.glob(os.path.join(CAMPAIGN_DIR, "*")), key=os.path.getmtime, reverse=True)
+
+    for campaign_dir in campaign_dirs:
+        metadata_path = os.path.join(campaign_dir, "metadata.json")
+
+        if not os.path.exists(metadata_path):
+            continue
+
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+
+        campaign_config = metadata.get("config", {})
+        if (
+            metadata.get("mode") != mode
+            or campaign_config.get("model") != config.get("model")
+            or ModelFactory.parse_api_provider(campaign_config) != ModelFactory.parse_api_provider(config)
+        ):
+            continue
+
+        for jsonl_file in glob.glob(os.path.join(campaign_dir, "files", "*.jsonl")):
+            with open(jsonl_file) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+
+                    record = json.loads(line)
+                    usage = record.get("usage")
+
+                    # the usage is only recorded with the record for which the request was made
+                    if not usage or not usage.get("completion_tokens"):
+                        continue
+
+                    request_outputs = usage.get("request_outputs", 1)
+                    output_tokens.append(usage["completion_tokens"] / request_outputs)
+
+                    start = record["metadata"].get("start_timestamp")
+                    end = record["metadata"].get("end_timestamp")
+                    if start and end and end > start:
+                        durations.append(end - start)
+
+        if len(output_tokens) >= MAX_HISTORY_RECORDS:
+            break
+
+    return output_tokens, durations
+
+
+def get_token_costs(config):
+    """Cost per input and output token from the config (`input_cost_per_token`, `output_cost_per_token`) or from the LiteLLM model cost map."""
+    if config.get("input_cost_per_token") is not None:
+        return float(config["input_cost_per_token"]), float(config.get("output_cost_per_token", 0))
+
+    import litellm
+
+    model_name = config.get("model", "")
+    costs = litellm.model_cost.get(model_name)
+
+    # the model can be listed only with the provider prefix, e.g. `gemini/gemini-2.0-flash`
+    if costs is None:
+        costs = next((v for k, v in litellm.model_cost.items() if k.endswith("/" + model_name)), None)
+
+    if costs and costs.get("input_cost_per_token") is not None:
+        return costs["input_cost_per_token"], costs.get("output_cost_per_token", 0)
+
+    return None, None
+
+
+def estimate_llm_campaign(app, mode, config, campaign_data, datasets, workers=1):
+    """
+    Estimate the number of tokens, the cost and the duration of an LLM campaign without calling the model.
+
+    Every prompt is rendered with the prompting strategy of the campaign. The number of output tokens and the duration of the requests are taken from the previous runs of the same model, if there are any.
+
+    Args:
+        workers: The number of workers running the campaign in parallel, used for estimating the duration.
+
+    Returns:
+        A dictionary with the estimate.
+    """
+    prompt_strat = ModelFactory.get_prompt_strategies()[mode][config.get("prompt_strat", "default")](config)
+    # only used for grouping the examples, the API is not needed
+    model = Model(config, mode, None, prompt_strat)
+
+    db = generate_llm_campaign_db(app, mode, datasets, "estimate", campaign_data, config=config)
+    groups = get_example_groups(mode, db, model)
+
+    outputs = {}
+    if mode == CampaignMode.LLM_EVAL:
+        output_index = workflows.get_output_index(app, force_reload=False)
+        outputs = {
+            (out["dataset"], out["split"], out["setup_id"], out["example_idx"]): out["output"]
+            for out in output_index.to_dict(orient="records")
+        }
+
+    tokenizer = get_tokenizer()
+    # plain dicts are much faster to access than the dataframe rows
+    db_rows = db.to_dict(orient="index")
+
+    input_tokens, output_cnt = 0, 0
+
+    # the prompts are rendered in chunks, each chunk is then tokenized at once
+    for start in range(0, len(groups), CHUNK_SIZE):
+        texts, output_cnts = zip(
+            *[
+                get_request_texts(mode, prompt_strat, datasets, outputs, [db_rows[i] for i in group])
+                for group in groups[start : start + CHUNK_SIZE]
+            ]
+        )
+        input_tokens += sum(count_tokens(texts, tokenizer))
+        output_cnt += sum(output_cnts)
+
+    # output tokens
+    history_output_tokens, history_durations = get_model_history(config, mode)
+    max_tokens = (config.get("model_args") or {}).get("max_tokens")
+
+    if history_output_tokens:
+        tokens_per_output = sum(history_output_tokens) / len(history_output_tokens)
+        output_tokens_source = "history"
+    elif max_tokens:
+        tokens_per_output = float(max_tokens)
+        output_tokens_source = "max_tokens"
+    else:
+        tokens_per_output = DEFAULT_OUTPUT_TOKENS
+        output_tokens_source = "default"
+
+    output_tokens = int(tokens_per_output * output_cnt)
+
+    # cost
+    input_cost, output_cost = get_token_costs(config)
+    cost = None
+    if input_cost is not None:
+        cost = input_cost * input_tokens + output_cost * output_tokens
+
+    # wall time
+    time_per_request = sum(history_durations) / len(history_durations) if history_durations else None
+    wall_time = time_per_request * len(groups) / workers if time_per_request else None
+
+    return {
+        "examples": len(db),
+        "requests": len(groups),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "output_tokens_source": output_tokens_source,
+        "history_records": len(history_output_tokens),
+        "input_cost_per_token": input_cost,
+        "output_cost_per_token": output_cost,
+        "cost": cost,
+        "time_per_request": time_per_request,
+        "workers": workers,
+        "wall_time": wall_time,
+    }
+
+
+def format_estimate(estimate):
+    lines = [
+        f"Examples: {estimate['examples']}",
+        f"Requests: {estimate['requests']}",
+        f"Input tokens: {estimate['input_tokens']:,}",
+        f"Output tokens: {estimate['output_tokens']:,} (based on {estimate['output_tokens_source']})",
+    ]
+
+    if estimate["cost"] is not None:
+        lines.append(f"Cost: ${estimate['cost']:.2f}")
+    else:
+        lines.append("Cost: unknown (set `input_cost_per_token` and `output_cost_per_token` in the config)")
+
+    if estimate["wall_time"] is not None:
+        lines.append(
+            f"Duration: {estimate['wall_time'] / 3600:.1f} h ({estimate['time_per_request']:.1f} s per request, {estimate['workers']} workers)"
+        )
+    else:
+        lines.append("Duration: unknown (no previous runs of the model)")
+
+    return "\n".join(lines)
@@ -2,15 +2,18 @@
 
 import ast
 import datetime
+import hashlib
 import json
 import logging
 import os
 import shutil
+import socket
 import time
 import traceback
+from collections import deque
+from contextlib import contextmanager
 
 import pandas as pd
-import requests
 import urllib3
 from flask import jsonify
 from slugify import slugify
@@ -22,6 +25,9 @@ from factgenie.campaign import CampaignMode, CampaignStatus, ExampleStatus
 
 logger = logging.getLogger("factgenie")
 
+# the delay before retrying a failed example is doubled after each attempt up to this limit (seconds)
+MAX_RETRY_DELAY = 3600
+
 
 def create_llm_campaign(app, mode, campaign_id, config, campaign_data, datasets, overwrite=False):
     campaign_id = slugify(campaign_id)
@@ -37,7 +43,7 @@ def create_llm_campaign(app, mode, campaign_id, config, campaign_data, datasets,
         os.makedirs(os.path.join(CAMPAIGN_DIR, campaign_id, "files"), exist_ok=True)
 
         # create the annotation CSV
-        db = generate_llm_campaign_db(app, mode, datasets, campaign_id, campaign_data)
+        db = generate_llm_campaign_db(app, mode, datasets, campaign_id, campaign_data, config=config)
         db_path = os.path.join(CAMPAIGN_DIR, campaign_id, "db.csv")
         logger.info(f"DB with {len(db)} free examples created for {campaign_id} at {db_path}")
         db.to_csv(db_path, index=False)
@@ -85,6 +91,16 @@ def duplicate_llm_campaign(app, mode, campaign_id, new_campaign_id):
     new_db["start"] = None
     new_db["end"] = None
 
+    for col, default in [
+        ("attempts", 0),
+        ("error", ""),
+        ("retry_after", None),
+        ("lease_owner", ""),
+        ("lease_expires", None),
+    ]:
+        if col in new_db.columns:
+            new_db[col] = default
+
     new_db.to_csv(os.path.join(new_campaign_dir, "db.csv"), index=False)
 
     # update the metadata
@@ -102,7 +118,13 @@ def duplicate_llm_campaign(app, mode, campaign_id, new_campaign_id):
     return utils.success()
 
 
-def generate_llm_campaign_db(app, mode, datasets, campaign_id, campaign_data):
+def get_dedup_key(data, text, config):
+    """Hash of everything the model sees for an example: the example data, the evaluated output and the prompt config."""
+    serialized = json.dumps([data, text, config], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def generate_llm_campaign_db(app, mode, datasets, campaign_id, campaign_data, config=None):
     # load all outputs
     all_examples = []
 
@@ -135,21 +157,212 @@ def generate_llm_campaign_db(app, mode, datasets, campaign_id, campaign_data):
     df["status"] = ExampleStatus.FREE
     df["start"] = None
     df["end"] = None
+    df["attempts"] = 0
+    df["error"] = ""
+    df["retry_after"] = None
+    df["lease_owner"] = ""
+    df["lease_expires"] = None
+
+    # identical outputs for the same example are annotated only once
+    if mode == CampaignMode.LLM_EVAL and config and config.get("deduplicate_outputs"):
+        keys = list(zip(df["dataset"], df["split"], df["setup_id"], df["example_idx"]))
+        outputs = workflows.get_outputs_for_keys(app, keys)
+
+        df["dedup_key"] = [
+            get_dedup_key(datasets[dataset].get_example(split, example_idx), output["output"], config)
+            for (dataset, split, _, example_idx), output in zip(keys, outputs)
+        ]
+        logger.info(f"Deduplication: {len(df) - df['dedup_key'].nunique()} out of {len(df)} outputs are duplicates")
 
     return df
 
 
-def run_llm_campaign(app, mode, campaign_id, announcer, campaign, datasets, model, running_campaigns):
-    db = campaign.db
+def get_example_groups(mode, db, model):
+    """
+    Split the free examples into groups processed with a single request.
+
+    For strategies annotating multiple outputs at once, the rows with the same (dataset, split, example_idx) are grouped together, so that the example data are sent to the model only once. Otherwise, each row is processed separately.
+    """
+    free_examples = db[db.status == ExampleStatus.FREE]
+
+    # only the first of the duplicate rows is sent to the model, see `get_duplicate_rows()`
+    if "dedup_key" in db.columns:
+        free_examples = free_examples[~free_examples["dedup_key"].duplicated()]
+
+    if mode == CampaignMode.LLM_EVAL and model.groups_outputs() and not free_examples.empty:
+        grouped = free_examples.groupby(["dataset", "split", "example_idx"], sort=False)
+        return [list(group.index) for _, group in grouped]
+
+    return [[i] for i in free_examples.index]
+
+
+def get_duplicate_rows(db, idx):
+    """Return the indices of the other free rows with the same deduplication key as the row `idx`."""
+    if "dedup_key" not in db.columns:
+        return []
+
+    duplicates = db[(db["dedup_key"] == db.loc[idx, "dedup_key"]) & (db.status == ExampleStatus.FREE)]
+    return [i for i in duplicates.index if i != idx]
+
+
+def generate_results(app, mode, model, example, rows):
+    """Generate the outputs / annotations for the rows sharing the same example, returns a list aligned with `rows`."""
+    if mode == CampaignMode.LLM_GEN:
+        return [model.generate_output(data=example) for _ in range(len(rows))]
+
+    texts = []
+    for _, row in rows.iterrows():
+        generated_output = workflows.get_output_for_setup(
+            row["dataset"], row["split"], row["example_idx"], row["setup_id"], app=app, force_reload=False
+        )
+        texts.append(generated_output["output"])
+
+    if model.groups_outputs():
+        results = model.generate_outputs(data=example, texts=texts)
+    else:
+        results = [model.generate_output(data=example, text=text) for text in texts]
+
+    for res, text in zip(results, texts):
+        # keep the annotated text in the object
+        res["output"] = text
+
+    return results
+
+
+def get_default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def add_worker_columns(db):
+    """Add the columns used by the failure policy and the leases to campaigns created before they were introduced."""
+    for col, default in [
+        ("attempts", 0),
+        ("error", ""),
+        ("retry_after", None),
+        ("lease_owner", ""),
+        ("lease_expires", None),
+    ]:
+        if col not in db.columns:
+            db[col] = default
+
+
+def get_unleased_rows(db, worker_id, now):
+    """
+    Rows not leased by a worker other than `worker_id`.
+
+    A single worker which does not share the db (`worker_id` is None) ignores the leases, they can only be left over from a previous run.
+    """
+    if worker_id is None:
+        return pd.Series(True, index=db.index)
+
+    lease_owner = db["lease_owner"].fillna("")
+    return (lease_owner == "") | (lease_owner == worker_id) | (db["lease_expires"] < now)
+
+
+def select_example_groups(db, mode, model, worker_id, lease_size, lease_time):
+    """
+    Lease up to `lease_size` groups of free examples in `db` for the worker `worker_id` (all the available groups if `lease_size` is None).
+
+    The leased rows are skipped by the other workers until the lease expires, which only happens if the worker stopped without releasing them. The examples which already failed are leased last and only after their `retry_after` time.
+
+    If `worker_id` is None, the groups are only selected and not leased.
+    """
+    add_worker_columns(db)
+    now = time.time()
+
+    available = get_unleased_rows(db, worker_id, now) & ~(db["retry_after"] > now)
+
+    groups = [group for group in get_example_groups(mode, db, model) if available[group].all()]
+    groups = sorted(groups, key=lambda group: db.loc[group[0], "attempts"])[:lease_size]
+
+    if worker_id is not None:
+        leased_rows = [i for group in groups for i in group]
+        db.loc[leased_rows, "lease_owner"] = worker_id
+        db.loc[leased_rows, "lease_expires"] = now + lease_time
+
+    return groups
+
+
+def get_next_retry_time(db, worker_id):
+    """The time when the next failed example waiting for a retry can be leased by the worker, or None if there is no such example."""
+    now = time.time()
+
+    available = get_unleased_rows(db, worker_id, now)
+    waiting = db[(db.status == ExampleStatus.FREE) & available & (db["retry_after"] > now)]
+
+    return None if waiting.empty else float(waiting["retry_after"].min())
+
+
+def get_retry_delay(config, attempts):
+    """Exponential backoff: `retry_delay` seconds (30 by default) after the first failed attempt, doubled after each next one."""
+    retry_delay = float(config.get("retry_delay", 30))
+
+    return min(retry_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def lease_example_groups(campaign, mode, model, worker_id, lease_size, lease_time):
+    """Lease the groups of examples from the db shared with the other workers, see `select_example_groups()`."""
+    with campaign.locked_db() as db:
+        return select_example_groups(db, mode, model, worker_id, lease_size, lease_time)
+
+
+def release_leases(campaign, worker_id, shared=True):
+    with update_campaign_db(campaign, shared) as db:
+        add_worker_columns(db)
+        leased = db["lease_owner"] == worker_id
+
+        db.loc[leased, "lease_owner"] = ""
+        db.loc[leased, "lease_expires"] = None
+
+
+@contextmanager
+def update_campaign_db(campaign, shared):
+    """
+    Update the campaign db and write it to the disk.
+
+    If the db is `shared` with other workers, it is locked and re-read before the update (see `Campaign.locked_db()`). Otherwise, the in-memory db is updated directly.
+    """
+    if shared:
+        with campaign.locked_db() as db:
+            yield db
+    else:
+        yield campaign.db
+        campaign.update_db(campaign.db)
+
+
+def run_llm_campaign(
+    app,
+    mode,
+    campaign_id,
+    announcer,
+    campaign,
+    datasets,
+    model,
+    running_campaigns,
+    worker_id=None,
+    lease_size=1,
+    lease_time=600,
+    shared=False,
+):
+    """
+    Generate the outputs / annotations for the free examples of the campaign.
+
+    Multiple workers (threads, processes or machines sharing the campaign directory) can run the same campaign at once if they are all started with `shared=True`. Each worker then leases `lease_size` groups of examples at a time from the db, which is locked and re-read on every update, and saves its records to separate JSONL files named after `worker_id`.
+
+    A single worker (`shared=False`) keeps the db in memory and writes it once per processed example.
+    """
+    lease_owner = worker_id or get_default_worker_id()
 
     # set campaign status to running
     campaign.metadata["status"] = CampaignStatus.RUNNING
     campaign.metadata["last_run"] = int(time.time())
+    # other workers can only join the campaign if the db is shared
+    campaign.metadata["shared_db"] = shared
     campaign.update_metadata()
 
     provider = campaign.metadata["config"].get("api_provider", None)
 
-    logger.info(f"Starting LLM campaign \033[1m{campaign_id}\033[0m | {provider}")
+    logger.info(f"Starting LLM campaign \033[1m{campaign_id}\033[0m | {provider} | worker {lease_owner}")
 
     logger.info(f"=" * 50)
     logger.info(f"\033[1mModel\033[0m: {campaign.metadata['config']['model']}")
@@ -166,75 +379,203 @@ def run_llm_campaign(app, mode, campaign_id, announcer, campaign, datasets, mode
     # regenerate output index
     workflows.get_output_index(app, force_reload=True)
 
+    max_attempts = int(campaign.metadata["config"].get("max_attempts", 3))
+    annotator_id = campaign.metadata["config"]["model"] + "-" + campaign_id
+
     # generate outputs / annotations for all free examples in the db
-    for i, row in db[db.status == ExampleStatus.FREE].iterrows():
-        # campaign was paused
-        if campaign_id not in running_campaigns:
-            break
-
-        dataset_id = row["dataset"]
-        split = row["split"]
-        example_idx = row["example_idx"]
-        example = datasets[dataset_id].get_example(split, example_idx)
-        # only for llm_eval
-        setup_id = row.get("setup_id")
-
-        db.loc[i, "start"] = float(time.time())
-        db.loc[i, "annotator_id"] = campaign.metadata["config"]["model"] + "-" + campaign_id
-
-        # generate output or annotate example
-        try:
-            if mode == CampaignMode.LLM_EVAL:
-                generated_output = workflows.get_output_for_setup(
-                    dataset_id, split, example_idx, setup_id, app=app, force_reload=False
+    queue = deque()
+
+    try:
+        while True:
+            # campaign was paused
+            if campaign_id not in running_campaigns:
+                break
+
+            if not queue:
+                if shared:
+                    queue.extend(lease_example_groups(campaign, mode, model, lease_owner, lease_size, lease_time))
+                else:
+                    # nobody else can take the examples, the whole queue is selected at once without leasing it
+                    queue.extend(select_example_groups(campaign.db, mode, model, None, None, lease_time))
+
+                if not queue:
+                    next_retry = get_next_retry_time(campaign.db, lease_owner if shared else None)
+
+                    # no examples left for this worker
+                    if next_retry is None:
+                        break
+
+                    # only the failed examples are left, wait until they can be retried (or the campaign is paused)
+                    logger.info(f"{campaign_id}: waiting {next_retry - time.time():.0f} seconds for the next retry")
+                    while campaign_id in running_campaigns and time.time() < next_retry:
+                        time.sleep(max(0, min(next_retry - time.time(), 1.0)))
+                    continue
+
+            group = queue.popleft()
+            # written to the db together with the result
+            start = float(time.time())
+            rows = campaign.db.loc[group].copy()
+            rows["start"] = start
+            rows["annotator_id"] = annotator_id
+
+            row = rows.iloc[0]
+            dataset_id = row["dataset"]
+            split = row["split"]
+            example_idx = row["example_idx"]
+            example = datasets[dataset_id].get_example(split, example_idx)
+            # only for llm_eval
+            setup_id = row.get("setup_id")
+
+            # report the progress of streamed responses
+            example_key = {"dataset": dataset_id, "split": split, "setup_id": setup_id, "example_idx": int(example_idx)}
+            model.set_progress_callback(
+                lambda progress, example_key=example_key: utils.announce(
+                    announcer,
+                    {"campaign_id": campaign_id, "type": "progress", "example": example_key, "progress": progress},
                 )
-                res = model.generate_output(data=example, text=generated_output["output"])
-                # keep the annotated text in the object
-                res["output"] = generated_output["output"]
-            elif mode == CampaignMode.LLM_GEN:
-                res = model.generate_output(data=example)
-        except requests.exceptions.ConnectionError as e:
-            traceback.print_exc()
-            return utils.error(
-                f"Error processing example {dataset_id}-{split}-{example_idx}: {e.__class__.__name__}: {str(e)}\n"
             )
 
-        except Exception as e:
-            traceback.print_exc()
-            return utils.error(
-                f"Error processing example {dataset_id}-{split}-{example_idx}: {e.__class__.__name__}: {str(e)}"
-            )
+            # generate output or annotate example
+            try:
+                results = generate_results(app, mode, model, example, rows)
+            except Exception as e:
+                traceback.print_exc()
+                error = f"{e.__class__.__name__}: {str(e)}"
+
+                with update_campaign_db(campaign, shared) as db:
+                    attempts = int(db.loc[group[0], "attempts"]) + 1
+                    failed = attempts >= max_attempts
+
+                    db.loc[group, "attempts"] = attempts
+                    db.loc[group, "error"] = error
+
+                    # release the lease, the example is retried after the examples which have not failed yet and not before the backoff delay
+                    retry_delay = get_retry_delay(campaign.metadata["config"], attempts)
+                    db.loc[group, "retry_after"] = time.time() + retry_delay
+                    db.loc[group, "lease_owner"] = ""
+                    db.loc[group, "lease_expires"] = None
+
+                    if failed:
+                        # the duplicates would otherwise stay free until the next run
+                        failed_rows = group + [dup for i in group for dup in get_duplicate_rows(db, i)]
+                        db.loc[failed_rows, "status"] = ExampleStatus.FAILED
+                        db.loc[failed_rows, "start"] = start
+                        db.loc[failed_rows, "annotator_id"] = annotator_id
+                        db.loc[failed_rows, "end"] = float(time.time())
+
+                    # the next groups are leased with the same update of the shared db
+                    if shared and not queue:
+                        queue.extend(select_example_groups(db, mode, model, lease_owner, lease_size, lease_time))
+
+                if failed:
+                    logger.error(
+                        f"Error processing example {dataset_id}-{split}-{example_idx}, giving up after {attempts} attempts: {error}"
+                    )
+                else:
+                    logger.warning(
+                        f"Error processing example {dataset_id}-{split}-{example_idx}, retrying in {retry_delay:.0f} seconds (attempt {attempts}/{max_attempts}): {error}"
+                    )
+
+                payload = {
+                    "campaign_id": campaign_id,
+                    "stats": campaign.get_stats(refresh=False),
+                    "type": "failed" if failed else "retry",
+                    "example": example_key,
+                    "attempts": attempts,
+                    "error": error,
+                }
+                utils.announce(announcer, payload)
+                continue
+
+            with update_campaign_db(campaign, shared) as db:
+                # fan out the results to the rows with identical outputs
+                finished_rows, row_results = [], []
+                for i, res in zip(group, results):
+                    finished_rows.append(i)
+                    row_results.append(res)
+
+                    for dup in get_duplicate_rows(db, i):
+                        # the usage is reported only with the request that was actually made
+                        dup_res = {key: value for key, value in res.items() if key != "usage"}
+                        finished_rows.append(dup)
+                        row_results.append(dup_res)
+
+                # update the DB
+                db.loc[finished_rows, "start"] = start
+                db.loc[finished_rows, "annotator_id"] = annotator_id
+                db.loc[finished_rows, "end"] = float(time.time())
+                db.loc[finished_rows, "status"] = ExampleStatus.FINISHED
+                db.loc[finished_rows, "error"] = ""
+                db.loc[finished_rows, "lease_owner"] = ""
+                db.loc[finished_rows, "lease_expires"] = None
+
+                if shared:
+                    # the worker is still alive, renew the leases of the examples waiting in its queue
+                    db.loc[db["lease_owner"] == lease_owner, "lease_expires"] = time.time() + lease_time
+
+                finished = [db.loc[i].copy() for i in finished_rows]
+
+                # the next groups are leased with the same update of the shared db
+                if shared and not queue:
+                    queue.extend(select_example_groups(db, mode, model, lease_owner, lease_size, lease_time))
+
+            # the db was just updated
+            stats = campaign.get_stats(refresh=False)
+            usage = model.get_token_usage()
+
+            for row, res in zip(finished, row_results):
+                # save the record to a JSONL file
+                response = workflows.save_record(
+                    mode=mode,
+                    campaign=campaign,
+                    row=row,
+                    result=res,
+                    worker_id=worker_id,
+                )
 
-        # update the DB
-        db.loc[i, "end"] = float(time.time())
-        db.loc[i, "status"] = ExampleStatus.FINISHED
+                # send a response to the frontend
+                payload = {
+                    "campaign_id": campaign_id,
+                    "stats": stats,
+                    "usage": usage,
+                    "type": "result",
+                    "response": response,
+                }
 
-        campaign.update_db(db)
+                utils.announce(announcer, payload)
 
-        # save the record to a JSONL file
-        response = workflows.save_record(
-            mode=mode,
-            campaign=campaign,
-            row=db.loc[i],
-            result=res,
-        )
+            logger.info(f"-" * 50)
+            logger.info(f"{campaign_id}: {stats['finished']}/{stats['total']} examples")
+
+            if stats.get("deduplicated"):
+                logger.info(f"{campaign_id}: {stats['deduplicated']} requests saved by deduplication")
 
-        # send a response to the frontend
-        stats = campaign.get_stats()
-        payload = {"campaign_id": campaign_id, "stats": stats, "type": "result", "response": response}
+            if usage["prompt_tokens"]:
+                logger.info(
+                    f"{campaign_id}: {usage['prompt_tokens']} prompt tokens, {usage['cached_token_ratio']:.1%} cached"
+                )
+            logger.info(f"-" * 50)
+    finally:
+        # the examples left in the queue after pausing (or after an error) can be leased by other workers
+        if shared:
+            release_leases(campaign, lease_owner)
 
-        utils.announce(announcer, payload)
-        logger.info(f"-" * 50)
-        logger.info(f"{campaign_id}: {stats['finished']}/{stats['total']} examples")
-        logger.info(f"-" * 50)
+    db = campaign.db
 
     # if all examples are finished, set the campaign status to finished
     if len(db.status.unique()) == 1 and db.status.unique()[0] == ExampleStatus.FINISHED:
         campaign.metadata["status"] = CampaignStatus.FINISHED
         campaign.update_metadata()
+        running_campaigns.discard(campaign_id)
+
+    # only the failed examples are left, they can be re-run with `retry_failed_examples()`
+    elif campaign_id in running_campaigns and ExampleStatus.FREE not in db.status.unique():
+        failed_cnt = len(db[db.status == ExampleStatus.FAILED])
+        logger.warning(f"{campaign_id}: {failed_cnt} examples failed after {max_attempts} attempts")
 
-        if campaign_id in running_campaigns:
-            running_campaigns.remove(campaign_id)
+        campaign.metadata["status"] = CampaignStatus.IDLE
+        campaign.update_metadata()
+        running_campaigns.discard(campaign_id)
 
     return jsonify(success=True, status=campaign.metadata["status"])
 
@@ -248,6 +589,19 @@ def pause_llm_campaign(app, campaign_id):
     campaign.update_metadata()
 
 
+def retry_failed_examples(app, campaign_id):
+    campaign = workflows.load_campaign(app, campaign_id=campaign_id)
+    failed_cnt = campaign.reset_failed_examples()
+
+    if campaign.metadata["status"] == CampaignStatus.FINISHED:
+        campaign.metadata["status"] = CampaignStatus.IDLE
+        campaign.update_metadata()
+
+    logger.info(f"{campaign_id}: {failed_cnt} failed examples returned to the queue")
+
+    return failed_cnt
+
+
 def parse_llm_gen_config(config):
     config = {
         "api_provider": config.get("apiProvider"),
@@ -275,6 +629,7 @@ def parse_llm_eval_config(config):
         "model_args": config.get("modelArguments"),
         "extra_args": config.get("extraArguments"),
         "annotation_span_categories": config.get("annotationSpanCategories"),
+        "deduplicate_outputs": config.get("deduplicateOutputs", False),
     }
     return config
 
@@ -295,35 +650,37 @@ def parse_campaign_config(config):
 
 def save_generation_outputs(app, campaign_id, setup_id):
     """
-    Load the files from the `GENERATIONS_DIR` and save them in the appropriate subdirectory in `OUTPUT_DIR`.
+    Copy the generated outputs from the campaign files to `OUTPUT_DIR/<setup_id>/<campaign_id>.jsonl`.
+
+    The records are copied line by line so that the outputs of large campaigns are never loaded in memory at once.
     """
+    # ensure the campaign exists
+    workflows.load_campaign(app, campaign_id)
 
-    campaign = workflows.load_campaign(app, campaign_id)
-    metadata = campaign.metadata
+    path = OUTPUT_DIR / setup_id
+    os.makedirs(path, exist_ok=True)
 
-    # load the metadata
-    with open(CAMPAIGN_DIR / campaign_id / "metadata.json") as f:
-        metadata = json.load(f)
+    out_path = path / f"{campaign_id}.jsonl"
+    # the output index may be read while the file is written
+    tmp_path = path / f".{campaign_id}.jsonl.tmp"
+    files_dir = CAMPAIGN_DIR / campaign_id / "files"
 
-    # load the outputs
-    outputs = []
+    with open(tmp_path, "w") as out_f:
+        for file in sorted(os.listdir(files_dir)):
+            if not file.endswith(".jsonl"):
+                continue
 
-    for file in os.listdir(CAMPAIGN_DIR / campaign_id / "files"):
-        if file.endswith(".jsonl"):
-            with open(CAMPAIGN_DIR / campaign_id / "files" / file) as f:
+            with open(files_dir / file) as f:
                 for line in f:
+                    if not line.strip():
+                        continue
+
                     record = json.loads(line)
                     # replace the campaign_id with the desired setup_id
                     record["setup_id"] = setup_id
+                    out_f.write(json.dumps(record) + "\n")
 
-                    outputs.append(record)
-
-    # save the outputs
-    path = OUTPUT_DIR / setup_id
-    os.makedirs(path, exist_ok=True)
-
-    with open(path / f"{campaign_id}.jsonl", "w") as f:
-        for example in outputs:
-            f.write(json.dumps(example) + "\n")
+    os.replace(tmp_path, out_path)
+    workflows.index_output_file(app, out_path)
 
     return utils.success()
@@ -13,6 +13,7 @@ from factgenie.annotations import AnnotationModelFactory
 from factgenie.api import (
     AnthropicAPI,
     GeminiAPI,
+    MockAPI,
     ModelAPI,
     OllamaAPI,
     OpenAIAPI,
@@ -22,6 +23,7 @@ from factgenie.api import (
 from factgenie.campaign import CampaignMode
 from factgenie.prompting import (
     GenerationStrategy,
+    MultiOutputStrategy,
     PromptingStrategy,
     RawOutputStrategy,
     StructuredOutputStrategy,
@@ -58,6 +60,7 @@ class ModelFactory:
             "anthropic": AnthropicAPI,
             "gemini": GeminiAPI,
             "vertexai": VertexAIAPI,
+            "mock": MockAPI,
         }
 
     @staticmethod
@@ -66,6 +69,7 @@ class ModelFactory:
             CampaignMode.LLM_EVAL: {
                 "default": StructuredOutputStrategy,
                 "parse_raw": RawOutputStrategy,
+                "multi_output": MultiOutputStrategy,
             },
             CampaignMode.LLM_GEN: {
                 "default": GenerationStrategy,
@@ -120,7 +124,37 @@ class Model:
 
     def generate_output(self, data, text=None):
         """For backward compatibility with existing code."""
-        return self.prompt_strat.get_model_output(api=self.model_api, data=data, text=text)
+        res = self.prompt_strat.get_model_output(api=self.model_api, data=data, text=text)
+
+        if self.prompt_strat.last_usage:
+            res["usage"] = self.prompt_strat.last_usage
+
+        return res
+
+    def groups_outputs(self):
+        """Whether all the outputs for the same example should be annotated in a single request."""
+        return getattr(self.prompt_strat, "groups_outputs", False)
+
+    def generate_outputs(self, data, texts):
+        """Annotate multiple outputs for the same data with a single request."""
+        results = self.prompt_strat.get_model_outputs(api=self.model_api, data=data, texts=texts)
+
+        if self.prompt_strat.last_usage:
+            for res in results:
+                # the usage is shared by all the outputs annotated in the request
+                res["usage"] = {**self.prompt_strat.last_usage, "request_outputs": len(results)}
+
+        return results
+
+    def set_progress_callback(self, callback):
+        """Set a function receiving progress updates (time to first token, partial output length) of streamed responses."""
+        self.prompt_strat.progress_callback = callback
+
+    def get_token_usage(self):
+        usage = self.prompt_strat.token_usage.copy()
+        usage["cached_token_ratio"] = self.prompt_strat.get_cached_token_ratio()
+
+        return usage
 
     def get_annotator_id(self):
         return "llm-" + ModelFactory.parse_api_provider(self.config) + "-" + self.config["model"]
@@ -3,7 +3,6 @@
 import abc
 import json
 import logging
-import re
 import time
 import traceback
 
@@ -11,7 +10,13 @@ from pydantic import ValidationError
 
 from factgenie.annotations import AnnotationModelFactory
 from factgenie.api import ModelAPI
-from factgenie.text_processing import template_replace
+from factgenie.text_processing import (
+    SpanLocator,
+    find_last_json_object,
+    get_template_prefix,
+    strip_think_blocks,
+    template_replace,
+)
 
 logger = logging.getLogger("factgenie")
 
@@ -22,6 +27,18 @@ class PromptingStrategy(abc.ABC):
         self.extra_args = config.get("extra_args", {})
         self.prompt_strat_kwargs = {}
 
+        # mark the static part of the messages as cacheable for providers supporting prompt caching
+        self.prompt_caching = self.extra_args.get("prompt_caching", False)
+
+        # consume the response incrementally and stop early at the stopping sequence / suffix
+        self.stream = self.extra_args.get("stream", False)
+        # called with progress updates of a streamed response, see `Model.set_progress_callback()`
+        self.progress_callback = None
+
+        # token usage of the last response and the totals over all the responses
+        self.last_usage = None
+        self.token_usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
     def prompt(self, data, to_annotate: str = "{text}"):
         data = self.preprocess_data_for_prompt(data)
         keyword_dict = {"data": data, "text": to_annotate}
@@ -32,6 +49,9 @@ class PromptingStrategy(abc.ABC):
         return prompt_template
 
     def construct_message(self, prompt):
+        if self.prompt_caching:
+            return self.construct_cacheable_message(prompt)
+
         messages = []
 
         if self.config.get("system_msg"):
@@ -44,14 +64,84 @@ class PromptingStrategy(abc.ABC):
 
         return messages
 
+    def construct_cacheable_message(self, prompt):
+        """
+        Construct the messages so that the static prefix is marked with `cache_control`.
+
+        The system message and the part of the prompt template preceding the first placeholder are the same for all the examples, so they are sent as separate content blocks ending with a cache breakpoint. See https://docs.litellm.ai/docs/completion/prompt_caching.
+        """
+        cache_control = {"type": "ephemeral"}
+        messages = []
+
+        if self.config.get("system_msg"):
+            messages.append(
+                {
+                    "role": "system",
+                    "content": [{"type": "text", "text": self.config["system_msg"], "cache_control": cache_control}],
+                }
+            )
+
+        prefix = get_template_prefix(self.config["prompt_template"], keywords=["data", "text"])
+
+        if prefix and prompt.startswith(prefix) and len(prefix) < len(prompt):
+            content = [
+                {"type": "text", "text": prefix, "cache_control": cache_control},
+                {"type": "text", "text": prompt[len(prefix) :]},
+            ]
+        else:
+            content = [{"type": "text", "text": prompt}]
+
+        messages.append({"role": "user", "content": content})
+
+        if self.config.get("start_with"):
+            messages.append({"role": "assistant", "content": self.config["start_with"]})
+
+        return messages
+
+    def update_token_usage(self, usage):
+        """Keep track of the token usage, including the prompt tokens read from the provider cache."""
+        if usage is None:
+            self.last_usage = None
+            return
+
+        # OpenAI-style usage details (LiteLLM also maps the Anthropic `cache_read_input_tokens` here)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or getattr(usage, "cache_read_input_tokens", None) or 0
+
+        self.last_usage = {
+            "prompt_tokens": usage.prompt_tokens or 0,
+            "completion_tokens": usage.completion_tokens or 0,
+            "cached_tokens": cached_tokens,
+        }
+
+        for key, value in self.last_usage.items():
+            self.token_usage[key] += value
+
+    def get_cached_token_ratio(self):
+        """Ratio of the prompt tokens served from the provider cache over all the responses so far."""
+        if not self.token_usage["prompt_tokens"]:
+            return 0.0
+
+        return self.token_usage["cached_tokens"] / self.token_usage["prompt_tokens"]
+
+    def get_stopping_sequence(self):
+        if not self.extra_args.get("stopping_sequence", False):
+            return None
+
+        stopping_sequence = self.extra_args["stopping_sequence"]
+
+        # re-normalize double backslashes ("\\n" -> "\n")
+        return stopping_sequence.encode().decode("unicode_escape")
+
+    def get_stop_sequences(self):
+        """Sequences at which a streamed generation can be aborted."""
+        return [seq for seq in [self.get_stopping_sequence(), self.extra_args.get("remove_suffix", "")] if seq]
+
     def postprocess_output(self, output):
         # cut model generation at the stopping sequence
-        if self.extra_args.get("stopping_sequence", False):
-            stopping_sequence = self.extra_args["stopping_sequence"]
-
-            # re-normalize double backslashes ("\\n" -> "\n")
-            stopping_sequence = stopping_sequence.encode().decode("unicode_escape")
+        stopping_sequence = self.get_stopping_sequence()
 
+        if stopping_sequence:
             if stopping_sequence in output:
                 output = output[: output.index(stopping_sequence)]
 
@@ -74,6 +164,9 @@ class PromptingStrategy(abc.ABC):
         """Get model response with timing and logging."""
         messages = self.construct_message(prompt)
 
+        if self.stream:
+            return self.get_streamed_model_response(api, messages)
+
         start = time.time()
         response = api.get_model_response_with_retries(messages, prompt_strat_kwargs=self.prompt_strat_kwargs)
         logger.info(f"Received response in {time.time() - start:.2f} seconds.")
@@ -81,8 +174,34 @@ class PromptingStrategy(abc.ABC):
         logger.debug(f"Prompt tokens: {response.usage.prompt_tokens}")
         logger.debug(f"Response tokens: {response.usage.completion_tokens}")
 
+        self.update_token_usage(response.usage)
+
+        if self.prompt_caching and self.last_usage:
+            logger.info(
+                f"Cached prompt tokens: {self.last_usage['cached_tokens']}/{self.last_usage['prompt_tokens']} "
+                f"(total ratio {self.get_cached_token_ratio():.1%})"
+            )
+
         return response.choices[0].message.content
 
+    def get_streamed_model_response(self, api: ModelAPI, messages):
+        """Get model response in the streaming mode, aborting the generation at the stop sequences."""
+        start = time.time()
+        response = api.get_model_response_with_retries(
+            messages,
+            prompt_strat_kwargs=self.prompt_strat_kwargs,
+            stream=True,
+            stop_sequences=self.get_stop_sequences(),
+            on_progress=self.progress_callback,
+        )
+        ttft = f"{response['ttft']:.2f}" if response["ttft"] is not None else "-"
+        logger.info(f"Received response in {time.time() - start:.2f} seconds (first token after {ttft} seconds).")
+
+        # token usage is not reported for aborted streams
+        self.update_token_usage(response["usage"])
+
+        return response["content"]
+
     def preprocess_data_for_prompt(self, data):
         """Override this method to change the format how the data is presented in the prompt. See self.prompt() method for usage."""
         return data
@@ -161,13 +280,17 @@ class AnnotationsStrategy(PromptingStrategy):
         Returns:
             A list of validated annotations.
         """
+        annotations_obj = self.validate_json(annotations_json, self.output_validation_model)
 
-        annotation_span_categories = self.config["annotation_span_categories"]
-        overlap_allowed = self.config.get("annotation_overlap_allowed", False)
+        if annotations_obj is None:
+            return []
+
+        return self.locate_annotations(text=text, annotations=annotations_obj.annotations)
 
+    def validate_json(self, annotations_json: str, validation_model):
+        """Validate the model response against the schema, returns `None` if the response is not valid."""
         try:
-            annotations_obj = self.output_validation_model.model_validate_json(annotations_json)
-            annotations = annotations_obj.annotations
+            return validation_model.model_validate_json(annotations_json)
         except ValidationError as e:
             logger.exception("Parsing error: ")
 
@@ -179,36 +302,47 @@ class AnnotationsStrategy(PromptingStrategy):
                 logger.error(f"Model response is not a valid JSON.")
                 logger.error(f"Model response: {annotations_json}")
 
-            return []
+            return None
+
+    def locate_annotations(self, text: str, annotations: list):
+        """
+        Find the positions of the annotated spans in the text.
+
+        Args:
+            text: The annotated text.
+            annotations: A list of validated span annotations.
+
+        Returns:
+            A list of annotations with the `start` position of each span.
+        """
+        annotation_span_categories = self.config["annotation_span_categories"]
+        overlap_allowed = self.config.get("annotation_overlap_allowed", False)
 
         annotation_list = []
+        locator = SpanLocator(text, overlap_allowed=overlap_allowed)
 
         logger.info(f"Response contains {len(annotations)} annotations.")
 
         for i, annotation in enumerate(annotations):
             annotated_span = annotation.text.lower().strip()
 
-            if len(text) == 0:
+            if len(text) == 0 or len(annotated_span) == 0:
                 logger.warning(f"❌ Span EMPTY.")
                 continue
 
             # find the `start` index of the error in the text
-            start_pos = text.lower().find(annotated_span)
-
-            if not overlap_allowed and start_pos != -1:
-                # check if the annotation overlaps with any other annotation
-                for other_annotation in annotation_list:
-                    other_start = other_annotation["start"]
-                    other_end = other_start + len(other_annotation["text"])
-
-                    if start_pos < other_end and start_pos + len(annotated_span) > other_start:
-                        logger.warning(
-                            f"❌ Span OVERLAP: {annotated_span} ({start_pos}:{start_pos + len(annotated_span)}) overlaps with {other_annotation['text']} ({other_start}:{other_end})"
-                        )
-                        continue
+            start_pos = locator.locate(annotated_span)
 
             if start_pos == -1:
-                logger.warning(f'❌ Span NOT FOUND: "{annotated_span}"')
+                occurrences = locator.find_occurrences(annotated_span)
+
+                if occurrences:
+                    other_start, other_end = locator.get_overlap(occurrences[0], occurrences[0] + len(annotated_span))
+                    logger.warning(
+                        f"❌ Span OVERLAP: {annotated_span} ({occurrences[0]}:{occurrences[0] + len(annotated_span)}) overlaps with {text[other_start:other_end]} ({other_start}:{other_end})"
+                    )
+                else:
+                    logger.warning(f'❌ Span NOT FOUND: "{annotated_span}"')
                 continue
 
             annotation_d = annotation.model_dump()
@@ -226,9 +360,7 @@ class AnnotationsStrategy(PromptingStrategy):
                 logger.error(f"Annotation type {annotation_d['type']} not found in the annotation_span_categories.")
                 continue
 
-            if start_pos == 0 and start_pos + len(annotated_span) == 0:
-                logger.warning(f"❌ Span EMPTY.")
-                continue
+            locator.add(annotated_span, start_pos)
 
             logger.info(
                 f'[\033[32m\033[1m{annotation_type_str}\033[0m] "\033[32m{annotation.text}\033[0m" ({start_pos}:{start_pos + len(annotation.text)})'
@@ -284,6 +416,83 @@ class StructuredOutputStrategy(AnnotationsStrategy):
             raise e
 
 
+class MultiOutputStrategy(AnnotationsStrategy):
+    """Strategy for annotating all the outputs for a single example in a single structured request."""
+
+    # the campaign groups the outputs for the same example, see `run_llm_campaign()`
+    groups_outputs = True
+
+    def __init__(self, config):
+        super().__init__(config)
+
+        with_reason = self.extra_args.get("with_reason") != False
+        self.multi_output_validation_model = AnnotationModelFactory.get_multi_output_model(with_reason)
+
+        # We force the output format with the `response_format` parameter
+        self.prompt_strat_kwargs["response_format"] = self.multi_output_validation_model
+
+    def format_outputs(self, texts: list):
+        """Format the outputs to be annotated so that the model can refer to them by their index."""
+        blocks = [f"[OUTPUT {i}]\n{text}" for i, text in enumerate(texts)]
+        header = f"There are {len(texts)} outputs to annotate. Annotate each output separately and refer to it by its index in `output_idx`."
+
+        return header + "\n\n" + "\n\n".join(blocks)
+
+    def get_model_output(self, api: ModelAPI, data, text):
+        """Annotate a single output, see `get_model_outputs()`."""
+        return self.get_model_outputs(api, data, [text])[0]
+
+    def get_model_outputs(self, api: ModelAPI, data, texts: list):
+        """
+        Annotate multiple outputs for the same data with a single request.
+
+        Args:
+            api: The ModelAPI instance
+            data: The data from which the texts were generated (optional)
+            texts: The list of texts to annotate (required)
+
+        Returns:
+            A list of dictionaries aligned with `texts`: {
+                "prompt": the prompt used for the generation,
+                "annotations": the annotations for the text
+            }
+        """
+        assert all(isinstance(text, str) and len(text) > 0 for text in texts), f"Texts must be non-empty strings"
+
+        try:
+            prompt = self.prompt(data, self.format_outputs(texts))
+            logger.debug(f"Prompt: {prompt}")
+
+            logger.info(f"Annotating {len(texts)} outputs in a single request.")
+
+            annotation_str = self.get_model_response(api, prompt)
+            annotations_obj = self.validate_json(annotation_str, self.multi_output_validation_model)
+
+            annotations_by_idx = {i: [] for i in range(len(texts))}
+
+            if annotations_obj is not None:
+                for output in annotations_obj.outputs:
+                    if output.output_idx not in annotations_by_idx:
+                        logger.warning(f"❌ Output index {output.output_idx} out of range, skipping.")
+                        continue
+
+                    annotations_by_idx[output.output_idx].extend(output.annotations)
+
+            results = []
+            for i, text in enumerate(texts):
+                logger.info(f"Annotated text [{i}]:")
+                logger.info(f"\033[34m{text}\033[0m")
+
+                annotations = self.locate_annotations(text=text, annotations=annotations_by_idx[i])
+                results.append({"prompt": prompt, "annotations": annotations})
+
+            return results
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(e)
+            raise e
+
+
 class RawOutputStrategy(AnnotationsStrategy):
     """Strategy for generating structured annotations that need to be extracted from raw text."""
 
@@ -292,45 +501,17 @@ class RawOutputStrategy(AnnotationsStrategy):
         Extract JSON object from raw model output, handling potential thinking traces.
         """
         # First, if the response contains <think> tags, log them and remove them
-        think_blocks = re.findall(r"<think>(.*?)</think>", content, flags=re.DOTALL)
+        output, think_blocks = strip_think_blocks(content)
         for block in think_blocks:
             logger.info(f"\033[90m[THINKING] {block.strip()}\033[0m")  # Grey color
 
-        # Remove all <think>...</think> sections
-        output = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL)
-
-        # Try to find the JSON object by looking for matching curly braces
-        potential_jsons = []
-        stack = []
-        start_indices = []
-
-        for i, char in enumerate(output):
-            if char == "{":
-                if not stack:  # If this is a new potential JSON object
-                    start_indices.append(i)
-                stack.append("{")
-            elif (char == "}") and stack:
-                stack.pop()
-                if not stack:  # If we've found a complete balanced JSON
-                    start = start_indices.pop()
-                    potential_jsons.append(output[start : i + 1])
-
-        # Try to validate each potential JSON, prioritizing the last valid one
-        valid_jsons = []
-        for json_str in potential_jsons:
-            try:
-                json.loads(json_str)  # Validate JSON
-                valid_jsons.append(json_str)
-            except json.JSONDecodeError:
-                continue
+        # The last valid JSON is most likely to be the final output
+        final_json = find_last_json_object(output)
 
-        if not valid_jsons:
+        if final_json is None:
             logger.error("Failed to find valid JSON object in response.")
             return ""
 
-        # Return the last valid JSON (most likely to be the final output)
-        final_json = valid_jsons[-1]
-
         return {
             "json_str": final_json,
             "thinking_trace": "\n".join(think_blocks).strip(),
@@ -109,7 +109,39 @@ function collectTextFields() {
 }
 
 
+function showAnnotation(data, annotation_idx) {
+    $('<div>', {
+        id: `out-text-${annotation_idx}`,
+        class: `annotate-box`,
+        style: 'display: none;'
+    }).appendTo('#outputarea');
+
+    if (data.html === null) {
+        $("#centerpanel").hide();
+        // disable Split.js
+        splitInstance.setSizes([0, 100]);
+        // center the right panel
+        $("#rightpanel").css("width", "50%");
+        $("#rightpanel").css("margin", "auto");
+
+    } else {
+        $("#examplearea").html(data.html);
+    }
+    examples_cached[annotation_idx] = data;
+}
+
+
 function fetchAnnotation(dataset, split, setup_id, example_idx, annotation_idx) {
+    const example = annotation_set[annotation_idx];
+
+    // the example was sent together with the page
+    if (example.payload) {
+        showAnnotation(example.payload, annotation_idx);
+        // do not send the payload back with the annotations
+        delete example.payload;
+        return Promise.resolve();
+    }
+
     return new Promise((resolve, reject) => {
         $.get(`${url_prefix}/example`, {
             "dataset": dataset,
@@ -117,27 +149,9 @@ function fetchAnnotation(dataset, split, setup_id, example_idx, annotation_idx)
             "split": split,
             "setup_id": setup_id
         }, function (data) {
-            $('<div>', {
-                id: `out-text-${annotation_idx}`,
-                class: `annotate-box`,
-                style: 'display: none;'
-            }).appendTo('#outputarea');
-
-            if (data.html === null) {
-                $("#centerpanel").hide();
-                // disable Split.js
-                splitInstance.setSizes([0, 100]);
-                // center the right panel
-                $("#rightpanel").css("width", "50%");
-                $("#rightpanel").css("margin", "auto");
-
-            } else {
-                $("#examplearea").html(data.html);
-            }
-
             // we have always only a single generated output here
             data.generated_outputs = data.generated_outputs[0];
-            examples_cached[annotation_idx] = data;
+            showAnnotation(data, annotation_idx);
             resolve();
         }).fail(function () {
             reject();
@@ -84,6 +84,34 @@ function createLLMCampaign() {
     });
 }
 
+function estimateLLMCampaign() {
+    const config = gatherConfig();
+    var campaignData = gatherSelectedCombinations();
+
+    if (campaignData.length == 0) {
+        alert("Please select at least one existing combination of dataset, split, and output.");
+        return;
+    }
+    $("#estimate-area").text("Estimating...");
+
+    $.post({
+        url: `${url_prefix}/${mode}/estimate`,
+        contentType: 'application/json',
+        data: JSON.stringify({
+            campaignData: campaignData,
+            config: config
+        }),
+        success: function (response) {
+            if (response.success !== true) {
+                $("#estimate-area").text("");
+                alert(response.error);
+            } else {
+                $("#estimate-area").text(response.message);
+            }
+        }
+    });
+}
+
 function createHumanCampaign() {
     const campaignId = $('#campaignId').val();
     const config = gatherConfig();
@@ -234,6 +262,7 @@ function gatherConfig() {
 
         if (window.mode == "llm_eval") {
             config.annotationSpanCategories = getAnnotationSpanCategories();
+            config.deduplicateOutputs = $("#deduplicateOutputs").is(":checked");
             config.purpose = "metric"
         }
         if (window.mode == "llm_gen") {
@@ -411,21 +440,23 @@ function setCampaignStatus(campaignId, status) {
 }
 
 function setExampleStatus(status, button) {
-    button.removeClass("bg-free bg-finished");
+    button.removeClass("bg-free bg-finished bg-failed");
     button.addClass(`bg-${status}`);
     button.text(status);
 }
 
 
-function showResult(payload, campaignId) {
-    const finished_examples = payload.stats.finished;
-    const total_examples = payload.stats.total;
+function showStats(stats, campaignId) {
+    const finished_examples = stats.finished;
+    const total_examples = stats.total;
     const progress = Math.round((finished_examples / total_examples) * 100);
     $(`#llm-progress-bar-${campaignId}`).css("width", `${progress}%`);
     $(`#llm-progress-bar-${campaignId}`).attr("aria-valuenow", progress);
     $(`#metadata-example-cnt-${campaignId}`).html(`${finished_examples} / ${total_examples}`);
     console.log(`Progress: ${progress}%`);
+}
 
+function showResult(payload, campaignId) {
 
     // update the annotation button
     const example = payload.response;
@@ -455,6 +486,51 @@ function showResult(payload, campaignId) {
     setExampleStatus("finished", status_button);
 }
 
+function showFailure(payload, campaignId) {
+    const example = payload.example;
+    const setup_id = example.setup_id || campaignId;
+    const exampleId = `${example.dataset}/${example.split}/${setup_id}/${example.example_idx}`;
+
+    if (payload.type === "retry") {
+        $("#log-area").text(`${exampleId}: attempt ${payload.attempts} failed, retrying later (${payload.error})`);
+        return;
+    }
+    $("#log-area").text(`${exampleId}: failed after ${payload.attempts} attempts (${payload.error})`);
+
+    const rowId = `${example.dataset}-${example.split}-${setup_id}-${example.example_idx}`;
+    setExampleStatus("failed", $(`#statusBtn${rowId}`));
+    $(`#retry-failed-button-${campaignId}`).show();
+}
+
+function retryFailedExamples(campaignId) {
+    $.post({
+        url: `${url_prefix}/${mode}/retry_failed`,
+        contentType: 'application/json',
+        data: JSON.stringify({
+            campaignId: campaignId
+        }),
+        success: function (response) {
+            if (response.success !== true) {
+                alert(response.error);
+                return;
+            }
+            $(`#retry-failed-button-${campaignId}`).hide();
+            runLLMCampaign(campaignId);
+        }
+    });
+}
+
+function showStreamingProgress(payload) {
+    // progress of a streamed response for the example currently being processed
+    const example = payload.example;
+    const progress = payload.progress;
+    const exampleId = `${example.dataset}/${example.split}/${example.setup_id}/${example.example_idx}`;
+    const ttft = progress.ttft !== null && progress.ttft !== undefined ? `${progress.ttft.toFixed(2)} s` : "-";
+    const chars = progress.chars !== undefined ? `, ${progress.chars} characters` : "";
+
+    $("#log-area").text(`${exampleId}: first token after ${ttft}${chars}`);
+}
+
 function finalizeCampaign(campaignId) {
     console.log("Closing the connection");
 
@@ -474,20 +550,54 @@ function startLLMCampaignListener(campaignId) {
     console.log(`Listening for progress events for campaign ${campaignId}`);
 
     source.onmessage = function (event) {
-        // update the progress bar
-        var payload = JSON.parse(event.data);
+        // the events are coalesced into batches with the latest stats
+        var message = JSON.parse(event.data);
 
-        if (payload.type === "status") {
-            console.log(payload.message);
+        if (message.type === "closed") {
+            // the run has ended
+            source.close();
+            return;
         }
-        else if (payload.type === "result") {
-            showResult(payload, campaignId);
 
-            if (payload.stats.finished == payload.stats.total) {
-                source.close();
-                finalizeCampaign(campaignId);
+        if (message.type === "batch") {
+            if (message.missed) {
+                $("#log-area").text("Some progress updates were skipped, reload the page to see all the results.");
+            }
+
+            for (const payload of message.events) {
+                if (payload.type === "status") {
+                    console.log(payload.message);
+                }
+                else if (payload.type === "progress") {
+                    showStreamingProgress(payload);
+                }
+                else if (payload.type === "retry" || payload.type === "failed") {
+                    showFailure(payload, campaignId);
+                }
+                else if (payload.type === "result") {
+                    showResult(payload, campaignId);
+                }
             }
         }
+
+        // the batch and the snapshot for newly connected clients carry the latest stats
+        const stats = message.stats;
+
+        if (!stats) {
+            return;
+        }
+        showStats(stats, campaignId);
+
+        if (stats.finished == stats.total) {
+            source.close();
+            finalizeCampaign(campaignId);
+        }
+        // the remaining examples failed, the campaign can be resumed after retrying them
+        else if (stats.failed > 0 && stats.free == 0) {
+            source.close();
+            setCampaignStatus(campaignId, "idle");
+            $(`#stop-button-${campaignId}`).hide();
+        }
     };
 }
 
@@ -621,6 +731,7 @@ function updateLLMMetricConfig() {
         $("#annotation-span-categories").empty();
         $("#extra-arguments").empty();
         $("#annotationOverlapAllowed").prop("checked", false);
+        $("#deduplicateOutputs").prop("checked", false);
         return;
     }
     const cfg = window.configs[llmConfigValue];
@@ -643,6 +754,7 @@ function updateLLMMetricConfig() {
     $("#prompt-template").html(prompt_template);
     $("#system-message").html(system_msg);
     $("#annotationOverlapAllowed").prop("checked", annotation_overlap_allowed);
+    $("#deduplicateOutputs").prop("checked", cfg.deduplicate_outputs || false);
     $("#api-url").html(api_url);
     $("#model-arguments").empty();
     $("#extra-arguments").empty();
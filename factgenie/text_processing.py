@@ -1,7 +1,86 @@
 #!/usr/bin/env python3
 
+import bisect
+import json
 import re
 import unittest
+from functools import lru_cache
+
+
+def get_template_regex(keywords):
+    # Regex matches "{data[...]+}", with at least one [...] key.
+    # Where 'data' is one of the keywords.
+    # Raw would look like: r"{data((?:\[[^\[\]\{\}]*\])+?)}".
+    return f"{{({'|'.join(keywords)})((?:\\[[^\\[\\]\\{{\\}}]*\\])+?)?}}"
+
+
+def get_template_prefix(text: str, keywords):
+    """
+    Returns the static part of the template preceding the first placeholder.
+
+    The prefix is identical for all the rendered prompts, which makes it suitable for provider-side prompt caching.
+    """
+    plan = compile_template(text, tuple(keywords))
+
+    if plan and isinstance(plan[0], str):
+        return plan[0]
+
+    return ""
+
+
+@lru_cache(maxsize=256)
+def compile_template(text: str, keywords: tuple):
+    """
+    Parses the template into a render plan, which is a tuple of:
+        - literal strings,
+        - placeholders `(keyword, keys, placeholder)`, where `keys` is the path in the data (e.g. `("a", "b")` for "{data[a][b]}") or None for "{data}".
+
+    The plan is cached, so that the template is parsed only once for all the rendered prompts.
+    """
+    plan = []
+    processed_chars = 0
+
+    for s in re.finditer(get_template_regex(keywords), text):
+        if s.start() > processed_chars:
+            plan.append(text[processed_chars : s.start()])
+
+        keys = tuple(s.group(2)[1:-1].split("][")) if s.group(2) is not None else None
+        plan.append((s.group(1), keys, s.group(0)))
+        processed_chars = s.end()
+
+    if processed_chars < len(text):
+        plan.append(text[processed_chars:])
+
+    return tuple(plan)
+
+
+def render_template(plan: tuple, keyword_dict: dict):
+    """Renders the plan created by `compile_template()`, see `template_replace()` for the semantics."""
+    chunks = []
+
+    for part in plan:
+        if isinstance(part, str):
+            chunks.append(part)
+            continue
+
+        label_for_data, keys, placeholder = part
+        data = keyword_dict[label_for_data]
+
+        # Case 1: we have something like {data[key1]}.
+        if keys is not None:
+            if type(data) is not dict:
+                raise TypeError(f"Trying to access dictionary entries in {label_for_data} but it's not a dictionary.")
+
+            try:
+                chunks.append(str(extract_data(data, keys)))
+            except KeyError:
+                raise KeyError(f"Could not find path {placeholder} in {label_for_data}.")
+
+        # Case 2: we have just {data}.
+        else:
+            chunks.append(str(data))
+
+    return "".join(chunks)
 
 
 # Throws `KeyError` when the key is not found.
@@ -23,70 +102,161 @@ def template_replace(text: str, keyword_dict: dict):
 
     "{unknown_keywords}" in text will not be detected.
     """
-    # Regex matches "{data[...]+}", with at least one [...] key.
-    # Where 'data' is one of the keyword_dict keys.
-    # Raw would look like: r"{data((?:\[[^\[\]\{\}]*\])+?)}".
-    regex = f"{{({'|'.join(keyword_dict.keys())})((?:\\[[^\\[\\]\\{{\\}}]*\\])+?)?}}"
+    # The template is parsed only once, the replaced values are never searched for placeholders (which could otherwise cause infinite recursion).
+    return render_template(compile_template(text, tuple(keyword_dict.keys())), keyword_dict)
 
-    # Once we replace some part of text, we want to have that replaced text inaccessible to future regex searches, as it could potentially cause infinite recursion. Therefore we keep the variable `processed_chars`, which remembers how many chars we have processed so far. After each replace, it will point to the rightmost part of that replce.
-    processed_chars = 0
 
-    while True:
-        # Try to find a match.
-        s = re.search(regex, text[processed_chars:])
-        if s is None:
-            break
+def extract_data(data: dict, keys: list[str]):
+    """
+    `extract_data(data, ['a', 'b'])` either returns data['a']['b'] or throws a KeyError when not found.
+    """
+    value = data
 
-        label_for_data = s.group(1)
-        data = keyword_dict[label_for_data]
+    for i, key in enumerate(keys):
+        # the intermediate values have to be dictionaries
+        if i > 0 and type(value) is not dict:
+            raise KeyError()
 
-        # Find the span to be replaced, taking into account the initial cropping.
-        l, r = s.span()
-        l += processed_chars
-        r += processed_chars
+        if key not in value:
+            raise KeyError()
 
-        # Case 1: we have something like {data[key1]}.
-        if s.group(2) is not None:
-            if type(data) is not dict:
-                raise TypeError(f"Trying to access dictionary entries in {label_for_data} but it's not a dictionary.")
+        value = value[key]
 
-            # The replacement path in the dictionary.
-            keys = s.group(2)[1:-1].split("][")
+    return value
 
-            # Replace.
-            try:
-                replace_with = str(extract_data(data, keys))
-            except KeyError:
-                raise KeyError(f"Could not find path {s.group(0)} in {label_for_data}.")
 
-        # Case 2: we have just {data}.
-        else:
-            replace_with = str(data)
+class SpanLocator:
+    """
+    Finds the positions of the annotated spans in the text.
 
-        text = text[:l] + replace_with + text[r:]
-        processed_chars = l + len(replace_with)
+    The text is lowercased only once and the occurrences of each span are searched only once. A repeated span is located at the next occurrence not taken by the same span yet. Unless `overlap_allowed` is set, the spans overlapping with the already located spans are rejected; the located spans are kept as sorted disjoint intervals, so each check takes a binary search.
+    """
 
-    return text
+    def __init__(self, text: str, overlap_allowed: bool = False):
+        self.text = text.lower()
+        self.overlap_allowed = overlap_allowed
 
+        # span -> start positions of all its occurrences
+        self.occurrences = {}
+        # span -> start positions already taken by the span
+        self.taken = {}
+        # sorted start and end positions of the located spans
+        self.starts = []
+        self.ends = []
 
-def extract_data(data: dict, keys: list[str]):
+    def find_occurrences(self, span: str):
+        if span not in self.occurrences:
+            positions = []
+            pos = self.text.find(span) if span else -1
+
+            while pos != -1:
+                positions.append(pos)
+                pos = self.text.find(span, pos + 1)
+
+            self.occurrences[span] = positions
+
+        return self.occurrences[span]
+
+    def get_overlap(self, start: int, end: int):
+        """Returns the `(start, end)` of a located span overlapping with the interval, or None."""
+        i = bisect.bisect_right(self.starts, start)
+
+        # the closest span starting before (or at) `start` and the closest span starting after it
+        for j in (i - 1, i):
+            if 0 <= j < len(self.starts) and self.starts[j] < end and start < self.ends[j]:
+                return self.starts[j], self.ends[j]
+
+        return None
+
+    def locate(self, span: str):
+        """
+        Returns the start position of the (lowercased) span in the text, or -1 if the span was not found or all its occurrences are taken.
+
+        The span is not reserved until `add()` is called.
+        """
+        occurrences = self.find_occurrences(span)
+        taken = self.taken.get(span, set())
+
+        for start in occurrences:
+            if start in taken:
+                continue
+
+            if self.overlap_allowed or self.get_overlap(start, start + len(span)) is None:
+                return start
+
+        # the same span can be annotated more than once if overlaps are allowed
+        if self.overlap_allowed and occurrences:
+            return occurrences[0]
+
+        return -1
+
+    def add(self, span: str, start: int):
+        """Marks the occurrence of the span as taken."""
+        self.taken.setdefault(span, set()).add(start)
+
+        if not self.overlap_allowed:
+            i = bisect.bisect_right(self.starts, start)
+            self.starts.insert(i, start)
+            self.ends.insert(i, start + len(span))
+
+
+def strip_think_blocks(content: str):
     """
-    `extract_data(data, ['a', 'b'])` either returns data['a']['b'] or throws a KeyError when not found.
+    Removes the `<think>...</think>` blocks from the model output in a single pass.
+
+    Returns:
+        A tuple `(output, think_blocks)` with the output without the blocks and the list of the block contents. An unclosed `<think>` tag is kept in the output.
     """
-    key = keys[0]
-    tail = keys[1:]
+    open_tag, close_tag = "<think>", "</think>"
+    chunks, think_blocks = [], []
+    pos = 0
+
+    while True:
+        start = content.find(open_tag, pos)
+        if start == -1:
+            break
+
+        end = content.find(close_tag, start + len(open_tag))
+        if end == -1:
+            break
 
-    if key not in data:
-        raise KeyError()
+        chunks.append(content[pos:start])
+        think_blocks.append(content[start + len(open_tag) : end])
+        pos = end + len(close_tag)
 
-    value = data[key]
+    chunks.append(content[pos:])
 
-    if len(tail) == 0:
-        return value
-    elif type(value) is dict:
-        return extract_data(value, tail)
-    else:
-        raise KeyError()
+    return "".join(chunks), think_blocks
+
+
+def find_last_json_object(text: str):
+    """
+    Returns the last top-level balanced `{...}` substring of the text which is a valid JSON, or None.
+
+    The braces are matched in a single pass over the brace characters only, the candidates are then validated from the last one and the parsing stops at the first valid candidate.
+    """
+    candidates = []
+    depth = 0
+
+    for m in re.finditer(r"[{}]", text):
+        if m.group() == "{":
+            if depth == 0:
+                start = m.start()
+            depth += 1
+        elif depth > 0:
+            depth -= 1
+            if depth == 0:
+                candidates.append((start, m.end()))
+
+    for start, end in reversed(candidates):
+        json_str = text[start:end]
+        try:
+            json.loads(json_str)
+            return json_str
+        except json.JSONDecodeError:
+            continue
+
+    return None
 
 
 class TestTemplating(unittest.TestCase):
@@ -116,6 +286,26 @@ class TestTemplating(unittest.TestCase):
         keyword_dict = {"data": data}
         self.assertEqual(template_replace(text, keyword_dict), "data[a] is '{data[a]}'")
 
+    def test_template_prefix(self):
+        text = "Static instructions.\nData: {data[a]}\nText: {text}"
+        self.assertEqual(get_template_prefix(text, ["data", "text"]), "Static instructions.\nData: ")
+        self.assertEqual(get_template_prefix("No placeholders.", ["data", "text"]), "No placeholders.")
+
+    def test_compile_template(self):
+        plan = compile_template("A {data[a][b]} B {text} C {unknown}", ("data", "text"))
+        self.assertEqual(
+            plan, ("A ", ("data", ("a", "b"), "{data[a][b]}"), " B ", ("text", None, "{text}"), " C {unknown}")
+        )
+        self.assertIs(plan, compile_template("A {data[a][b]} B {text} C {unknown}", ("data", "text")))
+
+    def test_render_template(self):
+        plan = compile_template("{data[a]}-{data}-{data[a]}", ("data",))
+        self.assertEqual(render_template(plan, {"data": {"a": "{data[a]}"}}), "{data[a]}-{'a': '{data[a]}'}-{data[a]}")
+        self.assertEqual(render_template(compile_template("", ("data",)), {"data": {}}), "")
+
+    def test_template_non_dict_key_access(self):
+        self.assertRaises(TypeError, lambda: template_replace("Value: {data[a]}", {"data": "dogs"}))
+
     def test_extract_wrong_key(self):
         data = {"a": {"b": {"c": "<CC>"}, "d": "<DD>"}, "e": "<EE>"}
         self.assertRaises(KeyError, lambda: extract_data(data, ["a", "z"]))
@@ -127,5 +317,53 @@ class TestTemplating(unittest.TestCase):
         self.assertRaises(KeyError, lambda: template_replace(text, keyword_dict))
 
 
+class TestSpanLocator(unittest.TestCase):
+    def test_repeated_spans(self):
+        locator = SpanLocator("The team won. The TEAM lost. The team drew.")
+        positions = []
+        for _ in range(3):
+            start = locator.locate("the team")
+            locator.add("the team", start)
+            positions.append(start)
+
+        self.assertEqual(positions, [0, 14, 29])
+        self.assertEqual(locator.locate("the team"), -1)
+
+    def test_overlap(self):
+        locator = SpanLocator("Team won the match.")
+        locator.add("won the", locator.locate("won the"))
+
+        self.assertEqual(locator.locate("the match"), -1)
+        self.assertEqual(locator.get_overlap(9, 18), (5, 12))
+        self.assertEqual(locator.locate("match"), 13)
+        self.assertEqual(locator.locate("team"), 0)
+
+    def test_overlap_allowed(self):
+        locator = SpanLocator("Team won the match.", overlap_allowed=True)
+        locator.add("won the", locator.locate("won the"))
+
+        self.assertEqual(locator.locate("the match"), 9)
+        self.assertEqual(locator.locate("won the"), 5)
+
+    def test_not_found(self):
+        locator = SpanLocator("Team won the match.")
+        self.assertEqual(locator.locate("lost"), -1)
+        self.assertEqual(locator.locate(""), -1)
+
+
+class TestJsonExtraction(unittest.TestCase):
+    def test_strip_think_blocks(self):
+        output, blocks = strip_think_blocks("<think>a {}</think>X<think>b</think>Y<think>c")
+        self.assertEqual(output, "XY<think>c")
+        self.assertEqual(blocks, ["a {}", "b"])
+
+    def test_last_valid_json(self):
+        text = 'First {"a": 1}, then {"b": {"c": 2}} and a broken {"d": } one.'
+        self.assertEqual(find_last_json_object(text), '{"b": {"c": 2}}')
+
+    def test_no_json(self):
+        self.assertIsNone(find_last_json_object("} no {json here"))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -2,12 +2,15 @@
 import json
 import logging
 import os
-import queue
+import threading
+import time
 import urllib
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
 
 import yaml
-from flask import jsonify, render_template_string
+from flask import current_app, jsonify
 from pydantic import ValidationError
 from slugify import slugify
 from tqdm import tqdm
@@ -26,23 +29,200 @@ from factgenie.campaign import CampaignMode
 logger = logging.getLogger("factgenie")
 
 
-# https://maxhalford.github.io/blog/flask-sse-no-deps/
-class MessageAnnouncer:
-    def __init__(self):
-        self.listeners = []
+class ProgressChannel:
+    """
+    Progress events of a running campaign streamed to the browsers (https://maxhalford.github.io/blog/flask-sse-no-deps/).
+
+    The events are kept in a bounded log, except for the streaming progress for which only the latest event of each example is kept. Every client reads the log at its own pace: the events since its last message are coalesced into a single batch, which is sent at most every `min_interval` seconds together with the latest campaign stats. Clients joining later get a snapshot of the latest stats first, idle clients get a heartbeat every `heartbeat_interval` seconds (which also detects the disconnected clients), and all the streams end when the channel is closed.
+    """
+
+    def __init__(self, min_interval=0.5, heartbeat_interval=15, max_events=1000, max_progress=100):
+        self.min_interval = min_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.max_events = max_events
+        self.max_progress = max_progress
+
+        self.condition = threading.Condition()
+        self.events = deque()
+        # the latest streaming progress for each example
+        self.progress = {}
+        self.seq = 0
+        # sequence number of the last event dropped from the log
+        self.dropped_seq = 0
+        # the latest values of the fields shared by all the events (stats, usage)
+        self.state = {}
+        self.closed = False
+        self.listeners = 0
+
+    def announce(self, payload):
+        payload = dict(payload)
+
+        with self.condition:
+            for key in ["stats", "usage"]:
+                if key in payload:
+                    self.state[key] = payload.pop(key)
+
+            self.seq += 1
+
+            if payload.get("type") == "progress":
+                key = json.dumps(payload.get("example"), sort_keys=True)
+                # re-inserting keeps the dict ordered by the last update
+                self.progress.pop(key, None)
+                self.progress[key] = (self.seq, payload)
+
+                if len(self.progress) > self.max_progress:
+                    self.progress.pop(next(iter(self.progress)))
+            else:
+                self.events.append((self.seq, payload))
+
+                if len(self.events) > self.max_events:
+                    self.dropped_seq = self.events.popleft()[0]
+
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def collect(self, last_seq):
+        """Coalesce the events after `last_seq` into a single message. Must be called with the condition held."""
+        events = [event for event in self.events if event[0] > last_seq]
+        events += [event for event in self.progress.values() if event[0] > last_seq]
+        events.sort(key=lambda event: event[0])
+
+        return {
+            "type": "batch",
+            "events": [payload for _, payload in events],
+            # the client was too slow and some events were dropped from the log
+            "missed": self.dropped_seq > last_seq,
+            **self.state,
+        }
 
     def listen(self):
-        self.listeners.append(queue.Queue(maxsize=5))
-        return self.listeners[-1]
+        """Generator of the SSE messages for a single client."""
+        with self.condition:
+            self.listeners += 1
+            last_seq = self.seq
+            snapshot = {"type": "snapshot", **self.state} if self.state else None
+
+        try:
+            if snapshot:
+                yield format_sse(data=json.dumps(snapshot))
+
+            last_sent = 0
+
+            while True:
+                with self.condition:
+                    if self.seq == last_seq and not self.closed:
+                        self.condition.wait(timeout=self.heartbeat_interval)
+
+                    idle = self.seq == last_seq
+                    closed = self.closed
+
+                if idle:
+                    if closed:
+                        # the browser would otherwise reconnect
+                        yield format_sse(data=json.dumps({"type": "closed"}))
+                        return
+
+                    yield ": heartbeat\n\n"
+                    continue
+
+                # throttle the messages, the events arriving in the meantime are sent in the same batch
+                delay = self.min_interval - (time.time() - last_sent)
+                if delay > 0 and not closed:
+                    time.sleep(delay)
 
-    def announce(self, msg):
-        # We go in reverse order because we might have to delete an element, which will shift the
-        # indices backward
-        for i in reversed(range(len(self.listeners))):
-            try:
-                self.listeners[i].put_nowait(msg)
-            except queue.Full:
-                del self.listeners[i]
+                with self.condition:
+                    message = self.collect(last_seq)
+                    last_seq = self.seq
+
+                last_sent = time.time()
+                yield format_sse(data=json.dumps(message))
+        finally:
+            with self.condition:
+                self.listeners -= 1
+
+
+class LockManager:
+    """
+    Separate locks for independent resources (e.g., crowdsourcing campaigns), so that the requests for one campaign do not wait for the requests for another.
+
+    For each lock, the time spent waiting for the lock and holding it is recorded, see `get_metrics()`.
+    """
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self.locks = {}
+        self.metrics = {}
+        # guards the creation of the locks and the metrics
+        self.guard = threading.Lock()
+
+    def get_lock(self, key):
+        with self.guard:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+                self.metrics[key] = {
+                    "acquired": 0,
+                    "wait_total": 0.0,
+                    "wait_max": 0.0,
+                    "hold_total": 0.0,
+                    "hold_max": 0.0,
+                    "waits": deque(maxlen=self.max_samples),
+                }
+
+            return self.locks[key]
+
+    @contextmanager
+    def lock(self, key):
+        lock = self.get_lock(key)
+
+        start = time.perf_counter()
+        lock.acquire()
+        acquired = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            released = time.perf_counter()
+            lock.release()
+            self.record(key, acquired - start, released - acquired)
+
+    def record(self, key, wait, hold):
+        with self.guard:
+            metrics = self.metrics[key]
+            metrics["acquired"] += 1
+            metrics["wait_total"] += wait
+            metrics["wait_max"] = max(metrics["wait_max"], wait)
+            metrics["hold_total"] += hold
+            metrics["hold_max"] = max(metrics["hold_max"], hold)
+            metrics["waits"].append(wait)
+
+    def get_metrics(self):
+        """
+        Returns:
+            A dictionary with the number of acquisitions and the wait and hold times (in seconds) for each lock. The percentiles of the wait time are computed from the last `max_samples` acquisitions.
+        """
+        with self.guard:
+            metrics = {key: dict(m, waits=sorted(m["waits"])) for key, m in self.metrics.items()}
+
+        result = {}
+        for key, m in metrics.items():
+            waits = m.pop("waits")
+            acquired = m["acquired"]
+
+            result[key] = {
+                **m,
+                "wait_mean": m["wait_total"] / acquired if acquired else 0.0,
+                "hold_mean": m["hold_total"] / acquired if acquired else 0.0,
+                **{
+                    f"wait_p{p}": waits[min(len(waits) - 1, len(waits) * p // 100)] if waits else 0.0
+                    for p in [50, 95, 99]
+                },
+            }
+
+        return result
 
 
 def format_sse(data: str, event=None) -> str:
@@ -220,10 +400,19 @@ def resumable_download(
                 raise e
 
 
+def get_progress_channel(app, campaign_id):
+    """Return the progress channel of the campaign, a new channel is created if the previous run has ended."""
+    channel = app.db["announcers"].get(campaign_id)
+
+    if channel is None or channel.closed:
+        channel = app.db["announcers"][campaign_id] = ProgressChannel()
+
+    return channel
+
+
 def announce(announcer, payload):
-    msg = format_sse(data=json.dumps(payload))
     if announcer is not None:
-        announcer.announce(msg=msg)
+        announcer.announce(payload)
 
 
 def check_login(app, username, password):
@@ -257,8 +446,20 @@ def save_config(filename, config, mode):
         yaml.dump(config, f, indent=2, allow_unicode=True)
 
 
+# compiled templates from `render_from_folder()`: template file -> (modification time, template)
+template_cache = {}
+
+
 def render_from_folder(template_path, custom_folder, **context):
     template_file = os.path.join(custom_folder, template_path)
-    with open(template_file, "r") as f:
-        template_content = f.read()
-    return render_template_string(template_content, **context)
+    mtime = os.path.getmtime(template_file)
+    cached = template_cache.get(template_file)
+
+    # the template is compiled again only if the file was modified
+    if cached is None or cached[0] != mtime:
+        with open(template_file, "r") as f:
+            template_content = f.read()
+        cached = template_cache[template_file] = (mtime, current_app.jinja_env.from_string(template_content))
+
+    current_app.update_template_context(context)
+    return cached[1].render(context)
@@ -6,16 +6,17 @@ import logging
 import os
 import shutil
 import tempfile
+import threading
 import time
 import traceback
 import zipfile
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from io import BytesIO
 from pathlib import Path
 
 import pandas as pd
 import yaml
-from flask import make_response
+from flask import make_response, send_file
 from slugify import slugify
 
 import factgenie.utils as utils
@@ -36,9 +37,15 @@ from factgenie.campaign import (
     LLMCampaignEval,
     LLMCampaignGen,
 )
+from factgenie.datasets.indexed import INDEX_DIR
 
 logger = logging.getLogger("factgenie")
 
+# rendered HTML of the most recently shown examples, see `render_example()`
+RENDER_CACHE_SIZE = 1000
+render_cache = OrderedDict()
+render_cache_lock = threading.Lock()
+
 
 def get_dataset(app, dataset_id):
     return app.db["datasets_obj"].get(dataset_id)
@@ -76,6 +83,35 @@ def load_configs(mode):
     return configs
 
 
+def render_example(app, dataset, split, example_idx, example):
+    """
+    Render the example in HTML.
+
+    The HTML is cached (up to `RENDER_CACHE_SIZE` examples) for the current version of the split, so that the example is rendered again only after the split is reloaded.
+    """
+    key = (dataset.id, split, example_idx, dataset.get_split_version(split))
+
+    with render_cache_lock:
+        if key in render_cache:
+            render_cache.move_to_end(key)
+            return render_cache[key]
+
+    html = dataset.render(example=example)
+
+    if html is not None:
+        # temporary solution for external files
+        # prefix all the "/files" calls with "app.config["host_prefix"]"
+        html = html.replace('src="/files', f'src="{app.config["host_prefix"]}/files')
+
+    with render_cache_lock:
+        render_cache[key] = html
+
+        if len(render_cache) > RENDER_CACHE_SIZE:
+            render_cache.popitem(last=False)
+
+    return html
+
+
 def get_example_data(app, dataset_id, split, example_idx, setup_id=None):
     dataset = get_dataset(app=app, dataset_id=dataset_id)
 
@@ -85,12 +121,7 @@ def get_example_data(app, dataset_id, split, example_idx, setup_id=None):
         raise ValueError("Example cannot be retrieved from the dataset")
 
     try:
-        html = dataset.render(example=example)
-
-        if html is not None:
-            # temporary solution for external files
-            # prefix all the "/files" calls with "app.config["host_prefix"]"
-            html = html.replace('src="/files', f'src="{app.config["host_prefix"]}/files')
+        html = render_example(app, dataset, split, example_idx, example)
     except:
         raise ValueError("Example cannot be rendered")
 
@@ -118,7 +149,7 @@ def instantiate_campaign(app, campaign_id, mode):
 
     if mode == CampaignMode.CROWDSOURCING:
         scheduler = app.db["scheduler"]
-        campaign = HumanCampaign(campaign_id=campaign_id, scheduler=scheduler)
+        campaign = HumanCampaign(campaign_id=campaign_id, scheduler=scheduler, locks=app.db["locks"])
     elif mode == CampaignMode.LLM_EVAL:
         campaign = LLMCampaignEval(campaign_id=campaign_id)
     elif mode == CampaignMode.LLM_GEN:
@@ -272,7 +303,8 @@ def get_annotation_files():
 
 def remove_annotations(app, file_path):
     """Remove annotations from the annotation index for a specific file"""
-    if app.db["annotation_index"] is not None:
+    # the index built without any annotation files has no columns
+    if app.db["annotation_index"] is not None and "jsonl_file" in app.db["annotation_index"].columns:
         # Filter out annotations from the specified file
         app.db["annotation_index"] = app.db["annotation_index"][app.db["annotation_index"]["jsonl_file"] != file_path]
 
@@ -331,6 +363,9 @@ def get_annotations(app, dataset_id, split, example_idx, setup_id):
     return annotations.to_dict(orient="records")
 
 
+OUTPUT_INDEX_COLUMNS = ["dataset", "split", "setup_id", "example_idx", "output"]
+
+
 def get_output_files():
     """Get dictionary of annotation JSONL files and their modification times"""
     files_dict = {}
@@ -371,9 +406,10 @@ def load_outputs_from_file(file_path, cols):
 
 def remove_outputs(app, file_path):
     """Remove outputs from the output index for a specific file"""
-    if app.db["output_index"] is not None:
+    # the index built without any output files has no columns
+    if app.db["output_index"] is not None and "jsonl_file" in app.db["output_index"].columns:
         # Filter out outputs from the specified file
-        app.db["output_index"] = app.db["output_index"][app.db["output_index"].get("jsonl_file") != file_path]
+        app.db["output_index"] = app.db["output_index"][app.db["output_index"]["jsonl_file"] != file_path]
 
 
 def get_output_index(app, force_reload=True):
@@ -382,12 +418,16 @@ def get_output_index(app, force_reload=True):
 
     logger.debug("Reloading output index")
 
-    cols = ["dataset", "split", "setup_id", "example_idx", "output"]
+    cols = OUTPUT_INDEX_COLUMNS
 
     current_outs = get_output_files()
     cached_outs = app.db.get("output_index_cache", {})
     new_outputs = []
 
+    # keep the same index object if no file changed, the caches derived from the index are keyed by its identity
+    if app.db["output_index"] is not None and current_outs == cached_outs:
+        return app.db["output_index"]
+
     # Handle modified files
     for file_path, mod_time in current_outs.items():
         if file_path not in cached_outs or cached_outs[file_path] < mod_time:
@@ -420,9 +460,10 @@ def get_output_index(app, force_reload=True):
 
 
 def export_campaign_outputs(campaign_id):
-    zip_buffer = BytesIO()
+    # the archive of a large campaign is written to a temporary file and streamed instead of being built in memory
+    zip_file_obj = tempfile.TemporaryFile()
 
-    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
+    with zipfile.ZipFile(zip_file_obj, "w") as zip_file:
         for root, _dirs, files in os.walk(os.path.join(CAMPAIGN_DIR, campaign_id)):
             for file in files:
                 zip_file.write(
@@ -430,12 +471,13 @@ def export_campaign_outputs(campaign_id):
                     os.path.relpath(os.path.join(root, file), os.path.join(CAMPAIGN_DIR, campaign_id)),
                 )
 
+    zip_file_obj.seek(0)
+
     # Set response headers for download
     timestamp = int(time.time())
-    response = make_response(zip_buffer.getvalue())
-    response.headers["Content-Type"] = "application/zip"
-    response.headers["Content-Disposition"] = f"attachment; filename={campaign_id}_{timestamp}.zip"
-    return response
+    return send_file(
+        zip_file_obj, mimetype="application/zip", as_attachment=True, download_name=f"{campaign_id}_{timestamp}.zip"
+    )
 
 
 def get_local_dataset_overview(app):
@@ -560,6 +602,9 @@ def export_dataset(app, dataset_id):
 
     with zipfile.ZipFile(zip_buffer, "w") as zip_file:
         for root, dirs, files in os.walk(data_path):
+            # skip the indexes of the data files
+            dirs[:] = [d for d in dirs if d != INDEX_DIR]
+
             for file in files:
                 zip_file.write(
                     os.path.join(root, file),
@@ -822,6 +867,65 @@ def get_outputs(dataset_id, split, example_idx, app=None, force_reload=True):
     return outputs
 
 
+def get_outputs_for_keys(app, keys, force_reload=False):
+    """
+    Retrieve the outputs for multiple examples at once.
+
+    The lookup table from the keys to the outputs is built once for each version of the output index, so the lookup does not scan the output index.
+
+    Args:
+        keys: List of `(dataset, split, setup_id, example_idx)` tuples.
+
+    Returns:
+        A list with the output records in the order of the keys (None for the keys without an output).
+    """
+    output_index = get_output_index(app, force_reload=force_reload)
+    lookup_index, lookup = app.db.get("output_lookup", (None, None))
+
+    # the output index is replaced (not modified) on every update
+    if lookup_index is not output_index:
+        lookup = {
+            (dataset, split, setup_id, int(example_idx)): pos
+            for pos, (dataset, split, setup_id, example_idx) in enumerate(
+                zip(
+                    output_index["dataset"],
+                    output_index["split"],
+                    output_index["setup_id"],
+                    output_index["example_idx"],
+                )
+            )
+        }
+        app.db["output_lookup"] = (output_index, lookup)
+
+    positions = [
+        lookup.get((dataset, split, setup_id, int(example_idx))) for dataset, split, setup_id, example_idx in keys
+    ]
+    found = [pos for pos in positions if pos is not None]
+    records = iter(output_index.iloc[found].to_dict(orient="records"))
+
+    return [next(records) if pos is not None else None for pos in positions]
+
+
+def index_output_file(app, file_path):
+    """Add the outputs from a new or rewritten file to the output index without rescanning the other output files."""
+    # the index is built from all the files on the first access
+    if app.db["output_index"] is None:
+        return
+
+    file_path = str(file_path)
+    new_outputs = pd.DataFrame.from_records(load_outputs_from_file(file_path, OUTPUT_INDEX_COLUMNS))
+
+    remove_outputs(app, file_path)
+
+    app.db["output_index"] = (
+        pd.concat([app.db["output_index"], new_outputs])
+        .drop_duplicates(subset=["dataset", "split", "setup_id", "example_idx"], keep="last")
+        .reset_index(drop=True)
+    )
+    # the file is skipped by the next reload of the index
+    app.db.setdefault("output_index_cache", {})[file_path] = os.path.getmtime(file_path)
+
+
 def get_output_ids(app, dataset, split, setup_id):
     output_index = get_output_index(app)
 
@@ -842,9 +946,9 @@ def upload_model_outputs(dataset, split, setup_id, model_outputs):
     generated = model_outputs.strip().split("\n")
     setup_id = slugify(setup_id)
 
-    if len(generated) != len(dataset.examples[split]):
+    if len(generated) != dataset.get_example_count(split):
         raise ValueError(
-            f"Output count mismatch for {setup_id} in {split}: {len(generated)} vs {len(dataset.examples[split])}"
+            f"Output count mismatch for {setup_id} in {split}: {len(generated)} vs {dataset.get_example_count(split)}"
         )
 
     with open(f"{path}/{split}-{setup_id}.jsonl", "w") as f:
@@ -925,12 +1029,46 @@ def refresh_indexes(app):
     get_output_index(app=app, force_reload=True)
 
 
-def save_record(mode, campaign, row, result):
-    campaign_id = campaign.metadata["id"]
+def save_record(mode, campaign, row, result, worker_id=None):
+    save_dir = os.path.join(CAMPAIGN_DIR, campaign.metadata["id"], "files")
+    os.makedirs(save_dir, exist_ok=True)
+
+    filename, record = create_record(mode, campaign, row, result, worker_id=worker_id)
+
+    # append the record to the file from the current run
+    with open(os.path.join(save_dir, filename), "a") as f:
+        f.write(json.dumps(record, allow_nan=True) + "\n")
 
-    save_dir = os.path.join(CAMPAIGN_DIR, campaign_id, "files")
+    return record
+
+
+def save_records(mode, campaign, rows, results, worker_id=None):
+    """Same as `save_record()` for multiple records, each file is written with a single write."""
+    save_dir = os.path.join(CAMPAIGN_DIR, campaign.metadata["id"], "files")
     os.makedirs(save_dir, exist_ok=True)
 
+    records = []
+    lines = defaultdict(list)
+
+    for row, result in zip(rows, results):
+        filename, record = create_record(mode, campaign, row, result, worker_id=worker_id)
+        records.append(record)
+        lines[filename].append(json.dumps(record, allow_nan=True) + "\n")
+
+    for filename, file_lines in lines.items():
+        with open(os.path.join(save_dir, filename), "a") as f:
+            f.write("".join(file_lines))
+
+    return records
+
+
+def create_record(mode, campaign, row, result, worker_id=None):
+    """
+    Returns:
+        A tuple `(filename, record)` with the record to be saved and the name of the file in the campaign directory.
+    """
+    campaign_id = campaign.metadata["id"]
+
     dataset_id = str(row["dataset"])
     split = str(row["split"])
     example_idx = int(row["example_idx"])
@@ -948,6 +1086,9 @@ def save_record(mode, campaign, row, result):
     if result.get("thinking_trace"):
         record["thinking_trace"] = result["thinking_trace"]
 
+    if result.get("usage"):
+        record["usage"] = result["usage"]
+
     record["metadata"].pop("annotator_instructions", None)
     record["metadata"].pop("final_message", None)
 
@@ -986,8 +1127,8 @@ def save_record(mode, campaign, row, result):
     record["metadata"]["start_timestamp"] = row.get("start", int(time.time()))
     record["metadata"]["end_timestamp"] = row.get("end", int(time.time()))
 
-    # append the record to the file from the current run
-    with open(os.path.join(save_dir, filename), "a") as f:
-        f.write(json.dumps(record, allow_nan=True) + "\n")
+    # each of the workers running the campaign in parallel writes to its own file
+    if worker_id:
+        filename = filename.replace(".jsonl", f"-{slugify(worker_id)}.jsonl")
 
-    return record
+    return filename, record
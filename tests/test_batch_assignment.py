@@ -0,0 +1,258 @@
+import json
+import os
+import random
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import factgenie.campaign
+from factgenie.campaign import (
+    BatchAssignment,
+    CampaignMode,
+    ExampleStatus,
+    HumanCampaign,
+)
+from factgenie.utils import LockManager
+
+
+class StubScheduler:
+    def add_job(self, *args, **kwargs):
+        pass
+
+
+def make_db(batches=4, examples_per_batch=2, groups=1):
+    rows = []
+
+    for group in range(groups):
+        for batch in range(batches):
+            for example in range(examples_per_batch):
+                rows.append(
+                    {
+                        "dataset": "ds",
+                        "split": "test",
+                        "example_idx": batch * examples_per_batch + example,
+                        "setup_id": "s1",
+                        "batch_idx": group * batches + batch,
+                        "annotator_id": "",
+                        "annotator_group": group,
+                        "status": ExampleStatus.FREE,
+                        "start": None,
+                        "end": None,
+                    }
+                )
+
+    return pd.DataFrame.from_records(rows)
+
+
+def check_invariants(assignment):
+    free = [batch_idx for bucket in assignment.free.values() for batch_idx in bucket]
+
+    assert len(free) == len(set(free))
+    assert set(free) == set(assignment.free_pos)
+
+    for group, bucket in assignment.free.items():
+        for pos, batch_idx in enumerate(bucket):
+            assert assignment.free_pos[batch_idx] == pos
+            assert assignment.batch_groups[batch_idx] == group
+
+    for annotator_id, batch_idx in assignment.annotator_batches.items():
+        assert assignment.batch_annotators[batch_idx] == annotator_id
+        assert batch_idx not in assignment.free_pos
+
+
+class TestBatchAssignment:
+    def test_index_from_db(self):
+        db = make_db(batches=3)
+        db.loc[db["batch_idx"] == 1, ["status", "annotator_id"]] = [ExampleStatus.ASSIGNED, "a1"]
+        db.loc[db["batch_idx"] == 2, "status"] = ExampleStatus.FINISHED
+
+        assignment = BatchAssignment(db)
+
+        assert assignment.batch_rows == {0: [0, 1], 1: [2, 3], 2: [4, 5]}
+        assert set(assignment.free_pos) == {0}
+        assert assignment.get_assigned_batch("a1") == 1
+        check_invariants(assignment)
+
+    def test_empty_db(self):
+        assignment = BatchAssignment(pd.DataFrame())
+
+        assert assignment.select_free_batch() is None
+
+    def test_assign(self):
+        assignment = BatchAssignment(make_db())
+
+        assignment.assign(2, "a1")
+
+        assert assignment.get_assigned_batch("a1") == 2
+        assert 2 not in assignment.free_pos
+        check_invariants(assignment)
+
+    def test_release(self):
+        assignment = BatchAssignment(make_db())
+        assignment.assign(2, "a1")
+
+        assignment.release(2)
+        # releasing a free batch does nothing
+        assignment.release(2)
+
+        assert assignment.get_assigned_batch("a1") is None
+        assert sorted(assignment.free_pos) == [0, 1, 2, 3]
+        check_invariants(assignment)
+
+    def test_finish(self):
+        assignment = BatchAssignment(make_db())
+        assignment.assign(2, "a1")
+
+        assignment.finish(2)
+
+        assert assignment.get_assigned_batch("a1") is None
+        assert 2 not in assignment.free_pos
+        check_invariants(assignment)
+
+    def test_lowest_group_first(self):
+        assignment = BatchAssignment(make_db(batches=2, groups=2))
+
+        selected = set()
+        while (batch_idx := assignment.select_free_batch()) is not None:
+            selected.add(batch_idx)
+            assert assignment.batch_groups[batch_idx] == (0 if len(selected) <= 2 else 1)
+            assignment.assign(batch_idx, f"a{batch_idx}")
+
+        assert selected == {0, 1, 2, 3}
+
+        # a released batch of the lower group is selected again first
+        assignment.release(3)
+        assignment.release(0)
+        assert assignment.select_free_batch() == 0
+
+    def test_swap_pop(self):
+        rnd = random.Random(0)
+        assignment = BatchAssignment(make_db(batches=20, groups=3))
+        free = set(assignment.free_pos)
+        assigned = {}
+
+        for step in range(1000):
+            batch_idx = rnd.randrange(60)
+            action = rnd.choice(["assign", "release", "finish"])
+
+            if action == "assign":
+                assignment.assign(batch_idx, f"a{step}")
+                free.discard(batch_idx)
+                assigned[batch_idx] = f"a{step}"
+            elif action == "release":
+                assignment.release(batch_idx)
+                free.add(batch_idx)
+                assigned.pop(batch_idx, None)
+            else:
+                assignment.finish(batch_idx)
+                free.discard(batch_idx)
+                assigned.pop(batch_idx, None)
+
+            assert set(assignment.free_pos) == free
+            assert assignment.batch_annotators == assigned
+            check_invariants(assignment)
+
+            selected = assignment.select_free_batch()
+            if free:
+                assert assignment.batch_groups[selected] == min(assignment.batch_groups[b] for b in free)
+            else:
+                assert selected is None
+
+
+@pytest.fixture
+def campaign(tmp_path, monkeypatch):
+    monkeypatch.setattr(factgenie.campaign, "CAMPAIGN_DIR", tmp_path)
+    os.makedirs(tmp_path / "test-campaign" / "files")
+
+    with open(tmp_path / "test-campaign" / "metadata.json", "w") as f:
+        json.dump({"id": "test-campaign", "mode": CampaignMode.CROWDSOURCING, "config": {"idle_time": 60}}, f)
+
+    db = make_db()
+    now = int(time.time())
+    # batch 0 was abandoned two hours ago, batch 1 was opened just now
+    db.loc[db["batch_idx"] == 0, ["status", "annotator_id", "start"]] = [ExampleStatus.ASSIGNED, "a0", now - 7200]
+    db.loc[db["batch_idx"] == 1, ["status", "annotator_id", "start"]] = [ExampleStatus.ASSIGNED, "a1", now]
+    db.to_csv(tmp_path / "test-campaign" / "db.csv", index=False)
+
+    return HumanCampaign("test-campaign", scheduler=StubScheduler(), locks=LockManager())
+
+
+class TestIdleTime:
+    def test_idle_batch_released(self, campaign):
+        campaign.check_idle_time()
+
+        assert set(campaign.db.loc[campaign.db["batch_idx"] == 0, "status"]) == {ExampleStatus.FREE}
+        assert set(campaign.db.loc[campaign.db["batch_idx"] == 1, "status"]) == {ExampleStatus.ASSIGNED}
+
+        assignment = campaign.batch_assignment
+        assert assignment.get_assigned_batch("a0") is None
+        assert assignment.get_assigned_batch("a1") == 1
+        assert sorted(assignment.free_pos) == [0, 2, 3]
+        check_invariants(assignment)
+
+        # the change is persisted
+        campaign.load_db()
+        assert set(campaign.db.loc[campaign.db["batch_idx"] == 0, "status"]) == {ExampleStatus.FREE}
+
+    def test_db_written_once_outside_lock(self, campaign):
+        rows = campaign.batch_assignment.batch_rows[2]
+        campaign.db.loc[rows, ["status", "annotator_id", "start"]] = [ExampleStatus.ASSIGNED, "a2", 0]
+        campaign.batch_assignment.assign(2, "a2")
+
+        persist_db = campaign.persist_db
+        writes = []
+
+        def record_persist(version, db):
+            writes.append(campaign.locks.get_lock(campaign.campaign_id).locked())
+            persist_db(version, db)
+
+        campaign.persist_db = record_persist
+        campaign.check_idle_time()
+
+        assert writes == [False]
+        assert sorted(campaign.batch_assignment.free_pos) == [0, 2, 3]
+
+    def test_waits_for_campaign_lock(self, campaign):
+        with campaign.locks.lock(campaign.campaign_id):
+            checker = threading.Thread(target=campaign.check_idle_time)
+            checker.start()
+            checker.join(timeout=0.2)
+
+            assert checker.is_alive()
+            assert set(campaign.db.loc[campaign.db["batch_idx"] == 0, "status"]) == {ExampleStatus.ASSIGNED}
+
+        checker.join()
+        assert set(campaign.db.loc[campaign.db["batch_idx"] == 0, "status"]) == {ExampleStatus.FREE}
+
+    def test_clear_output(self, campaign):
+        campaign.clear_output(1)
+
+        assert set(campaign.db.loc[campaign.db["batch_idx"] == 1, "status"]) == {ExampleStatus.FREE}
+        assert campaign.batch_assignment.get_assigned_batch("a1") is None
+        check_invariants(campaign.batch_assignment)
+
+
+class TestUnpersistedChanges:
+    @pytest.fixture
+    def assigned(self, campaign):
+        # a batch assigned in memory with the db not written to the disk yet (see `crowdsourcing.get_annotator_batch()`)
+        with campaign.locks.lock(campaign.campaign_id):
+            rows = campaign.batch_assignment.batch_rows[2]
+            campaign.db.loc[rows, ["status", "annotator_id", "start"]] = [ExampleStatus.ASSIGNED, "a2", time.time()]
+            campaign.batch_assignment.assign(2, "a2")
+
+        return campaign
+
+    def test_overview_keeps_assignment(self, assigned):
+        overview = {batch["batch_idx"]: batch for batch in assigned.get_overview()}
+
+        assert overview[2]["status"] == ExampleStatus.ASSIGNED
+        assert assigned.batch_assignment.get_assigned_batch("a2") == 2
+
+    def test_clear_output_keeps_assignment(self, assigned):
+        assigned.clear_output(3)
+
+        assert set(assigned.db.loc[assigned.db["batch_idx"] == 2, "status"]) == {ExampleStatus.ASSIGNED}
+        assert assigned.batch_assignment.get_assigned_batch("a2") == 2
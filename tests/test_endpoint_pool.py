@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pytest
+
+from factgenie.api import EndpointPool
+
+URLS = ["http://a", "http://b"]
+
+
+class StubPool(EndpointPool):
+    """Endpoint pool with the health checks answered from `healthy` instead of sending requests."""
+
+    def __init__(self, urls, healthy=None, **kwargs):
+        self.healthy = set(urls if healthy is None else healthy)
+        super().__init__(urls, "/health", **kwargs)
+
+    def is_healthy(self, url):
+        return url in self.healthy
+
+
+def make_call(behavior):
+    """Call which looks up the behavior of the endpoint: a return value or an exception to raise."""
+
+    def call(url):
+        result = behavior[url]() if callable(behavior[url]) else behavior[url]
+
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return call
+
+
+class TestBalancing:
+    def test_least_outstanding_endpoint_is_selected(self):
+        pool = StubPool(URLS)
+
+        assert {pool.acquire(), pool.acquire()} == set(URLS)
+
+    def test_unhealthy_endpoint_is_ejected_at_start(self):
+        pool = StubPool(URLS, healthy=["http://b"])
+
+        assert [pool.acquire() for _ in range(3)] == ["http://b"] * 3
+
+
+class TestFailover:
+    def test_failed_endpoint_is_ejected(self):
+        pool = StubPool(URLS)
+        call = make_call({"http://a": ConnectionError("down"), "http://b": "ok"})
+
+        # the first request goes to the endpoint without outstanding requests
+        pool.outstanding["http://b"] += 1
+
+        assert [pool.call(call) for _ in range(5)] == ["ok"] * 5
+        assert pool.ejected_until["http://a"] > time.time()
+        assert pool.ejected_until["http://b"] == 0.0
+        assert pool.outstanding == {"http://a": 0, "http://b": 1}
+
+    def test_request_error_is_not_failed_over(self):
+        pool = StubPool(URLS)
+        call = make_call({url: ValueError("bad request") for url in URLS})
+
+        with pytest.raises(ValueError):
+            pool.call(call)
+
+        assert all(until == 0.0 for until in pool.ejected_until.values())
+
+    def test_error_is_raised_if_all_endpoints_fail(self):
+        pool = StubPool(URLS)
+        call = make_call({url: ConnectionError(url) for url in URLS})
+
+        with pytest.raises(ConnectionError):
+            pool.call(call)
+
+    def test_ejected_endpoint_returns_after_cooldown_if_healthy(self):
+        pool = StubPool(URLS, cooldown=0.05)
+        pool.eject("http://a")
+
+        assert [pool.acquire() for _ in range(3)] == ["http://b"] * 3
+
+        time.sleep(0.1)
+        pool.acquire()
+        assert pool.ejected_until["http://a"] == 0.0
+
+    def test_ejected_endpoint_stays_out_if_unhealthy(self):
+        pool = StubPool(URLS, cooldown=0.05)
+        pool.eject("http://a")
+        pool.healthy.discard("http://a")
+
+        time.sleep(0.1)
+        assert pool.acquire() == "http://b"
+        assert pool.ejected_until["http://a"] > time.time()
+
+
+class TestHedging:
+    def make_pool(self):
+        pool = StubPool(URLS, hedge_percentile=50)
+        pool.latencies.extend([0.01] * pool.min_latency_samples)
+        return pool
+
+    def test_no_hedging_without_enough_latency_samples(self):
+        pool = StubPool(URLS, hedge_percentile=50)
+
+        assert pool.get_hedge_delay() is None
+
+    def test_slow_request_is_hedged(self):
+        pool = self.make_pool()
+        release = threading.Event()
+        calls = []
+
+        # whichever endpoint gets the primary request, the hedged request to the other one returns immediately
+        def first_slow(url):
+            calls.append(url)
+            if len(calls) == 1:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        start = time.time()
+        assert pool.call(first_slow) == "fast"
+        assert time.time() - start < 1
+        assert len(set(calls)) == 2
+
+        release.set()
+
+    def test_hedge_prefers_success_when_both_finish(self):
+        pool = self.make_pool()
+
+        for _ in range(10):
+            # both requests finish at the same time, one of them fails
+            barrier = threading.Barrier(2)
+
+            def call(url):
+                barrier.wait(5)
+                if url == "http://a":
+                    raise ConnectionError("down")
+                return "ok"
+
+            assert pool.call_hedged(call) == "ok"
+            pool.ejected_until = {url: 0.0 for url in URLS}
+
+    def test_error_is_raised_if_both_requests_fail(self):
+        pool = self.make_pool()
+        barrier = threading.Barrier(2)
+
+        def call(url):
+            barrier.wait(5)
+            raise ConnectionError(url)
+
+        with pytest.raises(ConnectionError):
+            pool.call_hedged(call)
@@ -0,0 +1,211 @@
+import json
+import random
+
+import pytest
+
+from factgenie.datasets.basic import JSONDataset, JSONLDataset
+from factgenie.datasets.indexed import (
+    IndexedJSONFile,
+    IndexedJSONLFile,
+    LazyExamples,
+    build_array_index,
+    build_line_index,
+    load_index,
+)
+
+STRINGS = ["", "plain", "žluťoučký kůň", "日本語", "emoji 😀", 'quote " and \\ backslash', "line\nbreak", "]", ",", "["]
+NUMBERS = [0, -1, 7, 151, 123456789, 1.5, -0.25, 1e-7, 3.14e10, 2.5e-300]
+
+
+def random_value(rnd, depth=0):
+    kind = rnd.choice(["string", "number", "literal", "list", "dict"] if depth < 3 else ["string", "number"])
+
+    if kind == "string":
+        return rnd.choice(STRINGS)
+    if kind == "number":
+        return rnd.choice(NUMBERS)
+    if kind == "literal":
+        return rnd.choice([True, False, None])
+    if kind == "list":
+        return [random_value(rnd, depth + 1) for _ in range(rnd.randrange(4))]
+
+    return {rnd.choice(STRINGS): random_value(rnd, depth + 1) for _ in range(rnd.randrange(4))}
+
+
+def read_ranges(path, offsets):
+    data = path.read_bytes()
+    return [json.loads(data[start:end]) for start, end in offsets]
+
+
+class TestLineIndex:
+    def test_round_trip(self, tmp_path):
+        rnd = random.Random(0)
+        records = [random_value(rnd) for _ in range(50)]
+        path = tmp_path / "test.jsonl"
+        path.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records), encoding="utf-8")
+
+        assert read_ranges(path, build_line_index(path)) == records
+
+    def test_blank_lines_and_missing_final_newline(self, tmp_path):
+        path = tmp_path / "test.jsonl"
+        path.write_text('{"a": 1}\n\n{"a": "ž"}\r\n\n[1, 2]', encoding="utf-8")
+
+        expected = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line]
+
+        assert read_ranges(path, build_line_index(path)) == expected
+
+    def test_empty_file(self, tmp_path):
+        path = tmp_path / "test.jsonl"
+        path.write_text("")
+
+        assert len(build_line_index(path)) == 0
+
+
+class TestArrayIndex:
+    @pytest.mark.parametrize("indent", [None, 2])
+    def test_chunk_sizes(self, tmp_path, indent):
+        rnd = random.Random(indent)
+        elements = [random_value(rnd) for _ in range(30)] + NUMBERS + STRINGS
+        rnd.shuffle(elements)
+
+        path = tmp_path / "test.json"
+        path.write_text(json.dumps(elements, ensure_ascii=False, indent=indent), encoding="utf-8")
+
+        with open(path, encoding="utf-8") as f:
+            expected = json.load(f)
+
+        for chunk_size in range(1, 65):
+            assert read_ranges(path, build_array_index(path, chunk_size=chunk_size)) == expected, chunk_size
+
+    def test_whitespace(self, tmp_path):
+        path = tmp_path / "test.json"
+        path.write_text(' \n[ 1 ,\t"ž" ,\r\n{"a" : [ ]} , 2.5e3 ]\n ', encoding="utf-8")
+
+        for chunk_size in [1, 2, 3, 1024]:
+            assert read_ranges(path, build_array_index(path, chunk_size=chunk_size)) == [1, "ž", {"a": []}, 2.5e3]
+
+    def test_empty_array(self, tmp_path):
+        path = tmp_path / "test.json"
+        path.write_text(" [ ] ")
+
+        assert len(build_array_index(path)) == 0
+
+    @pytest.mark.parametrize("content", ['{"a": 1}', "[1, 2", "[1 2]", '[1, "a]', "", "1"])
+    def test_invalid(self, tmp_path, content):
+        path = tmp_path / "test.json"
+        path.write_text(content)
+
+        with pytest.raises(ValueError):
+            build_array_index(path, chunk_size=2)
+
+
+class TestIndexedFile:
+    def test_index_saved_and_invalidated(self, tmp_path):
+        path = tmp_path / "test.jsonl"
+        path.write_text('{"a": 1}\n{"a": 2}\n')
+
+        examples = IndexedJSONLFile(path)
+        assert [examples[i] for i in range(len(examples))] == [{"a": 1}, {"a": 2}]
+        assert load_index(path) is not None
+        examples.close()
+
+        path.write_text('{"a": 1}\n{"a": 2}\n{"a": 3}\n')
+
+        assert load_index(path) is None
+        assert len(IndexedJSONLFile(path)) == 3
+
+    def test_json_file(self, tmp_path):
+        path = tmp_path / "test.json"
+        path.write_text('[{"a": "ž"}, 151.5]', encoding="utf-8")
+
+        examples = IndexedJSONFile(path)
+
+        assert len(examples) == 2
+        assert examples[0] == {"a": "ž"}
+        assert examples[-1] == 151.5
+
+
+class ListSource:
+    def __init__(self, items):
+        self.items = items
+        self.closed = False
+
+    def is_current(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        return self.items[idx]
+
+
+class TestLazyExamples:
+    @pytest.fixture
+    def calls(self):
+        return []
+
+    @pytest.fixture
+    def examples(self, calls):
+        def postprocess(examples):
+            calls.extend(examples)
+            return [{"value": e} for e in examples]
+
+        return LazyExamples(ListSource(list(range(5))), postprocess, cache_size=2)
+
+    def test_access(self, examples):
+        assert len(examples) == 5
+        assert examples[1] == {"value": 1}
+        assert examples[-1] == {"value": 4}
+        assert examples[1:4] == [{"value": 1}, {"value": 2}, {"value": 3}]
+        assert [e["value"] for e in examples] == [0, 1, 2, 3, 4]
+
+    def test_out_of_range(self, examples):
+        with pytest.raises(IndexError):
+            examples[5]
+
+        with pytest.raises(IndexError):
+            examples[-6]
+
+    def test_cache(self, examples, calls):
+        examples[0]
+        examples[0]
+        assert calls == [0]
+
+        # 0 is the most recently used, 1 is evicted
+        examples[1]
+        examples[0]
+        examples[2]
+        assert list(examples.cache) == [0, 2]
+
+        examples[1]
+        assert calls == [0, 1, 2, 1]
+
+
+class TestLazyDataset:
+    def test_reopened_after_modification(self, tmp_path):
+        dataset = JSONLDataset("test-dataset", splits=["test"], lazy_loading=True)
+        dataset.data_path = tmp_path
+        (tmp_path / "test.jsonl").write_text('{"a": 1}\n{"a": 2}\n')
+
+        assert dataset.get_example("test", 1) == {"a": 2}
+        assert isinstance(dataset.examples["test"], LazyExamples)
+        version = dataset.get_split_version("test")
+
+        (tmp_path / "test.jsonl").write_text('{"a": 1}\n{"a": "changed"}\n{"a": 3}\n')
+
+        assert dataset.get_example("test", 1) == {"a": "changed"}
+        assert dataset.get_example_count("test") == 3
+        assert dataset.get_split_version("test") != version
+
+    def test_json_dict_loaded_without_index(self, tmp_path):
+        dataset = JSONDataset("test-dataset", splits=["test"], lazy_loading=True)
+        dataset.data_path = tmp_path
+        (tmp_path / "test.json").write_text('{"a": [1, 2]}')
+
+        dataset.get_example_count("test")
+
+        assert not isinstance(dataset.examples["test"], LazyExamples)
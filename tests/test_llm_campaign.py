@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import factgenie.campaign
+from factgenie.campaign import CampaignMode, ExampleStatus, LLMCampaignEval
+from factgenie.llm_campaign import (
+    MAX_RETRY_DELAY,
+    get_next_retry_time,
+    get_retry_delay,
+    lease_example_groups,
+    release_leases,
+    select_example_groups,
+)
+
+
+class SingleOutputModel:
+    def groups_outputs(self):
+        return False
+
+
+@pytest.fixture
+def campaign(tmp_path, monkeypatch):
+    monkeypatch.setattr(factgenie.campaign, "CAMPAIGN_DIR", tmp_path)
+    os.makedirs(tmp_path / "test-campaign" / "files")
+
+    with open(tmp_path / "test-campaign" / "metadata.json", "w") as f:
+        json.dump({"id": "test-campaign", "mode": CampaignMode.LLM_EVAL, "config": {}}, f)
+
+    db = pd.DataFrame(
+        {
+            "dataset": "ds",
+            "split": "test",
+            "example_idx": range(4),
+            "setup_id": "s1",
+            "annotator_id": "",
+            "annotator_group": 0,
+            "status": ExampleStatus.FREE,
+            "start": None,
+            "end": None,
+        }
+    )
+    db.to_csv(tmp_path / "test-campaign" / "db.csv", index=False)
+
+    return LLMCampaignEval("test-campaign")
+
+
+def lease(campaign, worker_id, lease_size=1, lease_time=600):
+    return lease_example_groups(campaign, CampaignMode.LLM_EVAL, SingleOutputModel(), worker_id, lease_size, lease_time)
+
+
+class TestLeases:
+    def test_workers_lease_different_examples(self, campaign):
+        assert lease(campaign, "w1", lease_size=2) == [[0], [1]]
+        assert lease(campaign, "w2", lease_size=2) == [[2], [3]]
+        assert lease(campaign, "w3", lease_size=2) == []
+
+    def test_lease_is_written_to_the_shared_db(self, campaign):
+        lease(campaign, "w1", lease_size=3)
+
+        # another worker with its own copy of the db
+        other = LLMCampaignEval("test-campaign")
+        assert list(other.db["lease_owner"].fillna("")) == ["w1", "w1", "w1", ""]
+
+    def test_expired_lease_is_leased_again(self, campaign):
+        assert lease(campaign, "w1", lease_size=4, lease_time=-1) == [[0], [1], [2], [3]]
+        assert lease(campaign, "w2", lease_size=1) == [[0]]
+
+    def test_released_examples_are_leased_again(self, campaign):
+        lease(campaign, "w1", lease_size=4)
+        release_leases(campaign, "w1")
+
+        assert lease(campaign, "w2", lease_size=4) == [[0], [1], [2], [3]]
+
+    def test_finished_examples_are_not_leased(self, campaign):
+        with campaign.locked_db() as db:
+            db.loc[[0, 2], "status"] = ExampleStatus.FINISHED
+
+        assert lease(campaign, "w1", lease_size=4) == [[1], [3]]
+
+    def test_failed_examples_are_leased_last(self, campaign):
+        lease(campaign, "w1", lease_size=1)
+
+        with campaign.locked_db() as db:
+            db.loc[0, "attempts"] = 1
+            db.loc[0, "lease_owner"] = ""
+
+        assert lease(campaign, "w2", lease_size=4) == [[1], [2], [3], [0]]
+
+    def test_threads_without_file_locks(self, campaign, monkeypatch):
+        monkeypatch.setattr(factgenie.campaign, "fcntl", None)
+        workers = [LLMCampaignEval("test-campaign") for _ in range(4)]
+        leased = []
+
+        for worker in workers:
+            load_db = worker.load_db
+
+            def slow_load_db(load_db=load_db):
+                # let the other threads interleave with the read-modify-write cycle
+                time.sleep(0.01)
+                load_db()
+
+            worker.load_db = slow_load_db
+
+        def run(i):
+            leased.extend(lease(workers[i], f"w{i}", lease_size=1))
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(leased) == [[0], [1], [2], [3]]
+
+    def test_select_all_groups_in_memory(self, campaign):
+        groups = select_example_groups(campaign.db, CampaignMode.LLM_EVAL, SingleOutputModel(), "w1", None, 600)
+
+        assert groups == [[0], [1], [2], [3]]
+        # the in-memory db of a single worker is not written when leasing
+        assert "lease_owner" not in pd.read_csv(campaign.db_path).columns
+
+    def test_single_worker_ignores_leases(self, campaign):
+        # leases left by a worker of a previous run which did not stop cleanly
+        lease(campaign, "dead-worker", lease_size=4)
+
+        groups = select_example_groups(campaign.db, CampaignMode.LLM_EVAL, SingleOutputModel(), None, None, 600)
+
+        assert groups == [[0], [1], [2], [3]]
+        assert set(campaign.db["lease_owner"]) == {"dead-worker"}
+
+
+class TestRetries:
+    def test_retry_delay_is_exponential(self):
+        assert [get_retry_delay({"retry_delay": 10}, attempts) for attempts in [1, 2, 3]] == [10, 20, 40]
+        assert get_retry_delay({}, 100) == MAX_RETRY_DELAY
+
+    def test_failed_example_is_not_leased_before_retry_after(self, campaign):
+        lease(campaign, "w1", lease_size=4)
+
+        retry_after = time.time() + 60
+        with campaign.locked_db() as db:
+            db.loc[0, "attempts"] = 1
+            db.loc[0, "retry_after"] = retry_after
+            db.loc[0, "lease_owner"] = ""
+            db.loc[[1, 2, 3], "status"] = ExampleStatus.FINISHED
+
+        assert lease(campaign, "w2", lease_size=4) == []
+        assert get_next_retry_time(campaign.db, "w2") == pytest.approx(retry_after)
+
+        with campaign.locked_db() as db:
+            db.loc[0, "retry_after"] = time.time() - 1
+
+        assert lease(campaign, "w2", lease_size=4) == [[0]]
+        assert get_next_retry_time(campaign.db, "w2") is None
+
+    def test_reset_failed_examples(self, campaign):
+        lease(campaign, "w1", lease_size=4)
+
+        with campaign.locked_db() as db:
+            db.loc[[0, 1], "status"] = ExampleStatus.FAILED
+            db.loc[[0, 1], "attempts"] = 3
+            db.loc[[0, 1], "retry_after"] = time.time() + 60
+
+        assert campaign.reset_failed_examples() == 2
+
+        db = LLMCampaignEval("test-campaign").db
+        assert (db["status"] == ExampleStatus.FREE).all()
+        assert (db["attempts"] == 0).all()
+        assert db["retry_after"].isna().all()